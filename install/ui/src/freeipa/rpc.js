@@ -32,6 +32,116 @@ define([
    ],
    function(lang, auth, IPA, text, util, rpc /*exports*/) {
 
+/**
+ * Cache of command responses which have an ETag
+ *
+ * Browsers do not revalidate responses to POST requests, the ETag of a
+ * response is therefore sent by `rpc.command` in the `If-None-Match` header
+ * of the same request and the cached response is used when the server
+ * answers with 304 Not Modified.
+ *
+ * Responses are kept in the session storage, so they survive reloads of
+ * the page. They are stored per URL, request data and browser languages,
+ * because the server sends the output of the commands, e.g.
+ * `json_metadata`, translated to the languages of the request.
+ *
+ * @class rpc.etag_cache
+ * @singleton
+ */
+rpc.etag_cache = {
+
+    /**
+     * Prefix of the storage keys
+     * @property {string}
+     */
+    prefix: 'ipa_etag:',
+
+    /**
+     * Get storage or null if it is not available
+     * @protected
+     * @return {Storage}
+     */
+    get_storage: function() {
+        try {
+            return window.sessionStorage || null;
+        } catch (e) {
+            // access to the storage may be denied
+            return null;
+        }
+    },
+
+    /**
+     * Get storage key of a request
+     * @protected
+     * @param {Object} request - AJAX request settings
+     * @return {string}
+     */
+    get_key: function(request) {
+        var languages = navigator.languages ||
+                [navigator.language || navigator.userLanguage];
+        return this.prefix + languages.join(',') + ':' + request.url + ':' +
+                request.data;
+    },
+
+    /**
+     * Get cached entry of a request
+     * @protected
+     * @param {Object} request - AJAX request settings
+     * @return {{etag:string,text:string}|null}
+     */
+    get_entry: function(request) {
+        var storage = this.get_storage();
+        if (!storage) return null;
+        var value = storage.getItem(this.get_key(request));
+        if (!value) return null;
+        try {
+            return JSON.parse(value);
+        } catch (e) {
+            return null;
+        }
+    },
+
+    /**
+     * Get ETag of cached response to a request
+     * @param {Object} request - AJAX request settings
+     * @return {string|null}
+     */
+    get_etag: function(request) {
+        var entry = this.get_entry(request);
+        return entry ? entry.etag : null;
+    },
+
+    /**
+     * Get cached response to a request
+     *
+     * The response is parsed again, so that handlers may modify it.
+     * @param {Object} request - AJAX request settings
+     * @return {Object|null}
+     */
+    get: function(request) {
+        var entry = this.get_entry(request);
+        return entry ? JSON.parse(entry.text) : null;
+    },
+
+    /**
+     * Store response to a request if it has an ETag
+     * @param {Object} request - AJAX request settings
+     * @param {XMLHttpRequest} xhr
+     */
+    set: function(request, xhr) {
+        var storage = this.get_storage();
+        var etag = xhr.getResponseHeader('ETag');
+        if (!storage || !etag) return;
+        var value = JSON.stringify({ etag: etag, text: xhr.responseText });
+        try {
+            storage.setItem(this.get_key(request), value);
+        } catch (e) {
+            // the storage is full, the response is requested again next
+            // time
+        }
+    }
+};
+
 /**
  * Call an IPA command over JSON-RPC.
  *
@@ -324,6 +434,13 @@ rpc.command = function(spec) {
 
         function success_handler(data, text_status, xhr) {
 
+            if (xhr.status === 304) {
+                // the cached response is still valid
+                data = rpc.etag_cache.get(that.request);
+            } else if (data && !data.error) {
+                rpc.etag_cache.set(that.request, xhr);
+            }
+
             if (!data) {
                 // error_handler() calls IPA.hide_activity_icon()
                 error_handler.call(this, xhr, text_status, /* error_thrown */ {
@@ -395,6 +512,11 @@ rpc.command = function(spec) {
             error: error_handler_login
         };
 
+        var etag = rpc.etag_cache.get_etag(that.request);
+        if (etag) {
+            that.request.headers = { 'If-None-Match': etag };
+        }
+
         IPA.display_activity_icon();
         $.ajax(that.request);
     };
@@ -54,6 +54,10 @@ capabilities = dict(
 
     # dns_name_values: dnsnames as objects
     dns_name_values=u'2.88',
+
+    # cert_find_cursor: cert_find returns the serial number to continue a
+    # truncated search from
+    cert_find_cursor=u'2.123',
 )
 
 
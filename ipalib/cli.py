@@ -49,6 +49,7 @@ from errors import (PublicError, CommandError, HelpError, InternalError,
                     NotConfiguredError, PromptFailed)
 from constants import CLI_TAB, LDAP_GENERALIZED_TIME_FORMAT
 from parameters import File, Str, Enum, Any, Flag
+from schema import SchemaCache
 from text import _
 from ipapython.version import API_VERSION
 from ipapython.dnsutil import DNSName
@@ -1331,11 +1332,28 @@ def run(api):
         (options, argv) = api.bootstrap_with_global_options(context='cli')
         for klass in cli_plugins:
             api.register(klass)
-        api.load_plugins()
+        schema_cache = None
+        command = None
+        if api.env.cli_schema and api.env.dot_ipa and argv:
+            schema_cache = SchemaCache(api)
+            command = schema_cache.get_command(from_cli(argv[0]))
+        if command is not None:
+            # Only the RPC client plugins are needed to forward a command
+            # built from the schema
+            api.register(command)
+            api.load_plugins(modules=('ipalib.plugins.rpcclient',))
+        else:
+            api.load_plugins()
         api.finalize()
         if not 'config_loaded' in api.env:
             raise NotConfiguredError()
-        sys.exit(api.Backend.cli.run(argv))
+        rv = api.Backend.cli.run(argv)
+        if schema_cache is not None and not schema_cache.is_current():
+            name = from_cli(argv[0])
+            if (name in api.Command and
+                    not isinstance(api.Command[name], frontend.Local)):
+                schema_cache.update()
+        sys.exit(rv)
     except KeyboardInterrupt:
         print ''
         api.log.info('operation aborted')
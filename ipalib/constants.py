@@ -137,12 +137,45 @@ DEFAULT_CONFIG = (
     # WebUI stuff:
     ('webui_prod', True),
 
+    # LDAP connection pool, see ipaserver.plugins.ldap2:
+
+    # Maximum number of idle bound connections kept per process, 0 disables
+    # pooling.
+    ('ldap_pool_size', 10),
+    # Seconds an idle connection is kept before it is unbound.
+    ('ldap_pool_idle_timeout', 60),
+
+    # Seconds the IPA configuration entry cached by ldap2 is used before it
+    # is checked with the server again, 0 disables the cache.
+    ('ldap_config_cache_ttl', 30),
+
+    # Maximum number of threads executing read-only methods of a parallel
+    # batch, 1 disables parallel execution.
+    ('batch_max_threads', 4),
+
+    # RPC responses at least this many bytes long are compressed when the
+    # client accepts it, 0 disables compression.
+    ('rpc_compress_threshold', 1024),
+
     # Session stuff:
 
     # Maximum time before a session expires forcing credentials to be reacquired.
     ('session_auth_duration', '20 minutes'),
     # How a session expiration is computed, see SessionManager.set_session_expiration_time()
     ('session_duration_type', 'inactivity_timeout'),
+    # Kerberos ccache type session credentials are bound to for a request,
+    # FILE or MEMORY, see ipalib.session.bind_ipa_ccache()
+    ('session_ccache_scheme', 'FILE'),
+    # Where session data is kept: 'memcache' for the ipa_memcached daemon
+    # or 'local' for a memory mapped file shared by the local processes
+    ('session_store', 'memcache'),
+    # Geometry of the 'local' session store, see
+    # ipalib.session.LocalSessionStore: number of slots, size of a slot in
+    # bytes, which limits the size of the data of a session, and number of
+    # slots a session can be stored in
+    ('session_store_slots', 4096),
+    ('session_store_slot_size', 16384),
+    ('session_store_probes', 8),
 
     # Debugging:
     ('verbose', 0),
@@ -161,6 +194,14 @@ DEFAULT_CONFIG = (
     ('ca_install_port', None),
     ('ca_agent_install_port', None),
     ('ca_ee_install_port', None),
+    # Maximum number of idle keep-alive connections to the CA kept per
+    # process by the RA backend, 0 disables pooling.
+    ('ra_pool_size', 4),
+    # Seconds an idle connection to the CA is kept before it is closed.
+    ('ra_pool_idle_timeout', 15),
+    # Seconds the CA masters found by the RA backend are cached, 0 disables
+    # the cache.
+    ('ra_master_cache_ttl', 300),
 
     # KRA plugin
     ('kra_host', FQDN),  # Set in Env._finalize_core()
@@ -170,6 +211,11 @@ DEFAULT_CONFIG = (
     ('interactive', True),
     ('fallback', True),
     ('delegate', False),
+    # Build commands from the cached server schema instead of loading all
+    # plugins, see ipalib.schema
+    ('cli_schema', False),
+    # Seconds before the cached schema is checked with the server again
+    ('cli_schema_ttl', 3600),
 
     # Enable certain optional plugins:
     ('enable_ra', False),
@@ -424,7 +424,26 @@ class Command(HasParam):
         """
         self.ensure_finalized()
         version_provided = 'version' in options
-        if version_provided:
+        (args, options) = self.prepare(*args, **options)
+        ret = self.run(*args, **options)
+        if (not version_provided and isinstance(ret, dict) and
+                self.api.env.in_server):
+            # add message only on server side
+            messages.add_message(
+                API_VERSION, ret,
+                messages.VersionMissing(server_version=API_VERSION))
+        self.process_output(ret, options['version'])
+        return ret
+
+    def prepare(self, *args, **options):
+        """
+        Validate the arguments and return the ``(args, options)`` to run the
+        command with.
+
+        The options include the default values and the API version.
+        """
+        self.ensure_finalized()
+        if 'version' in options:
             self.verify_client_version(unicode(options['version']))
         else:
             options['version'] = API_VERSION
@@ -439,23 +458,20 @@ class Command(HasParam):
             '%s(%s)', self.name, ', '.join(self._repr_iter(**params))
         )
         self.validate(**params)
-        (args, options) = self.params_2_args_options(**params)
-        ret = self.run(*args, **options)
-        if (not version_provided and isinstance(ret, dict) and
-                self.api.env.in_server):
-            # add message only on server side
-            messages.add_message(
-                API_VERSION, ret,
-                messages.VersionMissing(server_version=API_VERSION))
+        return self.params_2_args_options(**params)
+
+    def process_output(self, output, version=API_VERSION):
+        """
+        Add the default summary to the return value and validate it.
+        """
         if (
-            isinstance(ret, dict)
+            isinstance(output, dict)
             and 'summary' in self.output
-            and 'summary' not in ret
+            and 'summary' not in output
         ):
-            ret['summary'] = self.get_summary_default(ret)
-        if self.use_output_validation and (self.output or ret is not None):
-            self.validate_output(ret, options['version'])
-        return ret
+            output['summary'] = self.get_summary_default(output)
+        if self.use_output_validation and (self.output or output is not None):
+            self.validate_output(output, version)
 
     def soft_validate(self, values):
         errors = dict()
@@ -930,7 +946,8 @@ class Command(HasParam):
         expected_set = set(self.output)
         actual_set = set(output) - set(['messages'])
         if expected_set != actual_set:
-            missing = expected_set - actual_set
+            missing = set(o for o in expected_set - actual_set
+                          if 'optional' not in self.output[o].flags)
             if missing:
                 raise ValueError('%s: missing keys %r in %r' % (
                     nice, sorted(missing), output)
@@ -941,6 +958,8 @@ class Command(HasParam):
                     nice, sorted(extra), output)
                 )
         for o in self.output():
+            if o.name not in output:
+                continue
             value = output[o.name]
             if not (o.type is None or isinstance(value, o.type)):
                 raise TypeError('%s:\n  output[%r]: need %r; got %r: %r' % (
@@ -19,6 +19,7 @@
 import krbV
 import time
 import re
+import struct
 from ipapython.ipa_log_manager import *
 
 #-------------------------------------------------------------------------------
@@ -136,6 +137,181 @@ def krb5_format_time(timestamp):
     '''
     return time.strftime(krb5_time_fmt, time.localtime(timestamp))
 
+#-------------------------------------------------------------------------------
+
+# Version 4 of the FILE ccache format, see
+# http://web.mit.edu/kerberos/krb5-devel/doc/formats/ccache_file_format.html
+KRB5_FCC_FVNO_4 = 0x0504
+KRB5_NT_PRINCIPAL = 1
+
+_principal_escapes = (('\\', '\\\\'), ('/', '\\/'), ('@', '\\@'),
+                      ('\n', '\\n'), ('\t', '\\t'), ('\b', '\\b'),
+                      ('\0', '\\0'))
+_principal_unescapes = dict((escaped[1], char)
+                            for char, escaped in _principal_escapes)
+
+def krb5_format_principal(principal):
+    '''
+    Given a (name_type, realm, components) principal tuple return the
+    Kerberos V5 principal name, with special characters escaped.
+
+    :parameters:
+      principal
+        A principal tuple as returned by `krb5_parse_ccache_data()`
+    :returns:
+      Kerberos V5 principal name.
+    '''
+    name_type, realm, components = principal
+
+    def escape(value):
+        for char, escaped in _principal_escapes:
+            value = value.replace(char, escaped)
+        return value
+
+    return '%s@%s' % ('/'.join(escape(c) for c in components),
+                      realm.replace('\\', '\\\\').replace('@', '\\@'))
+
+def krb5_split_principal_name(name):
+    '''
+    Given a Kerberos V5 principal name return a two-tuple of its realm
+    and unescaped components. This is the inverse of
+    `krb5_format_principal()`.
+    '''
+    components = ['']
+    realm = None
+    i = 0
+    while i < len(name):
+        char = name[i]
+        if char == '\\':
+            escaped = name[i:i + 2]
+            char = _principal_unescapes.get(escaped, escaped[1:])
+            i += 1
+        elif realm is None and char == '@':
+            realm = ''
+            i += 1
+            continue
+        elif realm is None and char == '/':
+            components.append('')
+            i += 1
+            continue
+        if realm is None:
+            components[-1] += char
+        else:
+            realm += char
+        i += 1
+
+    return realm or '', tuple(components)
+
+def krb5_pack_ccache_cred(cred):
+    '''
+    Return a credential in the FILE ccache format.
+
+    :parameters:
+      cred
+        A credential tuple as returned by `krb5_parse_ccache_data()`
+    :returns:
+      str
+    '''
+    (client, server, keyblock, times, is_skey, ticket_flags, addrs,
+     ticket, second_ticket, authdata) = cred
+
+    def counted(data):
+        return struct.pack('>I', len(data)) + data
+
+    def principal(value):
+        name_type, realm, components = value
+        return (struct.pack('>II', name_type, len(components)) +
+                counted(realm) + ''.join(counted(c) for c in components))
+
+    def tagged(values):
+        return struct.pack('>I', len(values)) + ''.join(
+            struct.pack('>H', tag) + counted(data) for tag, data in values)
+
+    return ''.join((
+        principal(client),
+        principal(server),
+        struct.pack('>H', keyblock[0]), counted(keyblock[1]),
+        struct.pack('>IIIIBI', *[t & 0xffffffff for t in times] +
+                    [is_skey, ticket_flags & 0xffffffff]),
+        tagged(addrs),
+        tagged(authdata),
+        counted(ticket),
+        counted(second_ticket),
+    ))
+
+def krb5_parse_ccache_data(data):
+    '''
+    Parse the contents of a version 4 FILE ccache.
+
+    Principals are returned as (name_type, realm, components) tuples.
+    Credentials are returned as tuples laid out like krbV credentials
+    tuples: (client, server, (enctype, contents), (authtime, starttime,
+    endtime, renew_till), is_skey, ticket_flags, addrs, ticket,
+    second_ticket, authdata), where addrs and authdata are tuples of
+    (type, contents).
+
+    :parameters:
+      data
+        The ccache file contents.
+    :returns:
+      A three-tuple of (header, principal, creds). header is the raw
+      file header including the default principal, creds is a list of
+      (cred, raw cred data) two-tuples.
+    '''
+    offset = [0]
+
+    def read(fmt):
+        size = struct.calcsize(fmt)
+        if offset[0] + size > len(data):
+            raise ValueError('truncated ccache data')
+        values = struct.unpack_from(fmt, data, offset[0])
+        offset[0] += size
+        return values
+
+    def counted():
+        length, = read('>I')
+        if offset[0] + length > len(data):
+            raise ValueError('truncated ccache data')
+        value = data[offset[0]:offset[0] + length]
+        offset[0] += length
+        return value
+
+    def principal():
+        name_type, count = read('>II')
+        realm = counted()
+        return (name_type, realm, tuple(counted() for i in xrange(count)))
+
+    def tagged():
+        count, = read('>I')
+        return tuple((read('>H')[0], counted()) for i in xrange(count))
+
+    version, header_length = read('>HH')
+    if version != KRB5_FCC_FVNO_4:
+        raise ValueError('unsupported ccache version 0x%04x' % version)
+    offset[0] += header_length
+    default_principal = principal()
+    header = data[:offset[0]]
+
+    creds = []
+    while offset[0] < len(data):
+        start = offset[0]
+        client = principal()
+        server = principal()
+        enctype, = read('>H')
+        keyblock = (enctype, counted())
+        values = read('>IIIIBI')
+        addrs = tagged()
+        authdata = tagged()
+        ticket = counted()
+        second_ticket = counted()
+        cred = (client, server, keyblock, values[:4], values[4], values[5],
+                addrs, ticket, second_ticket, authdata)
+        creds.append((cred, data[start:offset[0]]))
+
+    return header, default_principal, creds
+
+#-------------------------------------------------------------------------------
+
 class KRB5_CCache(object):
     '''
     Kerberos stores a TGT (Ticket Granting Ticket) and the service
@@ -625,10 +625,13 @@ class API(DictProxy):
         self.bootstrap(parser, **overrides)
         return (options, args)
 
-    def load_plugins(self):
+    def load_plugins(self, modules=None):
         """
         Load plugins from all standard locations.
 
+        If ``modules`` is given, only the plugin modules it names are
+        imported.
+
         `API.bootstrap` will automatically be called if it hasn't been
         already.
         """
@@ -636,6 +639,11 @@ class API(DictProxy):
         self.__do_if_not_done('bootstrap')
         if self.env.mode in ('dummy', 'unit_test'):
             return
+        if modules is not None:
+            for fullname in modules:
+                self.log.debug('importing plugin module %r', fullname)
+                __import__(fullname)
+            return
         for package in self.packages:
             self.import_plugins(package)
 
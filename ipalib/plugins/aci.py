@@ -117,6 +117,8 @@ must include all existing attributes as well. When doing an aci-mod the
 targetattr REPLACES the current attributes, it does not add to them.
 
 """
+import collections
+import threading
 from copy import deepcopy
 
 from ipalib import api, crud, errors
@@ -400,6 +402,172 @@ def _find_aci_by_name(acis, aciprefix, aciname):
             return a
     raise errors.NotFound(reason=_('ACI with name "%s" not found') % aciname)
 
+_empty = frozenset()
+
+
+class ACIIndex(object):
+    """
+    The ACIs parsed from the aci values of an entry, indexed by what
+    aci_find searches them on.
+
+    ``acis`` holds the ACIs which could be parsed, in the order of the
+    values, and ``acistrs`` their values.  Each index maps a key to the set
+    of the positions of the ACIs having it, see `lookup`.
+    """
+
+    indexes = ('name', 'aciname', 'aciprefix', 'attr', 'permission',
+               'bindrule', 'group', 'targetfilter', 'target', 'subtree',
+               'targetgroup')
+
+    def __init__(self, acistrs):
+        self.acis = []
+        self.acistrs = []
+        for acistr in acistrs:
+            try:
+                self.acis.append(ACI(acistr))
+            except SyntaxError, e:
+                root_logger.warning("Failed to parse: %s" % acistr)
+                continue
+            self.acistrs.append(acistr)
+        self.names = [a.name.lower() for a in self.acis]
+
+        self._index = dict((index, {}) for index in self.indexes)
+        group_container_dn = DN(api.env.container_group, api.env.basedn)
+        for (i, a) in enumerate(self.acis):
+            (prefix, name) = _parse_aci_name(a.name)
+            self._add('name', a.name.lower(), i)
+            self._add('aciname', name, i)
+            self._add('aciprefix', prefix, i)
+            for permission in a.permissions:
+                self._add('permission', permission, i)
+
+            if 'expression' in a.bindrule:
+                bindrule = a.bindrule['expression']
+                self._add('bindrule', bindrule, i)
+                try:
+                    groupdn = DN(bindrule.replace('ldap:///', ''))
+                    self._add('group', groupdn[0]['cn'], i)
+                except (ValueError, IndexError, KeyError):
+                    pass
+
+            if 'targetattr' in a.target:
+                for attr in a.target['targetattr']['expression']:
+                    self._add('attr', attr.lower(), i)
+            if 'targetfilter' in a.target:
+                self._add('targetfilter',
+                          a.target['targetfilter']['expression'], i)
+            if 'target' in a.target:
+                target = a.target['target']['expression']
+                self._add('target', target, i)
+                self._add('subtree', target.lower(), i)
+                try:
+                    targetdn = DN(target.replace('ldap:///', ''))
+                    if targetdn.endswith(group_container_dn):
+                        self._add('targetgroup', targetdn[0]['cn'], i)
+                except (ValueError, IndexError, KeyError):
+                    pass
+
+    def _add(self, index, key, position):
+        self._index[index].setdefault(key, set()).add(position)
+
+    def lookup(self, index, key):
+        """
+        Return the positions of the ACIs with ``key`` in ``index``.
+        """
+        return self._index[index].get(key, _empty)
+
+    def search(self, term):
+        """
+        Return the positions of the ACIs whose name contains ``term``,
+        ignoring case. Of equal ACIs only the first one is returned.
+        """
+        term = term.lower()
+        positions = set()
+        listed = {}
+        for (i, name) in enumerate(self.names):
+            if name.find(term) == -1:
+                continue
+            # equal ACIs, which have the same name, are listed once
+            if any(self.acis[j].isequal(self.acis[i])
+                   for j in listed.get(name, ())):
+                continue
+            listed.setdefault(name, []).append(i)
+            positions.add(i)
+        return positions
+
+    def find(self, name):
+        """
+        Return the position of the first ACI named ``name``, ignoring case,
+        or None.
+        """
+        positions = self.lookup('name', name.lower())
+        if not positions:
+            return None
+        return min(positions)
+
+
+class ACICache(object):
+    """
+    Process-wide cache of the `ACIIndex` of entries, by DN.
+
+    An index is used again as long as the aci values of the entry are the
+    same, they are compared rather than a modification time of the entry
+    as principals may be allowed to read different values.  Only the
+    indexes of the ``max_size`` most recently used entries are kept.
+    """
+
+    max_size = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = collections.OrderedDict()
+
+    def get(self, entry):
+        """
+        Return the `ACIIndex` of the aci values of ``entry``.
+        """
+        acistrs = tuple(entry.get('aci', ()))
+        with self._lock:
+            cached = self._indexes.pop(entry.dn, None)
+            if cached is not None and cached[0] == acistrs:
+                self._indexes[entry.dn] = cached
+                return cached[1]
+
+        index = ACIIndex(acistrs)
+        with self._lock:
+            self._indexes.pop(entry.dn, None)
+            self._indexes[entry.dn] = (acistrs, index)
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+aci_cache = ACICache()
+
+
+def _get_aci_entry(ldap, dn):
+    """
+    Return the entry at ``dn`` with its aci values, and their `ACIIndex`.
+    """
+    entry = ldap.get_entry(dn, ['aci'])
+    return (entry, aci_cache.get(entry))
+
+
+def _find_aci_in_index(index, aciprefix, aciname):
+    """
+    Like `_find_aci_by_name`, but return the position of the ACI in the
+    `ACIIndex` ``index``.
+    """
+    i = index.find(_make_aci_name(aciprefix, aciname))
+    if i is None:
+        raise errors.NotFound(
+            reason=_('ACI with name "%s" not found') % aciname)
+    return i
+
 
 def validate_permissions(ugettext, perm):
     perm = perm.strip().lower()
@@ -537,10 +705,11 @@ class aci_add(crud.Create):
 
         newaci = _make_aci(ldap, None, aciname, kw)
 
-        entry = ldap.get_entry(self.api.env.basedn, ['aci'])
+        (entry, index) = _get_aci_entry(ldap, self.api.env.basedn)
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        for a in acis:
+        # equal ACIs have the same name, ignoring case
+        for i in index.lookup('name', newaci.name.lower()):
+            a = index.acis[i]
             # FIXME: add check for permission_group = permission_group
             if a.isequal(newaci) or newaci.name == a.name:
                 raise errors.DuplicateEntry()
@@ -581,16 +750,11 @@ class aci_del(crud.Delete):
         """
         ldap = self.api.Backend.ldap2
 
-        entry = ldap.get_entry(self.api.env.basedn, ['aci'])
+        (entry, index) = _get_aci_entry(ldap, self.api.env.basedn)
 
         acistrs = entry.get('aci', [])
-        acis = _convert_strings_to_acis(acistrs)
-        aci = _find_aci_by_name(acis, aciprefix, aciname)
-        for a in acistrs:
-            candidate = ACI(a)
-            if aci.isequal(candidate):
-                acistrs.remove(a)
-                break
+        i = _find_aci_in_index(index, aciprefix, aciname)
+        acistrs.remove(index.acistrs[i])
 
         entry['aci'] = acistrs
 
@@ -624,10 +788,9 @@ class aci_mod(crud.Update):
         aciprefix = kw['aciprefix']
         ldap = self.api.Backend.ldap2
 
-        entry = ldap.get_entry(self.api.env.basedn, ['aci'])
+        (entry, index) = _get_aci_entry(ldap, self.api.env.basedn)
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        aci = _find_aci_by_name(acis, aciprefix, aciname)
+        aci = index.acis[_find_aci_in_index(index, aciprefix, aciname)]
 
         # The strategy here is to convert the ACI we're updating back into
         # a series of keywords. Then we replace any keywords that have been
@@ -700,46 +863,24 @@ class aci_find(crud.Search):
     def execute(self, term, **kw):
         ldap = self.api.Backend.ldap2
 
-        entry = ldap.get_entry(self.api.env.basedn, ['aci'])
-
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        results = []
+        (entry, index) = _get_aci_entry(ldap, self.api.env.basedn)
+        acis = index.acis
 
+        # The ACIs are selected by their positions in the index
         if term:
-            term = term.lower()
-            for a in acis:
-                if a.name.lower().find(term) != -1 and a not in results:
-                    results.append(a)
-            acis = list(results)
+            positions = index.search(term)
         else:
-            results = list(acis)
+            positions = set(xrange(len(acis)))
 
         if kw.get('aciname'):
-            for a in acis:
-                prefix, name = _parse_aci_name(a.name)
-                if name != kw['aciname']:
-                    results.remove(a)
-            acis = list(results)
+            positions &= index.lookup('aciname', kw['aciname'])
 
         if kw.get('aciprefix'):
-            for a in acis:
-                prefix, name = _parse_aci_name(a.name)
-                if prefix != kw['aciprefix']:
-                    results.remove(a)
-            acis = list(results)
+            positions &= index.lookup('aciprefix', kw['aciprefix'])
 
         if kw.get('attrs'):
-            for a in acis:
-                if not 'targetattr' in a.target:
-                    results.remove(a)
-                    continue
-                alist1 = sorted(
-                    [t.lower() for t in a.target['targetattr']['expression']]
-                )
-                alist2 = sorted([t.lower() for t in kw['attrs']])
-                if len(set(alist1) & set(alist2)) != len(alist2):
-                    results.remove(a)
-            acis = list(results)
+            for attr in set(t.lower() for t in kw['attrs']):
+                positions &= index.lookup('attr', attr)
 
         if kw.get('permission'):
             try:
@@ -749,19 +890,12 @@ class aci_find(crud.Search):
             except errors.NotFound:
                 pass
             else:
-                for a in acis:
-                    uri = 'ldap:///%s' % entry.dn
-                    if a.bindrule['expression'] != uri:
-                        results.remove(a)
-                acis = list(results)
+                uri = 'ldap:///%s' % entry.dn
+                positions &= index.lookup('bindrule', uri)
 
         if kw.get('permissions'):
-            for a in acis:
-                alist1 = sorted(a.permissions)
-                alist2 = sorted(kw['permissions'])
-                if len(set(alist1) & set(alist2)) != len(alist2):
-                    results.remove(a)
-            acis = list(results)
+            for permission in set(kw['permissions']):
+                positions &= index.lookup('permission', permission)
 
         if kw.get('memberof'):
             try:
@@ -770,95 +904,29 @@ class aci_find(crud.Search):
                 pass
             else:
                 memberof_filter = '(memberOf=%s)' % dn
-                for a in acis:
-                    if 'targetfilter' in a.target:
-                        targetfilter = a.target['targetfilter']['expression']
-                        if targetfilter != memberof_filter:
-                            results.remove(a)
-                    else:
-                        results.remove(a)
+                positions &= index.lookup('targetfilter', memberof_filter)
 
         if kw.get('type'):
-            for a in acis:
-                if 'target' in a.target:
-                    target = a.target['target']['expression']
-                else:
-                    results.remove(a)
-                    continue
-                found = False
-                for k in _type_map.keys():
-                    if _type_map[k] == target and kw['type'] == k:
-                        found = True
-                        break;
-                if not found:
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            positions &= index.lookup('target', _type_map[kw['type']])
 
         if kw.get('selfaci', False) is True:
-            for a in acis:
-                if a.bindrule['expression'] != u'ldap:///self':
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            positions &= index.lookup('bindrule', u'ldap:///self')
 
         if kw.get('group'):
-            for a in acis:
-                groupdn = a.bindrule['expression']
-                groupdn = DN(groupdn.replace('ldap:///',''))
-                try:
-                    cn = groupdn[0]['cn']
-                except (IndexError, KeyError):
-                    cn = None
-                if cn is None or cn != kw['group']:
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            positions &= index.lookup('group', kw['group'])
 
         if kw.get('targetgroup'):
-            for a in acis:
-                found = False
-                if 'target' in a.target:
-                    target = a.target['target']['expression']
-                    targetdn = DN(target.replace('ldap:///',''))
-                    group_container_dn = DN(api.env.container_group, api.env.basedn)
-                    if targetdn.endswith(group_container_dn):
-                        try:
-                            cn = targetdn[0]['cn']
-                        except (IndexError, KeyError):
-                            cn = None
-                        if cn == kw['targetgroup']:
-                            found = True
-                if not found:
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            positions &= index.lookup('targetgroup', kw['targetgroup'])
 
         if kw.get('filter'):
             if not kw['filter'].startswith('('):
                 kw['filter'] = unicode('('+kw['filter']+')')
-            for a in acis:
-                if 'targetfilter' not in a.target or\
-                    not a.target['targetfilter']['expression'] or\
-                    a.target['targetfilter']['expression'] != kw['filter']:
-                    results.remove(a)
+            positions &= index.lookup('targetfilter', kw['filter'])
 
         if kw.get('subtree'):
-            for a in acis:
-                if 'target' in a.target:
-                    target = a.target['target']['expression']
-                else:
-                    results.remove(a)
-                    continue
-                if kw['subtree'].lower() != target.lower():
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            positions &= index.lookup('subtree', kw['subtree'].lower())
+
+        results = [acis[i] for i in sorted(positions)]
 
         acis = []
         for result in results:
@@ -908,11 +976,9 @@ class aci_show(crud.Retrieve):
         ldap = self.api.Backend.ldap2
 
         dn = kw.get('location', self.api.env.basedn)
-        entry = ldap.get_entry(dn, ['aci'])
-
-        acis = _convert_strings_to_acis(entry.get('aci', []))
+        (entry, index) = _get_aci_entry(ldap, dn)
 
-        aci = _find_aci_by_name(acis, kw['aciprefix'], aciname)
+        aci = index.acis[_find_aci_in_index(index, kw['aciprefix'], aciname)]
         if kw.get('raw', False):
             result = dict(aci=unicode(aci))
         else:
@@ -947,15 +1013,13 @@ class aci_rename(crud.Update):
     def execute(self, aciname, **kw):
         ldap = self.api.Backend.ldap2
 
-        entry = ldap.get_entry(self.api.env.basedn, ['aci'])
+        (entry, index) = _get_aci_entry(ldap, self.api.env.basedn)
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        aci = _find_aci_by_name(acis, kw['aciprefix'], aciname)
+        aci = index.acis[_find_aci_in_index(index, kw['aciprefix'], aciname)]
 
-        for a in acis:
-            prefix, name = _parse_aci_name(a.name)
-            if _make_aci_name(prefix, kw['newname']) == a.name:
-                raise errors.DuplicateEntry()
+        # an ACI of any prefix must not have the new name already
+        if index.lookup('aciname', kw['newname']):
+            raise errors.DuplicateEntry()
 
         # The strategy here is to convert the ACI we're updating back into
         # a series of keywords. Then we replace any keywords that have been
@@ -528,6 +528,8 @@ class automember_find(LDAPSearch):
     Search for automember rules.
     """)
     takes_options = group_type
+    # without the offset and limit options the result is never paged
+    has_output = output.standard_list_of_entries
     has_output_params = LDAPSearch.has_output_params + automember_rule + regex_attrs
 
     msg_summary = ngettext(
@@ -259,6 +259,37 @@ def entry_to_dict(entry, **options):
         result['dn'] = entry.dn
     return result
 
+_MEMBER_DN_SPECIAL = ('\\', '+', '"', ';', ' ,', ', ', ' =', '= ')
+
+# number of entries whose indirect members or memberships are resolved by a
+# single search
+_INDIRECT_MEMBERS_BATCH_SIZE = 100
+
+def _split_member_dn(value):
+    """
+    Split a raw DN attribute value into its first RDN attribute name, first
+    RDN value and the remaining parent DN, without building a DN object.
+
+    Attribute names and the parent DN are lower-cased. None is returned for
+    values which can't be compared as plain strings (escaped characters,
+    multi-valued RDNs, extra whitespace or non-ASCII parent DN), these must
+    be parsed as DN.
+    """
+    if value != value.strip():
+        return None
+    for c in _MEMBER_DN_SPECIAL:
+        if c in value:
+            return None
+    rdn, sep, parent = value.partition(',')
+    attr, sep, rdn_value = rdn.partition('=')
+    if not sep or not rdn_value or rdn_value.startswith('#'):
+        return None
+    try:
+        parent.decode('ascii')
+    except UnicodeDecodeError:
+        return None
+    return attr.lower(), rdn_value, parent.lower()
+
 def pkey_to_unicode(key):
     if key is None:
         key = []
@@ -533,6 +564,11 @@ class LDAPObject(Object):
     search_attributes_config = None
     default_attributes = []
     search_display_attributes = [] # attributes displayed in LDAPSearch
+    # Container whose entries are indexed for server side sorting by primary
+    # key and paging of LDAPSearch without criteria, see the vlvSearch
+    # entries in indices.ldif. The search post callbacks must not add or
+    # remove entries, as they only see the entries of the page.
+    vlv_container_dn = None
     hidden_attributes = ['objectclass', 'aci']
     # set rdn_attribute only if RDN attribute differs from primary key!
     rdn_attribute = ''
@@ -643,86 +679,178 @@ class LDAPObject(Object):
             del entry_attrs[attr]
 
             for member in value:
-                memberdn = DN(member)
+                # Most member values can be matched against the containers
+                # as plain strings, a DN object is only built for the rest.
+                split_member = _split_member_dn(member)
+                memberdn = None
                 for ldap_obj_name in self.attribute_members[attr]:
                     ldap_obj = self.api.Object[ldap_obj_name]
                     try:
-                        container_dn = container_dns[ldap_obj_name]
+                        container_dn, container_str = (
+                            container_dns[ldap_obj_name])
                     except KeyError:
                         container_dn = DN(ldap_obj.container_dn, api.env.basedn)
-                        container_dns[ldap_obj_name] = container_dn
-
-                    if memberdn.endswith(container_dn):
+                        container_str = str(container_dn).lower()
+                        container_dns[ldap_obj_name] = (
+                            container_dn, container_str)
+
+                    if split_member is not None:
+                        rdn_attr, rdn_value, parent_str = split_member
+                        if (parent_str != container_str and
+                                not parent_str.endswith(',' + container_str)):
+                            continue
+                        if (not ldap_obj.rdn_attribute and
+                                parent_str == container_str and
+                                rdn_attr == ldap_obj.primary_key.name.lower()):
+                            new_value = rdn_value.decode('utf-8')
+                        else:
+                            new_value = ldap_obj.get_primary_key_from_dn(
+                                DN(member))
+                    else:
+                        if memberdn is None:
+                            memberdn = DN(member)
+                        if not memberdn.endswith(container_dn):
+                            continue
                         new_value = ldap_obj.get_primary_key_from_dn(memberdn)
-                        new_attr_name = '%s_%s' % (attr, ldap_obj.name)
-                        try:
-                            new_attr = new_attrs[new_attr_name]
-                        except KeyError:
-                            new_attr = entry_attrs.setdefault(new_attr_name, [])
-                            new_attrs[new_attr_name] = new_attr
-                        new_attr.append(new_value)
-                        break
+
+                    new_attr_name = '%s_%s' % (attr, ldap_obj.name)
+                    try:
+                        new_attr = new_attrs[new_attr_name]
+                    except KeyError:
+                        new_attr = entry_attrs.setdefault(new_attr_name, [])
+                        new_attrs[new_attr_name] = new_attr
+                    new_attr.append(new_value)
+                    break
 
     def get_indirect_members(self, entry_attrs, attrs_list):
+        self.get_entries_indirect_members([entry_attrs], attrs_list)
+
+    def get_entries_indirect_members(self, entries, attrs_list):
+        """
+        Get indirect members and memberships of all entries at once, using
+        a number of searches which does not grow with every entry.
+        """
+        if not entries:
+            return
         if 'memberindirect' in attrs_list:
-            self.get_memberindirect(entry_attrs)
+            self.get_entries_memberindirect(entries)
         if 'memberofindirect' in attrs_list:
-            self.get_memberofindirect(entry_attrs)
+            self.get_entries_memberofindirect(entries)
 
     def get_memberindirect(self, group_entry):
         """
         Get indirect members
         """
+        self.get_entries_memberindirect([group_entry])
 
-        mo_filter = self.backend.make_filter({'memberof': group_entry.dn})
-        filter = self.backend.combine_filters(
-            ('(member=*)', mo_filter), self.backend.MATCH_ALL)
-        try:
-            result, truncated = self.backend.find_entries(
-                base_dn=self.api.env.basedn,
-                filter=filter,
-                attrs_list=['member'],
-                size_limit=-1, # paged search will get everything anyway
-                paged_search=True)
-            if truncated:
-                raise errors.LimitsExceeded()
-        except errors.NotFound:
-            result = []
+    def get_entries_memberindirect(self, group_entries):
+        """
+        Get indirect members of multiple groups
+        """
+        for i in xrange(0, len(group_entries), _INDIRECT_MEMBERS_BATCH_SIZE):
+            batch = group_entries[i:i + _INDIRECT_MEMBERS_BATCH_SIZE]
+            indirect = dict((e.dn, set()) for e in batch)
+
+            mo_filter = self.backend.make_filter(
+                {'memberof': [e.dn for e in batch]}, rules=self.backend.MATCH_ANY)
+            filter = self.backend.combine_filters(
+                ('(member=*)', mo_filter), self.backend.MATCH_ALL)
+
+            for entry in self.backend.iter_entries(
+                    base_dn=self.api.env.basedn,
+                    filter=filter,
+                    attrs_list=['member', 'memberof'],
+                    size_limit=-1, # paged search will get everything anyway
+                    paged_search=True):
+                members = entry.raw.get('member', [])
+                for memberof in entry.raw.get('memberof', []):
+                    group_indirect = indirect.get(DN(memberof))
+                    if group_indirect is not None:
+                        group_indirect.update(members)
+
+            for group_entry in batch:
+                group_indirect = indirect[group_entry.dn]
+                group_indirect.difference_update(
+                    group_entry.raw.get('member', []))
+                if group_indirect:
+                    group_entry.raw['memberindirect'] = list(group_indirect)
 
-        indirect = set()
-        for entry in result:
-            indirect.update(entry.raw.get('member', []))
-        indirect.difference_update(group_entry.raw.get('member', []))
+    def get_memberofindirect(self, entry):
+        self.get_entries_memberofindirect([entry])
 
-        if indirect:
-            group_entry.raw['memberindirect'] = list(indirect)
+    def get_entries_memberofindirect(self, entries):
+        """
+        Split memberof of multiple entries to direct and indirect memberships
+        """
+        # groups which have at least one of the entries as a direct member
+        parents = set()
+        for i in xrange(0, len(entries), _INDIRECT_MEMBERS_BATCH_SIZE):
+            dns = [e.dn for e in entries[i:i + _INDIRECT_MEMBERS_BATCH_SIZE]]
+            filter = self.backend.make_filter(
+                {'member': dns, 'memberuser': dns, 'memberhost': dns})
+            for group_entry in self.backend.iter_entries(
+                    base_dn=self.api.env.basedn,
+                    filter=filter,
+                    attrs_list=[''],
+                    size_limit=-1,
+                    paged_search=True):
+                parents.add(str(group_entry.dn))
+
+        # a group found above is a direct parent of an entry which is its
+        # member, unless more of the entries are its members, in which case
+        # its member values must be checked
+        candidates = {}
+        for entry in entries:
+            for group_dn in entry.raw.get('memberof', []):
+                if group_dn in parents:
+                    candidates.setdefault(group_dn, set()).add(entry.dn)
+        direct_members = {}
+        for group_dn, dns in candidates.iteritems():
+            if len(dns) > 1:
+                direct_members[group_dn] = self._get_direct_members(
+                    group_dn, dns)
+
+        for entry in entries:
+            direct = set()
+            indirect = set(entry.raw.get('memberof', []))
+            for group_dn in list(indirect):
+                if group_dn not in parents:
+                    continue
+                members = direct_members.get(group_dn)
+                if members is None or entry.dn in members:
+                    indirect.remove(group_dn)
+                    direct.add(group_dn)
 
-    def get_memberofindirect(self, entry):
+            entry.raw['memberof'] = list(direct)
+            if indirect:
+                entry.raw['memberofindirect'] = list(indirect)
 
-        dn = entry.dn
-        filter = self.backend.make_filter(
-            {'member': dn, 'memberuser': dn, 'memberhost': dn})
+    def _get_direct_members(self, group_dn, dns):
+        """
+        Return the DNs from dns which are direct members of group_dn.
+        """
+        member_attrs = ['member', 'memberuser', 'memberhost']
         try:
-            result, truncated = self.backend.find_entries(
-                base_dn=self.api.env.basedn,
-                filter=filter,
-                attrs_list=[''])
-            if truncated:
-                raise errors.LimitsExceeded()
+            group_entry = self.backend.get_entry(DN(group_dn), member_attrs)
         except errors.NotFound:
-            result = []
-
-        direct = set()
-        indirect = set(entry.raw.get('memberof', []))
-        for group_entry in result:
-            dn = str(group_entry.dn)
-            if dn in indirect:
-                indirect.remove(dn)
-                direct.add(dn)
-
-        entry.raw['memberof'] = list(direct)
-        if indirect:
-            entry.raw['memberofindirect'] = list(indirect)
+            return set()
+
+        keys = dict((str(dn).lower(), dn) for dn in dns)
+        members = set()
+        for attr in member_attrs:
+            for value in group_entry.raw.get(attr, []):
+                dn = keys.get(value.lower())
+                if dn is None and '\\' in value:
+                    # escaping may differ, compare the parsed DN
+                    try:
+                        dn = DN(value)
+                    except ValueError:
+                        continue
+                    if dn not in dns:
+                        continue
+                if dn is not None:
+                    members.add(dn)
+        return members
 
     def get_password_attributes(self, ldap, dn, entry_attrs):
         """
@@ -1710,6 +1838,33 @@ class LDAPModMember(LDAPQuery):
                         failed[attr][ldap_obj_name].append((name, unicode(e)))
         return (dns, failed)
 
+    def _get_attr_member_dns(self, objs):
+        """
+        Merge the member DNs of all object types of a member attribute into
+        a single list, so that they can be modified in bulk.
+
+        Return the list and a dict mapping each DN to its object type.
+        """
+        m_dns = []
+        obj_names = {}
+        for ldap_obj_name, obj_dns in objs.iteritems():
+            for m_dn in obj_dns:
+                assert isinstance(m_dn, DN)
+                if not m_dn:
+                    continue
+                m_dns.append(m_dn)
+                obj_names[m_dn] = ldap_obj_name
+        return (m_dns, obj_names)
+
+    def _add_failed_members(self, failed, obj_names, member_failed):
+        for m_dn, e in member_failed:
+            ldap_obj_name = obj_names[m_dn]
+            ldap_obj = self.api.Object[ldap_obj_name]
+            failed[ldap_obj_name].append((
+                ldap_obj.get_primary_key_from_dn(m_dn),
+                unicode(e),)
+            )
+
 
 class LDAPAddMember(LDAPModMember):
     """
@@ -1747,21 +1902,11 @@ class LDAPAddMember(LDAPModMember):
 
         completed = 0
         for (attr, objs) in member_dns.iteritems():
-            for ldap_obj_name in objs:
-                for m_dn in member_dns[attr][ldap_obj_name]:
-                    assert isinstance(m_dn, DN)
-                    if not m_dn:
-                        continue
-                    try:
-                        ldap.add_entry_to_group(m_dn, dn, attr, allow_same=self.allow_same)
-                    except errors.PublicError, e:
-                        ldap_obj = self.api.Object[ldap_obj_name]
-                        failed[attr][ldap_obj_name].append((
-                            ldap_obj.get_primary_key_from_dn(m_dn),
-                            unicode(e),)
-                        )
-                    else:
-                        completed += 1
+            m_dns, obj_names = self._get_attr_member_dns(objs)
+            add_failed = ldap.add_entries_to_group(
+                m_dns, dn, attr, allow_same=self.allow_same)
+            self._add_failed_members(failed[attr], obj_names, add_failed)
+            completed += len(m_dns) - len(add_failed)
 
         if options.get('all', False):
             attrs_list = ['*'] + self.obj.default_attributes
@@ -1848,21 +1993,10 @@ class LDAPRemoveMember(LDAPModMember):
 
         completed = 0
         for (attr, objs) in member_dns.iteritems():
-            for ldap_obj_name, m_dns in objs.iteritems():
-                for m_dn in m_dns:
-                    assert isinstance(m_dn, DN)
-                    if not m_dn:
-                        continue
-                    try:
-                        ldap.remove_entry_from_group(m_dn, dn, attr)
-                    except errors.PublicError, e:
-                        ldap_obj = self.api.Object[ldap_obj_name]
-                        failed[attr][ldap_obj_name].append((
-                            ldap_obj.get_primary_key_from_dn(m_dn),
-                            unicode(e),)
-                        )
-                    else:
-                        completed += 1
+            m_dns, obj_names = self._get_attr_member_dns(objs)
+            remove_failed = ldap.remove_entries_from_group(m_dns, dn, attr)
+            self._add_failed_members(failed[attr], obj_names, remove_failed)
+            completed += len(m_dns) - len(remove_failed)
 
         if options.get('all', False):
             attrs_list = ['*'] + self.obj.default_attributes
@@ -1951,6 +2085,28 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
             minvalue=0,
             autofill=False,
         ),
+        Int('offset?',
+            label=_('Offset'),
+            doc=_('Number of entries skipped from the start of the sorted '
+                  'result'),
+            flags=['no_display'],
+            minvalue=0,
+            autofill=False,
+        ),
+        Int('limit?',
+            label=_('Limit'),
+            doc=_('Maximum number of entries returned from the offset'),
+            flags=['no_display'],
+            minvalue=1,
+            autofill=False,
+        ),
+    )
+
+    has_output = output.standard_list_of_entries + (
+        output.Output('total', int,
+            _('Estimated number of matching entries when paging'),
+            flags=['no_display', 'optional'],
+        ),
     )
 
     def get_args(self):
@@ -2082,16 +2238,42 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
                 self, ldap, filter, attrs_list, base_dn, scope, *args, **options)
             assert isinstance(base_dn, DN)
 
-        try:
-            (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
-                filter, attrs_list, base_dn, scope,
-                time_limit=options.get('timelimit', None),
-                size_limit=options.get('sizelimit', None)
-            )
-        except errors.EmptyResult:
-            (entries, truncated) = ([], False)
-        except errors.NotFound:
-            self.api.Object[self.obj.parent_object].handle_not_found(*args[:-1])
+        paged = 'offset' in options or 'limit' in options
+        offset = options.get('offset') or 0
+        limit = options.get('limit')
+        total = None
+
+        if limit and self._is_vlv_indexed(ldap, filter, base_dn, scope):
+            # let the server sort the entries and send only the requested
+            # page
+            try:
+                (entries, total) = self._exc_wrapper(
+                    args, options, ldap.find_entries_sorted)(
+                    filter, attrs_list, base_dn, scope,
+                    sort_key=self.obj.primary_key.name,
+                    offset=offset, limit=limit,
+                    time_limit=options.get('timelimit', None)
+                )
+                truncated = False
+            except errors.NotFound:
+                self.api.Object[self.obj.parent_object].handle_not_found(
+                    *args[:-1])
+            except errors.ExecutionError, e:
+                self.log.debug(
+                    "%s: server side paging failed, falling back to a full "
+                    "search: %s", self.name, e)
+
+        if total is None:
+            try:
+                (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
+                    filter, attrs_list, base_dn, scope,
+                    time_limit=options.get('timelimit', None),
+                    size_limit=options.get('sizelimit', None)
+                )
+            except errors.EmptyResult:
+                (entries, truncated) = ([], False)
+            except errors.NotFound:
+                self.api.Object[self.obj.parent_object].handle_not_found(*args[:-1])
 
         for callback in self.get_callbacks('post'):
             truncated = callback(self, ldap, entries, truncated, *args, **options)
@@ -2103,20 +2285,46 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
                         x[self.obj.primary_key.name][0])
                 entries.sort(key=sort_key)
 
+        if paged and total is None:
+            total = len(entries)
+            if limit:
+                entries = entries[offset:offset + limit]
+            else:
+                entries = entries[offset:]
+
         if not options.get('raw', False):
+            self.obj.get_entries_indirect_members(entries, attrs_list)
             for e in entries:
-                self.obj.get_indirect_members(e, attrs_list)
                 self.obj.convert_attribute_members(e, *args, **options)
 
         for (i, e) in enumerate(entries):
             entries[i] = entry_to_dict(e, **options)
             entries[i]['dn'] = e.dn
 
-        return dict(
+        result = dict(
             result=entries,
             count=len(entries),
             truncated=truncated,
         )
+        if paged:
+            result['total'] = total
+        return result
+
+    def _is_vlv_indexed(self, ldap, filter, base_dn, scope):
+        """
+        Return True if the search is the one indexed for server side sorting
+        and paging of the object, see `LDAPObject.vlv_container_dn`.
+
+        Other searches are not paged on the server: without an index the
+        server would sort all the matching entries for each page.
+        """
+        if (not self.sort_result_entries or not self.obj.primary_key or
+                self.obj.vlv_container_dn is None):
+            return False
+        vlv_filter = ldap.make_filter(
+            {'objectclass': self.obj.object_class}, rules=ldap.MATCH_ALL)
+        return (base_dn == DN(self.obj.vlv_container_dn, api.env.basedn) and
+                scope == ldap.SCOPE_ONELEVEL and filter == vlv_filter)
 
     def pre_callback(self, ldap, filters, attrs_list, base_dn, scope, *args, **options):
         assert isinstance(base_dn, DN)
@@ -43,15 +43,26 @@ The format of the response is nested the same way.  At the top you will see
 
 And then a nested response for each IPA command method sent in the request
 
+With the parallel option, consecutive read-only methods (searches and
+retrievals) are executed concurrently by up to batch_max_threads threads,
+each with its own LDAP connection. Other methods are executed one at a time,
+after all the preceding methods finished. The results are always returned
+in the order of the methods.
+
 """
 
+import os
+import threading
+import Queue
+
 from ipalib import api, errors
 from ipalib import Command
-from ipalib.parameters import Str, Any
+from ipalib import crud
+from ipalib.parameters import Str, Any, Flag
 from ipalib.output import Output
 from ipalib import output
 from ipalib.text import _
-from ipalib.request import context
+from ipalib.request import context, destroy_context
 from ipalib.plugable import Registry
 from ipapython.version import API_VERSION
 
@@ -78,53 +89,138 @@ class batch(Command):
         ),
     )
 
+    takes_options = (
+        Flag('parallel?',
+            doc=_('Execute read-only methods concurrently'),
+        ),
+    )
+
     has_output = (
         Output('count', int, doc=''),
         Output('results', (list, tuple), doc='')
     )
 
     def execute(self, *args, **options):
-        results = []
-        for arg in args[0]:
-            params = dict()
-            name = None
-            try:
-                if 'method' not in arg:
-                    raise errors.RequirementError(name='method')
-                if 'params' not in arg:
-                    raise errors.RequirementError(name='params')
-                name = arg['method']
-                if name not in self.Command:
-                    raise errors.CommandError(name=name)
-                a, kw = arg['params']
-                newkw = dict((str(k), v) for k, v in kw.iteritems())
-                params = api.Command[name].args_options_2_params(*a, **newkw)
-                newkw.setdefault('version', options['version'])
-
-                result = api.Command[name](*a, **newkw)
+        methods = args[0]
+        if options.get('parallel') and self._can_execute_parallel():
+            results = self._execute_parallel(methods, options)
+        else:
+            results = [self._execute_method(arg, options) for arg in methods]
+        return dict(count=len(results) , results=results)
+
+    def _execute_method(self, arg, options):
+        params = dict()
+        name = None
+        try:
+            if 'method' not in arg:
+                raise errors.RequirementError(name='method')
+            if 'params' not in arg:
+                raise errors.RequirementError(name='params')
+            name = arg['method']
+            if name not in self.Command:
+                raise errors.CommandError(name=name)
+            a, kw = arg['params']
+            newkw = dict((str(k), v) for k, v in kw.iteritems())
+            params = api.Command[name].args_options_2_params(*a, **newkw)
+            newkw.setdefault('version', options['version'])
+
+            result = api.Command[name](*a, **newkw)
+            self.info(
+                '%s: batch: %s(%s): SUCCESS', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params))
+            )
+            result['error']=None
+        except Exception, e:
+            if isinstance(e, errors.RequirementError) or \
+                isinstance(e, errors.CommandError):
                 self.info(
-                    '%s: batch: %s(%s): SUCCESS', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params))
+                    '%s: batch: %s', context.principal, e.__class__.__name__
                 )
-                result['error']=None
-            except Exception, e:
-                if isinstance(e, errors.RequirementError) or \
-                    isinstance(e, errors.CommandError):
-                    self.info(
-                        '%s: batch: %s', context.principal, e.__class__.__name__
-                    )
-                else:
-                    self.info(
-                        '%s: batch: %s(%s): %s', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params)),  e.__class__.__name__
-                    )
-                if isinstance(e, errors.PublicError):
-                    reported_error = e
-                else:
-                    reported_error = errors.InternalError()
-                result = dict(
-                    error=reported_error.strerror,
-                    error_code=reported_error.errno,
-                    error_name=unicode(type(reported_error).__name__),
+            else:
+                self.info(
+                    '%s: batch: %s(%s): %s', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params)),  e.__class__.__name__
                 )
-            results.append(result)
-        return dict(count=len(results) , results=results)
-
+            if isinstance(e, errors.PublicError):
+                reported_error = e
+            else:
+                reported_error = errors.InternalError()
+            result = dict(
+                error=reported_error.strerror,
+                error_code=reported_error.errno,
+                error_name=unicode(type(reported_error).__name__),
+            )
+        return result
+
+    def _can_execute_parallel(self):
+        # worker threads bind with the Kerberos credentials of the request,
+        # which only the server has
+        return (self.api.env.context in ('server', 'lite') and
+                self.api.env.batch_max_threads > 1 and
+                os.environ.get('KRB5CCNAME') is not None)
+
+    def _is_read_only(self, arg):
+        try:
+            name = arg['method']
+            return (name in self.Command and
+                    isinstance(api.Command[name], (crud.Retrieve, crud.Search)))
+        except (KeyError, TypeError):
+            return False
+
+    def _execute_parallel(self, methods, options):
+        results = [None] * len(methods)
+        pending = []
+        for i, arg in enumerate(methods):
+            if self._is_read_only(arg):
+                pending.append(i)
+                continue
+            # other methods are serialized after all the preceding ones
+            self._execute_concurrently(methods, pending, results, options)
+            pending = []
+            results[i] = self._execute_method(arg, options)
+        self._execute_concurrently(methods, pending, results, options)
+        return results
+
+    def _execute_concurrently(self, methods, indexes, results, options):
+        if len(indexes) < 2:
+            for i in indexes:
+                results[i] = self._execute_method(methods[i], options)
+            return
+
+        queue = Queue.Queue()
+        for i in indexes:
+            queue.put(i)
+
+        ccache = os.environ['KRB5CCNAME']
+        client_ip = getattr(context, 'client_ip', None)
+        workers = []
+        for n in xrange(min(self.api.env.batch_max_threads, len(indexes))):
+            worker = threading.Thread(
+                target=self._worker,
+                args=(queue, methods, results, options, ccache, client_ip))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        # execute what was left over by workers which failed to connect
+        for i in indexes:
+            if results[i] is None:
+                results[i] = self._execute_method(methods[i], options)
+
+    def _worker(self, queue, methods, results, options, ccache, client_ip):
+        try:
+            try:
+                self.Backend.ldap2.connect(ccache=ccache)
+            except Exception, e:
+                self.error('batch: worker failed to connect: %s', e)
+                return
+            if client_ip is not None:
+                setattr(context, 'client_ip', client_ip)
+
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                results[i] = self._execute_method(methods[i], options)
+        finally:
+            destroy_context()
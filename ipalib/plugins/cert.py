@@ -20,6 +20,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import Queue
+import threading
 import time
 from ipalib import Command, Str, Int, Bytes, Flag, File
 from ipalib import api
@@ -31,11 +33,12 @@ from ipalib import ngettext
 from ipalib.plugable import Registry
 from ipalib.plugins.virtual import *
 from ipalib.plugins.baseldap import pkey_to_value
+from ipalib.capabilities import client_has_capability
 from ipalib.plugins.service import split_principal
 import base64
 import traceback
 from ipalib.text import _
-from ipalib.request import context
+from ipalib.request import context, destroy_context
 from ipalib import output
 from ipalib.plugins.service import validate_principal
 import nss.nss as nss
@@ -78,6 +81,9 @@ EXAMPLES:
  Request a new certificate and add the principal:
    ipa cert-request --add --principal=HTTP/lion.example.com example.csr
 
+ Request certificates for several services at once:
+   ipa cert-request-bulk --csr="$(cat lion.csr)" --csr="$(cat tiger.csr)" HTTP/lion.example.com HTTP/tiger.example.com
+
  Retrieve an existing certificate:
    ipa cert-show 1032
 
@@ -212,6 +218,20 @@ def get_host_from_principal(principal):
 
     return hostname
 
+def _can_write_certificate(entry):
+    """
+    Tell whether the rights returned with ``entry`` by a search with the
+    effective rights control allow writing its certificate.
+    """
+    for attr_rights in entry.get('attributelevelrights', []):
+        if isinstance(attr_rights, str):
+            attr_rights = attr_rights.decode('UTF-8')
+        for item in attr_rights.split(','):
+            (attr, sep, rights) = item.strip().partition(':')
+            if attr.lower() == 'usercertificate':
+                return 'w' in rights
+    return False
+
 def ca_enabled_check():
     if not api.Command.ca_is_enabled()['result']:
         raise errors.NotFound(reason=_('CA is not configured'))
@@ -290,31 +310,15 @@ class cert_request(VirtualCommand):
         '2.5.29.37': None,      # Extended Key Usage
     }
 
-    def execute(self, csr, **kw):
-        ca_enabled_check()
-
-        ldap = self.api.Backend.ldap2
-        principal = kw.get('principal')
-        add = kw.get('add')
-        request_type = kw.get('request_type')
-        service = None
-
+    def _check_csr(self, csr, principal, bind_principal, check_access):
         """
-        Access control is partially handled by the ACI titled
-        'Hosts can modify service userCertificate'. This is for the case
-        where a machine binds using a host/ prinicpal. It can only do the
-        request if the target hostname is in the managedBy attribute which
-        is managed using the add/del member commands.
+        Check that the certificate described by ``csr`` may be issued for
+        ``principal``, calling ``check_access`` for the operations its
+        extensions require.
 
-        Binding with a user principal one needs to be in the request_certs
-        taskgroup (directly or indirectly via role membership).
+        Returns the (servicename, hostname, realm) of the principal and the
+        subject alt names of the request.
         """
-
-        bind_principal = getattr(context, 'principal')
-        # Can this user request certs?
-        if not bind_principal.startswith('host/'):
-            self.check_access()
-
         try:
             subject = pkcs10.get_subject(csr)
             extensions = pkcs10.get_extensions(csr)
@@ -327,7 +331,7 @@ class cert_request(VirtualCommand):
             for ext in extensions:
                 operation = self._allowed_extensions.get(ext)
                 if operation:
-                    self.check_access(operation)
+                    check_access(operation)
 
         # Ensure that the hostname in the CSR matches the principal
         subject_host = subject.common_name  #pylint: disable=E1101
@@ -356,6 +360,44 @@ class cert_request(VirtualCommand):
                     error=_("subject alt name type %s is forbidden") %
                           name_type)
 
+        return (servicename, hostname, realm, subjectaltname)
+
+    def _set_certificate_details(self, result):
+        cert = x509.load_certificate(result['certificate'])
+        result['issuer'] = unicode(cert.issuer)
+        result['valid_not_before'] = unicode(cert.valid_not_before_str)
+        result['valid_not_after'] = unicode(cert.valid_not_after_str)
+        result['md5_fingerprint'] = unicode(nss.data_to_hex(nss.md5_digest(cert.der_data), 64)[0])
+        result['sha1_fingerprint'] = unicode(nss.data_to_hex(nss.sha1_digest(cert.der_data), 64)[0])
+
+    def execute(self, csr, **kw):
+        ca_enabled_check()
+
+        ldap = self.api.Backend.ldap2
+        principal = kw.get('principal')
+        add = kw.get('add')
+        request_type = kw.get('request_type')
+        service = None
+
+        """
+        Access control is partially handled by the ACI titled
+        'Hosts can modify service userCertificate'. This is for the case
+        where a machine binds using a host/ prinicpal. It can only do the
+        request if the target hostname is in the managedBy attribute which
+        is managed using the add/del member commands.
+
+        Binding with a user principal one needs to be in the request_certs
+        taskgroup (directly or indirectly via role membership).
+        """
+
+        bind_principal = getattr(context, 'principal')
+        # Can this user request certs?
+        if not bind_principal.startswith('host/'):
+            self.check_access()
+
+        (servicename, hostname, realm, subjectaltname) = self._check_csr(
+            csr, principal, bind_principal, self.check_access)
+
         dn = None
         service = None
         # See if the service exists and punt if it doesn't and we aren't
@@ -437,12 +479,7 @@ class cert_request(VirtualCommand):
         # Request the certificate
         result = self.Backend.ra.request_certificate(
             csr, request_type=request_type)
-        cert = x509.load_certificate(result['certificate'])
-        result['issuer'] = unicode(cert.issuer)
-        result['valid_not_before'] = unicode(cert.valid_not_before_str)
-        result['valid_not_after'] = unicode(cert.valid_not_after_str)
-        result['md5_fingerprint'] = unicode(nss.data_to_hex(nss.md5_digest(cert.der_data), 64)[0])
-        result['sha1_fingerprint'] = unicode(nss.data_to_hex(nss.sha1_digest(cert.der_data), 64)[0])
+        self._set_certificate_details(result)
 
         # Success? Then add it to the service entry.
         if 'certificate' in result:
@@ -459,6 +496,387 @@ class cert_request(VirtualCommand):
         )
 
 
+@register()
+class cert_request_bulk(cert_request):
+    __doc__ = _("""
+    Submit multiple certificate signing requests.
+
+    The entries of the principals are looked up and the certificates are
+    requested from the CA concurrently. A failed request does not stop
+    the others, the result of each one is reported.
+    """)
+
+    takes_args = (
+        Str('principal+',
+            label=_('Principal'),
+            doc=_('Service principals of the certificates, in the order of '
+                  'the CSRs'),
+        ),
+    )
+
+    takes_options = (
+        Str('csr+', validate_csr,
+            label=_('CSR'),
+            doc=_('Certificate signing requests in PEM format'),
+            normalizer=normalize_csr,
+        ),
+        Str('request_type',
+            default=u'pkcs10',
+            autofill=True,
+        ),
+        Flag('add',
+            doc=_("automatically add the principals which don't exist"),
+            default=False,
+            autofill=True
+        ),
+    )
+
+    has_output_params = cert_request.has_output_params + (
+        Str('error',
+            label=_('Error'),
+            flags=['suppress_empty'],
+        ),
+    )
+
+    has_output = (
+        output.Output('count', int,
+            doc=_('Number of certificates issued'),
+        ),
+        output.Output('results', (list, tuple),
+            doc=_('Result of each request, in the order of the principals'),
+        ),
+    )
+
+    # maximum number of principals looked up in a single LDAP search
+    lookup_batch_size = 100
+
+    def execute(self, principal, **options):
+        ca_enabled_check()
+
+        ldap = self.api.Backend.ldap2
+        csrs = options['csr']
+        add = options.get('add')
+        request_type = options.get('request_type')
+
+        if len(csrs) != len(principal):
+            raise errors.ValidationError(name='csr',
+                error=_('the number of CSRs does not match the number of '
+                        'principals'))
+
+        bind_principal = getattr(context, 'principal')
+        # Can this user request certs?
+        if not bind_principal.startswith('host/'):
+            self.check_access()
+
+        # the operations are allowed or not for all the requests alike, so
+        # each one is checked once
+        checked = {}
+        def check_access(operation):
+            if operation not in checked:
+                try:
+                    self.check_access(operation)
+                    checked[operation] = None
+                except errors.ACIError, e:
+                    checked[operation] = e
+            if checked[operation] is not None:
+                raise checked[operation]
+
+        requests = []
+        seen = set()
+        for p, csr in zip(principal, csrs):
+            request = dict(principal=p, csr=csr, error=None)
+            requests.append(request)
+            try:
+                (servicename, hostname, realm, subjectaltname) = \
+                    self._check_csr(csr, p, bind_principal, check_access)
+                key = self._get_entry_key(servicename, hostname, realm)
+                if key in seen:
+                    raise errors.ValidationError(name='principal',
+                        error=_("'%s' is requested more than once") % p)
+                seen.add(key)
+            except Exception, e:
+                self._fail(request, e)
+                continue
+            request.update(servicename=servicename, hostname=hostname,
+                           realm=realm, subjectaltname=subjectaltname,
+                           key=key)
+
+        pending = [r for r in requests if r['error'] is None]
+
+        # look up the entries of all the principals and of the subject alt
+        # names at once
+        keys = set()
+        for request in pending:
+            keys.add(request['key'])
+            for name_type, name in request['subjectaltname']:
+                if name_type == pkcs10.SAN_DNSNAME:
+                    keys.add(self._get_entry_key(
+                        request['servicename'], unicode(name),
+                        request['realm']))
+        entries = self._find_entries(ldap, keys)
+
+        for request in pending:
+            try:
+                request['entry'] = self._check_entry(
+                    ldap, request, entries, add)
+            except Exception, e:
+                self._fail(request, e)
+        pending = [r for r in pending if r['error'] is None]
+
+        try:
+            check_access('retrieve certificate')
+            check_access('revoke certificate')
+        except errors.ACIError:
+            # let cert_show and cert_revoke decide for each certificate
+            revoke_directly = False
+        else:
+            revoke_directly = True
+
+        def issue(request):
+            try:
+                oldcert = request['entry'].get('usercertificate')
+                if oldcert:
+                    self._revoke_certificate(oldcert[0], revoke_directly)
+                    request['revoked'] = True
+                result = self.Backend.ra.request_certificate(
+                    request['csr'], request_type=request_type)
+                self._set_certificate_details(result)
+                request['result'] = result
+            except Exception, e:
+                self._fail(request, e)
+
+        self._issue_certificates(pending, issue)
+
+        # store the certificates with a single modify of each entry
+        count = 0
+        for request in pending:
+            entry = request['entry']
+            result = request.get('result')
+            try:
+                if result is not None and 'certificate' in result:
+                    cert = x509.normalize_certificate(result['certificate'])
+                    x509.verify_cert_subject(ldap, request['hostname'], cert)
+                    entry['usercertificate'] = [cert]
+                elif request.get('revoked'):
+                    # the revoked certificate is removed like cert_request
+                    # does
+                    entry['usercertificate'] = None
+                else:
+                    continue
+                ldap.update_entry(entry)
+            except Exception, e:
+                self._fail(request, e)
+                continue
+            if result is not None:
+                count += 1
+
+        results = []
+        for request in requests:
+            if request['error'] is not None:
+                result = request['error']
+            else:
+                result = request['result']
+                result['error'] = None
+            result['principal'] = request['principal']
+            results.append(result)
+
+        return dict(count=count, results=results)
+
+    def _fail(self, request, e):
+        self.info('%s: cert_request_bulk: %s: %s', context.principal,
+                  request['principal'], e.__class__.__name__)
+        if isinstance(e, errors.PublicError):
+            reported_error = e
+        else:
+            self.error('cert_request_bulk: %s', traceback.format_exc())
+            reported_error = errors.InternalError()
+        request['error'] = dict(
+            error=reported_error.strerror,
+            error_code=reported_error.errno,
+            error_name=unicode(type(reported_error).__name__),
+        )
+        request.pop('result', None)
+
+    def _get_entry_key(self, servicename, hostname, realm):
+        hostname = hostname.lower()
+        if servicename == 'host':
+            return ('host', hostname)
+        return ('service', u'%s/%s@%s' % (servicename, hostname, realm))
+
+    def _find_entries(self, ldap, keys):
+        """
+        Look up the host and service entries identified by ``keys``,
+        together with the rights of the bound user on them.
+
+        Returns a dict mapping the keys to the entries found.
+        """
+        found = {}
+        lookups = (
+            ('host', 'fqdn', self.api.env.container_host),
+            ('service', 'krbprincipalname', self.api.env.container_service),
+        )
+        for kind, attr, container in lookups:
+            values = sorted(value for k, value in keys if k == kind)
+            base_dn = DN(container, self.api.env.basedn)
+            for i in xrange(0, len(values), self.lookup_batch_size):
+                chunk = values[i:i + self.lookup_batch_size]
+                filter = ldap.make_filter_from_attr(attr, chunk)
+                try:
+                    (entries, truncated) = ldap.find_entries_with_rights(
+                        filter, [attr, 'usercertificate'], base_dn,
+                        ldap.SCOPE_ONELEVEL)
+                except errors.NotFound:
+                    continue
+                for entry in entries:
+                    for value in entry.get(attr, []):
+                        if kind == 'host':
+                            value = value.lower()
+                        found[(kind, value)] = entry
+        return found
+
+    def _check_entry(self, ldap, request, entries, add):
+        """
+        Return the entry of the principal of ``request`` after checking that
+        the bound user may store its certificate there.
+        """
+        principal = request['principal']
+        servicename = request['servicename']
+        realm = request['realm']
+
+        entry = entries.get(request['key'])
+        if entry is None:
+            if not add:
+                raise errors.NotFound(reason=_("The service principal for "
+                    "this request doesn't exist."))
+            dn = api.Command['service_add'](principal, force=True)['result']['dn']
+            entry = ldap.get_effective_rights(dn, ['usercertificate'])
+
+        if not _can_write_certificate(entry):
+            raise errors.ACIError(info=_("Insufficient 'write' privilege "
+                "to the 'userCertificate' attribute of entry '%s'.") % entry.dn)
+
+        for name_type, name in request['subjectaltname']:
+            if name_type == pkcs10.SAN_DNSNAME:
+                name = unicode(name)
+                altentry = entries.get(
+                    self._get_entry_key(servicename, name, realm))
+                if altentry is None:
+                    raise errors.NotFound(reason=_('The service principal for '
+                        'subject alt name %s in certificate request does not '
+                        'exist') % name)
+                if not _can_write_certificate(altentry):
+                    raise errors.ACIError(info=_(
+                        "Insufficient privilege to create a certificate with "
+                        "subject alt name '%s'.") % name)
+            elif name_type in (pkcs10.SAN_OTHERNAME_KRB5PRINCIPALNAME,
+                               pkcs10.SAN_OTHERNAME_UPN):
+                if name != principal:
+                    raise errors.ACIError(
+                        info=_("Principal '%s' in subject alt name does not "
+                               "match requested service principal") % name)
+            else:
+                raise errors.ACIError(
+                    info=_("Subject alt name type %s is forbidden") %
+                         name_type)
+
+        return entry
+
+    def _revoke_certificate(self, cert, directly):
+        """
+        Revoke the certificate superseded by a new one, unless it is revoked
+        already. Unless ``directly``, the access is checked by cert_show and
+        cert_revoke.
+        """
+        serial = unicode(x509.get_serial_number(cert, datatype=x509.DER))
+        try:
+            if directly:
+                result = self.Backend.ra.get_certificate(serial)
+            else:
+                result = api.Command['cert_show'](serial)['result']
+            if 'revocation_reason' not in result:
+                try:
+                    if directly:
+                        self.Backend.ra.revoke_certificate(
+                            serial, revocation_reason=4)
+                    else:
+                        api.Command['cert_revoke'](
+                            serial, revocation_reason=4)
+                except errors.NotImplementedError:
+                    # some CA's might not implement revoke
+                    pass
+        except errors.NotImplementedError:
+            # some CA's might not implement get
+            pass
+
+    def _can_issue_parallel(self):
+        # worker threads bind with the Kerberos credentials of the request,
+        # which only the server has
+        return (self.api.env.context in ('server', 'lite') and
+                os.environ.get('KRB5CCNAME') is not None)
+
+    def _issue_certificates(self, requests, issue):
+        """
+        Call ``issue(request)`` for each of ``requests``, from as many
+        threads as connections to the CA are pooled.
+        """
+        workers = min(self.api.env.ra_pool_size, len(requests))
+        if workers >= 2 and self._can_issue_parallel():
+            # the workers connect to the CA concurrently, NSS must not be
+            # initialized by any of them
+            try:
+                self.Backend.ra.init_nss()
+            except errors.NotImplementedError:
+                workers = 1
+        else:
+            workers = 1
+        if workers == 1:
+            for request in requests:
+                issue(request)
+            return
+
+        queue = Queue.Queue()
+        for request in requests:
+            queue.put(request)
+
+        ccache = os.environ['KRB5CCNAME']
+        client_ip = getattr(context, 'client_ip', None)
+        threads = []
+        for n in xrange(workers):
+            thread = threading.Thread(
+                target=self._worker, args=(queue, issue, ccache, client_ip))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        # issue what was left over by workers which failed to connect
+        while True:
+            try:
+                request = queue.get_nowait()
+            except Queue.Empty:
+                break
+            issue(request)
+
+    def _worker(self, queue, issue, ccache, client_ip):
+        try:
+            try:
+                self.Backend.ldap2.connect(ccache=ccache)
+            except Exception, e:
+                self.error('cert_request_bulk: worker failed to connect: %s',
+                           e)
+                return
+            if client_ip is not None:
+                setattr(context, 'client_ip', client_ip)
+
+            while True:
+                try:
+                    request = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                issue(request)
+        finally:
+            destroy_context()
+
 
 @register()
 class cert_status(VirtualCommand):
@@ -728,9 +1146,26 @@ class cert_find(Command):
             minvalue=0,
             default=100,
         ),
+        Int('cursor?',
+            label=_('Cursor'),
+            doc=_('Serial number to continue a truncated search from'),
+            flags=['no_display'],
+            minvalue=0,
+            maxvalue=2147483647,
+            autofill=False,
+        ),
+        Flag('pkey_only?',
+            label=_('Primary key only'),
+            doc=_('Results should contain serial number and status only'),
+        ),
     )
 
-    has_output = output.standard_list_of_entries
+    has_output = output.standard_list_of_entries + (
+        output.Output('cursor', (int, long),
+            _('Serial number to continue the search from'),
+            flags=['no_display', 'optional'],
+        ),
+    )
     has_output_params = (
         Str('serial_number_hex',
             label=_('Serial number (hex)'),
@@ -749,13 +1184,34 @@ class cert_find(Command):
 
     def execute(self, **options):
         ca_enabled_check()
+        sizelimit = options.get('sizelimit', 100)
+        result = []
+        cursor = None
+        for cert in self.Backend.ra.iter_find(options):
+            if len(result) >= sizelimit:
+                cursor = cert['serial_number']
+                break
+            result.append(cert)
+
         ret = dict(
-            result=self.Backend.ra.find(options)
+            result=result,
+            count=len(result),
+            truncated=cursor is not None,
         )
-        ret['count'] = len(ret['result'])
-        ret['truncated'] = False
+        if (cursor is not None and
+                client_has_capability(options['version'], 'cert_find_cursor')):
+            ret['cursor'] = cursor
         return ret
 
+    def output_for_cli(self, textui, output, *args, **options):
+        rv = super(cert_find, self).output_for_cli(
+            textui, output, *args, **options)
+        if output.get('cursor') is not None:
+            textui.print_plain(
+                _('Use --cursor=%(cursor)d to continue the search') %
+                dict(cursor=output['cursor']))
+        return rv
+
 
 @register()
 class ca_is_enabled(Command):
@@ -256,7 +256,7 @@ class config_mod(LDAPUpdate):
         if 'ipagroupsearchfields' in entry_attrs:
             kw['ipagroupsearchfields']  = 'ipagroupobjectclasses'
         if kw:
-            config = ldap.get_ipa_config(kw.values())
+            config = ldap.get_ipa_config(kw.values(), fresh=True)
             for (k, v) in kw.iteritems():
                 allowed_attrs = ldap.get_allowed_attributes(config[v])
                 fields = entry_attrs[k].split(',')
@@ -311,7 +311,7 @@ class config_mod(LDAPUpdate):
                                 error=error_message)
 
             else:
-                config = ldap.get_ipa_config()
+                config = ldap.get_ipa_config(fresh=True)
                 defaultuser = config.get('ipaselinuxusermapdefault', [None])[0]
 
             if 'ipaselinuxusermaporder' in entry_attrs:
@@ -333,7 +333,7 @@ class config_mod(LDAPUpdate):
                                 error=error_message)
             else:
                 if not config:
-                    config = ldap.get_ipa_config()
+                    config = ldap.get_ipa_config(fresh=True)
                 order = config['ipaselinuxusermaporder']
                 userlist = order[0].split('$')
             if defaultuser and defaultuser not in userlist:
@@ -23,6 +23,7 @@ from __future__ import absolute_import
 import netaddr
 import time
 import re
+import threading
 import binascii
 import dns.name
 import dns.exception
@@ -524,14 +525,8 @@ def get_reverse_zone(ipaddr, prefixlen=None):
     revdns = DNSName(unicode(ip.reverse_dns))
 
     if prefixlen is None:
-        revzone = None
-
-        result = api.Command['dnszone_find']()['result']
-        for zone in result:
-            zonename = zone['idnsname'][0]
-            if (revdns.is_subdomain(zonename.make_absolute()) and
-               (revzone is None or zonename.is_subdomain(revzone))):
-                revzone = zonename
+        tree, truncated = _get_dns_zone_tree()
+        revzone = tree.find_zone(revdns, active_only=False)
     else:
         if ip.version == 4:
             pos = 4 - prefixlen / 8
@@ -1728,50 +1723,253 @@ def _normalize_zone(zone):
     return zone
 
 
-def _get_auth_zone_ldap(name):
+class _DNSZoneTreeNode(object):
+    __slots__ = ('children', 'zone', 'active', 'delegations')
+
+    def __init__(self):
+        self.children = {}
+        self.zone = None
+        self.active = False
+        # zone (absolute, canonical) -> delegation record name in the zone
+        self.delegations = {}
+
+
+class DNSZoneTree(object):
     """
-    Find authoritative zone in LDAP for name. Only active zones are considered.
-    :param name:
-    :return: (zone, truncated)
-    zone: authoritative zone, or None if authoritative zone is not in LDAP
+    Suffix trie of the master zones in LDAP and of the NS delegations in
+    them, looked up by the longest match of a name.
+    """
+
+    def __init__(self):
+        self._root = _DNSZoneTreeNode()
+
+    @staticmethod
+    def _key(name):
+        return name.make_absolute().canonicalize()
+
+    def _walk(self, name, create=False):
+        """
+        Yield the nodes on the path to ``name``, from the root.
+        """
+        node = self._root
+        for label in reversed(self._key(name).labels):
+            child = node.children.get(label)
+            if child is None:
+                if not create:
+                    return
+                child = node.children[label] = _DNSZoneTreeNode()
+            node = child
+            yield node
+
+    def add_zone(self, zone, active):
+        for node in self._walk(zone, create=True):
+            pass
+        node.zone = zone
+        node.active = active
+
+    def add_delegation(self, zone, name):
+        zone_key = self._key(zone)
+        if name.is_absolute():
+            name = name.relativize(zone_key)
+        if name.is_empty():
+            # NS records in zone apex are not delegations
+            return
+        for node in self._walk(name.derelativize(zone_key), create=True):
+            pass
+        node.delegations[zone_key] = name
+
+    def find_zone(self, name, active_only=True):
+        """
+        Return the name of the deepest zone ``name`` is in, as stored in
+        LDAP, or None.
+        """
+        zone = None
+        for node in self._walk(name):
+            if node.zone is not None and (node.active or not active_only):
+                zone = node.zone
+        return zone
+
+    def find_delegation(self, zone, name):
+        """
+        Return the name of the deepest delegation for ``name`` in ``zone``,
+        relative to the zone, or None.
+        """
+        zone_key = self._key(zone)
+        delegation = None
+        for node in self._walk(name):
+            if zone_key in node.delegations:
+                delegation = node.delegations[zone_key]
+        return delegation
+
+
+class DNSZoneTreeCache(object):
+    """
+    Process-wide cache of the `DNSZoneTree` built from LDAP, kept along
+    with the version of the zones and delegations it was built at, see
+    `_get_dns_zone_tree`.
+
+    The last check of the version is remembered too, so that it can be
+    skipped while nothing was written to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._tree = None
+        self._checked = None
+
+    def lookup(self, checked):
+        """
+        Return the tree if its version was last checked at ``checked``,
+        None otherwise.
+        """
+        with self._lock:
+            if checked is None or self._checked != checked:
+                return None
+            return self._tree
+
+    def get(self, version, checked=None):
+        """
+        Return the tree if it was built at ``version``, None otherwise.
+
+        The version of the tree returned is remembered as checked at
+        ``checked``.
+        """
+        with self._lock:
+            if self._version != version:
+                return None
+            self._checked = checked
+            return self._tree
+
+    def set(self, version, tree, checked=None):
+        with self._lock:
+            self._version = version
+            self._tree = tree
+            self._checked = checked
+
+    def clear(self):
+        self.set(None, None)
+
+
+zone_tree_cache = DNSZoneTreeCache()
+
+
+def _get_last_usn(ldap):
+    """
+    Return the last USNs of the databases read from the root DSE, or None
+    if they are not available.
+    """
+    try:
+        entry = ldap.get_entry(DN(), ['lastusn'])
+    except errors.NotFound:
+        return None
+    usns = sorted((name.lower(), tuple(values))
+                  for name, values in entry.raw.items()
+                  if name.lower().split(';')[0] == 'lastusn')
+    if not usns:
+        return None
+    return tuple(usns)
+
+
+def _get_dns_zone_tree():
+    """
+    Return a `DNSZoneTree` of the zones and delegations in LDAP.
+
+    The tree is built again only when the entries of the zones or of the
+    records with NS records in the DNS container were added, removed or
+    changed, as told by their DNs and entryUSNs. These are not searched
+    for again as long as the last USN of the database does not change.
+    :return: (tree, truncated)
     """
-    assert isinstance(name, DNSName)
     ldap = api.Backend.ldap2
+    container_dn = DN(api.env.container_dns, api.env.basedn)
+    # both objectclass and nsrecord are indexed
+    search_filter = '(|(objectclass=idnszone)(nsrecord=*))'
+
+    # what the bound principal may read is part of the version
+    checked = None
+    principal = getattr(context, 'principal', None)
+    last_usn = _get_last_usn(ldap)
+    if principal is not None and last_usn is not None:
+        checked = (principal, last_usn)
+        tree = zone_tree_cache.lookup(checked)
+        if tree is not None:
+            return tree, False
 
-    # Create all possible parent zone names
-    search_name = name.make_absolute()
-    zone_names = []
-    for i in xrange(len(search_name)):
-        zone_name_abs = DNSName(search_name[i:]).ToASCII()
-        zone_names.append(zone_name_abs)
-        # compatibility with IPA < 4.0, zone name can be relative
-        zone_names.append(zone_name_abs[:-1])
+    try:
+        entries, truncated = ldap.find_entries(
+            filter=search_filter,
+            attrs_list=['entryusn'],
+            base_dn=container_dn,
+            scope=ldap.SCOPE_SUBTREE,
+            time_limit=-1,
+            size_limit=-1,
+            paged_search=True
+        )
+    except errors.NotFound:
+        entries, truncated = [], False
 
-    # Create filters
-    objectclass_filter = ldap.make_filter({'objectclass':'idnszone'})
-    zonenames_filter = ldap.make_filter({'idnsname': zone_names})
-    zoneactive_filter = ldap.make_filter({'idnsZoneActive': 'true'})
-    complete_filter = ldap.combine_filters(
-        [objectclass_filter, zonenames_filter, zoneactive_filter],
-        rules=ldap.MATCH_ALL
-    )
+    version = None
+    if not truncated and all('entryusn' in entry.raw for entry in entries):
+        version = frozenset((entry.dn, entry.raw['entryusn'][0])
+                            for entry in entries)
+        tree = zone_tree_cache.get(version, checked)
+        if tree is not None:
+            return tree, False
 
     try:
         entries, truncated = ldap.find_entries(
-            filter=complete_filter,
-            attrs_list=['idnsname'],
-            base_dn=DN(api.env.container_dns, api.env.basedn),
-            scope=ldap.SCOPE_ONELEVEL
+            filter=search_filter,
+            attrs_list=['objectclass', 'idnsname', 'idnszoneactive'],
+            base_dn=container_dn,
+            scope=ldap.SCOPE_SUBTREE,
+            time_limit=-1,
+            size_limit=-1,
+            paged_search=True
         )
     except errors.NotFound:
-        return None, False
+        entries, truncated = [], False
 
-    # always use absolute zones
-    matched_auth_zones = [entry.single_value['idnsname'].make_absolute()
-                          for entry in entries]
+    tree = DNSZoneTree()
+    zones = {}
+    records = []
+    for entry in entries:
+        objectclasses = [o.lower() for o in entry.get('objectclass', [])]
+        if 'idnszone' not in objectclasses:
+            records.append(entry)
+            continue
+        zone = entry.single_value['idnsname']
+        active = entry.raw.get('idnszoneactive', [''])[0].upper() == 'TRUE'
+        tree.add_zone(zone, active)
+        zones[entry.dn] = zone
+
+    for entry in records:
+        # records of forward zones are not delegations
+        zone = zones.get(entry.dn[1:])
+        if zone is not None:
+            tree.add_delegation(zone, entry.single_value['idnsname'])
 
-    # return longest match
-    return max(matched_auth_zones, key=len), truncated
+    if version is not None and not truncated:
+        zone_tree_cache.set(version, tree, checked)
+    return tree, truncated
+
+
+def _get_auth_zone_ldap(name):
+    """
+    Find authoritative zone in LDAP for name. Only active zones are considered.
+    :param name:
+    :return: (zone, truncated)
+    zone: authoritative zone, or None if authoritative zone is not in LDAP
+    """
+    assert isinstance(name, DNSName)
+
+    tree, truncated = _get_dns_zone_tree()
+    zone = tree.find_zone(name)
+    if zone is None:
+        return None, truncated
+
+    # always use absolute zones
+    return zone.make_absolute(), truncated
 
 
 def _get_longest_match_ns_delegation_ldap(zone, name):
@@ -1800,11 +1998,6 @@ def _get_longest_match_ns_delegation_ldap(zone, name):
     assert isinstance(zone, DNSName)
     assert isinstance(name, DNSName)
 
-    ldap = api.Backend.ldap2
-
-    # get zone DN
-    zone_dn = api.Object.dnszone.get_dn(zone)
-
     if name.is_absolute():
         relative_record_name = name.relativize(zone.make_absolute())
     else:
@@ -1814,40 +2007,10 @@ def _get_longest_match_ns_delegation_ldap(zone, name):
     if relative_record_name.is_empty():
         return None, False
 
-    # create list of possible record names
-    possible_record_names = [DNSName(relative_record_name[i:]).ToASCII()
-                             for i in xrange(len(relative_record_name))]
-
-    # search filters
-    name_filter = ldap.make_filter({'idnsname': [possible_record_names]})
-    objectclass_filter = ldap.make_filter({'objectclass': 'idnsrecord'})
-    complete_filter = ldap.combine_filters(
-        [name_filter, objectclass_filter],
-        rules=ldap.MATCH_ALL
-    )
-
-    try:
-        entries, truncated = ldap.find_entries(
-            filter=complete_filter,
-            attrs_list=['idnsname', 'nsrecord'],
-            base_dn=zone_dn,
-            scope=ldap.SCOPE_ONELEVEL
-        )
-    except errors.NotFound:
-        return None, False
-
-    matched_records = []
-
-    # test if entry contains NS records
-    for entry in entries:
-        if entry.get('nsrecord'):
-            matched_records.append(entry.single_value['idnsname'])
-
-    if not matched_records:
-        return None, truncated
+    tree, truncated = _get_dns_zone_tree()
+    record_name = relative_record_name.derelativize(zone.make_absolute())
 
-    # return longest match
-    return max(matched_records, key=len), truncated
+    return tree.find_delegation(zone, record_name), truncated
 
 
 def _find_subtree_forward_zones_ldap(name, child_zones_only=False):
@@ -122,6 +122,7 @@ class group(LDAPObject):
     Group object.
     """
     container_dn = api.env.container_group
+    vlv_container_dn = api.env.container_group
     object_name = _('group')
     object_name_plural = _('groups')
     object_class = ['ipausergroup']
@@ -17,11 +17,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import itertools
+import threading
+
 from ipalib import api, errors, output, util
 from ipalib import Command, Str, Flag, Int, DeprecatedParam
 from types import NoneType
 from ipalib.cli import to_cli
 from ipalib import _, ngettext
+from ipalib.request import context
 from ipapython.dn import DN
 from ipalib.plugable import Registry
 if api.env.in_server and api.env.context in ['lite', 'server']:
@@ -136,6 +141,25 @@ EXAMPLES:
       Not matched rules: new-rule
       Matched rules: allow_all
 
+    8. Test every user with every host for a service in one call, with the
+       HBAC rules read and indexed only once:
+    $ ipa hbactest-batch --users=a1a,b2b --hosts=foo,bar --services=sshd \
+          --nodetail
+    ------------------------
+    3 of 4 requests granted
+    ------------------------
+      User name: a1a
+      Target host: foo
+      Service: sshd
+      Access granted: True
+      ...
+    ----------------------------
+    Number of requests tested 4
+    ----------------------------
+
+ Single requests may be given as --request=USER:HOST:SERVICE, along with or
+ instead of the users, hosts and services tested in all their combinations.
+
 
 HBACTEST AND TRUSTED DOMAINS
 
@@ -240,6 +264,185 @@ def convert_to_ipa_rule(rule):
     return ipa_rule
 
 
+# Elements of a request matched by the rules: (element, category attribute,
+# member attribute, member type, group type). Rules always apply to all
+# source hosts.
+_rule_elements = (
+    ('user',       'usercategory',    'memberuser',    'user',    'group'),
+    ('targethost', 'hostcategory',    'memberhost',    'host',    'hostgroup'),
+    ('service',    'servicecategory', 'memberservice', 'hbacsvc', 'hbacsvcgroup'),
+)
+
+_empty = frozenset()
+
+
+def _is_ascii(value):
+    """
+    Return True if ``value`` is a string made of ASCII characters only.
+    """
+    if not isinstance(value, basestring):
+        return False
+    try:
+        value.encode('ascii')
+    except UnicodeError:
+        return False
+    return True
+
+
+class HBACRuleSet(object):
+    """
+    HBAC rules converted once to be tested with many requests.
+
+    Rules are selected by their position in ``rules``.  Along with the
+    pyhbac rules, the users, hosts and services each rule applies to,
+    directly or through their groups, are indexed in sets, so that `match`
+    finds the rules allowing a request without evaluating every rule.
+
+    The index compares names with ``lower()``, which folds case the way
+    libhbac does for ASCII names only.  Rules naming anything else are
+    evaluated by pyhbac, and so are all the rules for requests naming
+    anything else.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.names = [rule['cn'][0] for rule in self.rules]
+        self.enabled = [bool(rule['ipaenabledflag'][0]) for rule in self.rules]
+        # a rule selected for a test is enabled for it
+        self.ipa_rules = []
+        for rule in self.rules:
+            ipa_rule = convert_to_ipa_rule(rule)
+            ipa_rule.enabled = True
+            self.ipa_rules.append(ipa_rule)
+
+        # positions of the rules evaluated by pyhbac
+        self.native = set()
+        for (i, rule) in enumerate(self.rules):
+            for (element, category, attr, member, group) in _rule_elements:
+                if rule.get(category, [None])[0] == u'all':
+                    continue
+                for member_type in (member, group):
+                    values = rule.get('%s_%s' % (attr, member_type), [])
+                    if not all(_is_ascii(value) for value in values):
+                        self.native.add(i)
+
+        self._index = {}
+        for (element, category, attr, member, group) in _rule_elements:
+            index = dict(all=set(), names={}, groups={})
+            for (i, rule) in enumerate(self.rules):
+                if i in self.native:
+                    continue
+                if rule.get(category, [None])[0] == u'all':
+                    index['all'].add(i)
+                    continue
+                for (key, member_type) in (('names', member),
+                                           ('groups', group)):
+                    for name in rule.get('%s_%s' % (attr, member_type), []):
+                        index[key].setdefault(name.lower(), set()).add(i)
+            self._index[element] = index
+
+    def select(self, enabled=True, disabled=False):
+        """
+        Return the positions of the enabled and/or disabled rules.
+        """
+        return [i for (i, rule_enabled) in enumerate(self.enabled)
+                if (enabled and rule_enabled) or
+                   (disabled and not rule_enabled)]
+
+    def match(self, positions, user, targethost, service):
+        """
+        Return the sorted positions of the rules of ``positions`` which allow
+        a request and the sorted positions of those pyhbac could not
+        evaluate.
+
+        Each element of the request is given as a (name, groups) tuple, a
+        name of None only matches the rules applying to all.
+        """
+        request = dict(user=user, targethost=targethost, service=service)
+        if all(_is_ascii(name) or name is None for (name, groups)
+               in request.values()) and \
+           all(_is_ascii(group_name) for (name, groups) in request.values()
+               for group_name in groups):
+            native = self.native.intersection(positions)
+        else:
+            native = set(positions)
+
+        matched = set(positions) - native
+        for (element, category, attr, member, group) in _rule_elements:
+            if not matched:
+                break
+            (name, groups) = request[element]
+            index = self._index[element]
+            allowed = matched & index['all']
+            if name is not None:
+                allowed |= matched & index['names'].get(name.lower(), _empty)
+            for group_name in groups:
+                allowed |= matched & index['groups'].get(group_name.lower(),
+                                                         _empty)
+            matched = allowed
+
+        failed = set()
+        if native:
+            hbac_request = pyhbac.HbacRequest()
+            for (element, (name, groups)) in request.iteritems():
+                if name is not None:
+                    getattr(hbac_request, element).name = name
+                    getattr(hbac_request, element).groups = list(groups)
+            for i in native:
+                try:
+                    res = hbac_request.evaluate([self.ipa_rules[i]])
+                except pyhbac.HbacError:
+                    failed.add(i)
+                    continue
+                if res == pyhbac.HBAC_EVAL_ALLOW:
+                    matched.add(i)
+        return (sorted(matched), sorted(failed))
+
+
+class HBACRuleCache(object):
+    """
+    Process-wide cache of `HBACRuleSet` objects.
+
+    The rules read by a principal are kept along with the version of the
+    HBAC rule container they were read at, see `hbactest._get_rule_version`.
+    Rule sets are kept per principal, as principals may be allowed to read
+    different rules.
+    Only the rule sets of the ``max_size`` most recent principals are kept.
+    """
+
+    max_size = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rulesets = collections.OrderedDict()
+
+    def get(self, principal, version):
+        """
+        Return the rule set of ``principal`` if it was read at ``version``,
+        None otherwise.
+        """
+        with self._lock:
+            cached = self._rulesets.pop(principal, None)
+            if cached is None or cached[0] != version:
+                return None
+            self._rulesets[principal] = cached
+            return cached[1]
+
+    def set(self, principal, version, ruleset):
+        with self._lock:
+            self._rulesets.pop(principal, None)
+            self._rulesets[principal] = (version, ruleset)
+            while len(self._rulesets) > self.max_size:
+                self._rulesets.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._rulesets.clear()
+
+
+rule_cache = HBACRuleCache()
+
+
 @register()
 class hbactest(Command):
     __doc__ = _('Simulate use of Host-based access controls')
@@ -302,6 +505,144 @@ class hbactest(Command):
             return u'%s.%s' % (host, self.env.domain)
         return host
 
+    def _get_rule_version(self):
+        """
+        Return the version of the HBAC rules: their number and the highest
+        entryUSN and modifyTimestamp among them, None if not all the rules
+        could be read.
+        """
+        ldap = self.api.Backend.ldap2
+        container_dn = DN(self.api.env.container_hbac, self.api.env.basedn)
+        try:
+            (entries, truncated) = ldap.find_entries(
+                '(objectclass=ipahbacrule)', ['entryusn', 'modifytimestamp'],
+                container_dn, ldap.SCOPE_ONELEVEL)
+        except errors.NotFound:
+            return (0, None, None)
+        if truncated:
+            return None
+        usns = [int(entry.raw['entryusn'][0]) for entry in entries
+                if 'entryusn' in entry.raw]
+        timestamps = [entry.raw['modifytimestamp'][0] for entry in entries
+                      if 'modifytimestamp' in entry.raw]
+        return (len(entries), max(usns or [None]), max(timestamps or [None]))
+
+    def _get_ruleset(self):
+        """
+        Return a `HBACRuleSet` of all the HBAC rules, read again only when
+        the rules changed.
+        """
+        principal = getattr(context, 'principal', None)
+        version = self._get_rule_version()
+        if version is not None:
+            ruleset = rule_cache.get(principal, version)
+            if ruleset is not None:
+                return ruleset
+
+        result = self.api.Command.hbacrule_find()
+        ruleset = HBACRuleSet(result['result'])
+        if version is not None and not result['truncated']:
+            rule_cache.set(principal, version, ruleset)
+        return ruleset
+
+    def _resolve_user(self, user):
+        """
+        Return the name ``user`` is tested with and the groups it is a
+        member of. The name is None for all users.
+        """
+        if user == u'all':
+            return (None, [])
+
+        # check first if this is not a trusted domain user
+        if _dcerpc_bindings_installed:
+            is_valid_sid = ipaserver.dcerpc.is_sid_valid(user)
+        else:
+            is_valid_sid = False
+        components = util.normalize_name(user)
+        if is_valid_sid or 'domain' in components or 'flatname' in components:
+            # this is a trusted domain user
+            if not _dcerpc_bindings_installed:
+                raise errors.NotFound(reason=_(
+                    'Cannot perform external member validation without '
+                    'Samba 4 support installed. Make sure you have installed '
+                    'server-trust-ad sub-package of IPA on the server'))
+            domain_validator = ipaserver.dcerpc.DomainValidator(self.api)
+            if not domain_validator.is_configured():
+                raise errors.NotFound(reason=_(
+                    'Cannot search in trusted domains without own domain configured. '
+                    'Make sure you have run ipa-adtrust-install on the IPA server first'))
+            user_sid, group_sids = domain_validator.get_trusted_domain_user_and_groups(user)
+
+            # Now search for all external groups that have this user or
+            # any of its groups in its external members. Found entires
+            # memberOf links will be then used to gather all groups where
+            # this group is assigned, including the nested ones
+            filter_sids = "(&(objectclass=ipaexternalgroup)(|(ipaExternalMember=%s)))" \
+                    % ")(ipaExternalMember=".join(group_sids + [user_sid])
+
+            ldap = self.api.Backend.ldap2
+            group_container = DN(api.env.container_group, api.env.basedn)
+            try:
+                entries, truncated = ldap.find_entries(filter_sids, ['memberof'], group_container)
+            except errors.NotFound:
+                return (user_sid, [])
+            groups = []
+            for entry in entries:
+                memberof_dns = entry.get('memberof', [])
+                for memberof_dn in memberof_dns:
+                    if memberof_dn.endswith(group_container):
+                        groups.append(memberof_dn[0][0].value)
+            return (user_sid, sorted(set(groups)))
+
+        # try searching for a local user
+        groups = []
+        try:
+            search_result = self.api.Command.user_show(user)['result']
+            groups = search_result['memberof_group']
+            if 'memberofindirect_group' in search_result:
+                groups += search_result['memberofindirect_group']
+            groups = sorted(set(groups))
+        except:
+            pass
+        return (user, groups)
+
+    def _resolve_service(self, service):
+        """
+        Return the name ``service`` is tested with and the groups it is a
+        member of. The name is None for all services.
+        """
+        if service == u'all':
+            return (None, [])
+
+        groups = []
+        try:
+            service_result = self.api.Command.hbacsvc_show(service)['result']
+            if 'memberof_hbacsvcgroup' in service_result:
+                groups = service_result['memberof_hbacsvcgroup']
+        except:
+            pass
+        return (service, groups)
+
+    def _resolve_host(self, host):
+        """
+        Return the name ``host`` is tested with and the groups it is a
+        member of. The name is None for all hosts.
+        """
+        if host == u'all':
+            return (None, [])
+
+        host = self.canonicalize(host)
+        groups = []
+        try:
+            tgthost_result = self.api.Command.host_show(host)['result']
+            groups = tgthost_result['memberof_hostgroup']
+            if 'memberofindirect_hostgroup' in tgthost_result:
+                groups += tgthost_result['memberofindirect_hostgroup']
+            groups = sorted(set(groups))
+        except:
+            pass
+        return (host, groups)
+
     def execute(self, *args, **options):
         # First receive all needed information:
         # 1. HBAC rules (whether enabled or disabled)
@@ -336,7 +677,15 @@ class hbactest(Command):
 
         hbacset = []
         if len(testrules) == 0:
-            hbacset = self.api.Command.hbacrule_find(sizelimit=sizelimit)['result']
+            if sizelimit is None:
+                ruleset = self._get_ruleset()
+            else:
+                ruleset = HBACRuleSet(self.api.Command.hbacrule_find(
+                    sizelimit=sizelimit)['result'])
+            # --enabled will import all enabled rules (default)
+            # --disabled will import all disabled rules
+            rules = [ruleset.ipa_rules[i]
+                     for i in ruleset.select(all_enabled, all_disabled)]
         else:
             for rule in testrules:
                 try:
@@ -345,8 +694,6 @@ class hbactest(Command):
                     pass
 
         # We have some rules, import them
-        # --enabled will import all enabled rules (default)
-        # --disabled will import all disabled rules
         # --rules will implicitly add the rules from a rule list
         for rule in hbacset:
             ipa_rule = convert_to_ipa_rule(rule)
@@ -372,80 +719,20 @@ class hbactest(Command):
         # Rules are converted to pyhbac format, build request and then test it
         request = pyhbac.HbacRequest()
 
-        if options['user'] != u'all':
-            # check first if this is not a trusted domain user
-            if _dcerpc_bindings_installed:
-                is_valid_sid = ipaserver.dcerpc.is_sid_valid(options['user'])
-            else:
-                is_valid_sid = False
-            components = util.normalize_name(options['user'])
-            if is_valid_sid or 'domain' in components or 'flatname' in components:
-                # this is a trusted domain user
-                if not _dcerpc_bindings_installed:
-                    raise errors.NotFound(reason=_(
-                        'Cannot perform external member validation without '
-                        'Samba 4 support installed. Make sure you have installed '
-                        'server-trust-ad sub-package of IPA on the server'))
-                domain_validator = ipaserver.dcerpc.DomainValidator(self.api)
-                if not domain_validator.is_configured():
-                    raise errors.NotFound(reason=_(
-                        'Cannot search in trusted domains without own domain configured. '
-                        'Make sure you have run ipa-adtrust-install on the IPA server first'))
-                user_sid, group_sids = domain_validator.get_trusted_domain_user_and_groups(options['user'])
-                request.user.name = user_sid
-
-                # Now search for all external groups that have this user or
-                # any of its groups in its external members. Found entires
-                # memberOf links will be then used to gather all groups where
-                # this group is assigned, including the nested ones
-                filter_sids = "(&(objectclass=ipaexternalgroup)(|(ipaExternalMember=%s)))" \
-                        % ")(ipaExternalMember=".join(group_sids + [user_sid])
-
-                ldap = self.api.Backend.ldap2
-                group_container = DN(api.env.container_group, api.env.basedn)
-                try:
-                    entries, truncated = ldap.find_entries(filter_sids, ['memberof'], group_container)
-                except errors.NotFound:
-                    request.user.groups = []
-                else:
-                    groups = []
-                    for entry in entries:
-                        memberof_dns = entry.get('memberof', [])
-                        for memberof_dn in memberof_dns:
-                            if memberof_dn.endswith(group_container):
-                                groups.append(memberof_dn[0][0].value)
-                    request.user.groups = sorted(set(groups))
-            else:
-                # try searching for a local user
-                try:
-                    request.user.name = options['user']
-                    search_result = self.api.Command.user_show(request.user.name)['result']
-                    groups = search_result['memberof_group']
-                    if 'memberofindirect_group' in search_result:
-                        groups += search_result['memberofindirect_group']
-                    request.user.groups = sorted(set(groups))
-                except:
-                    pass
+        (name, groups) = self._resolve_user(options['user'])
+        if name is not None:
+            request.user.name = name
+            request.user.groups = groups
 
-        if options['service'] != u'all':
-            try:
-                request.service.name = options['service']
-                service_result = self.api.Command.hbacsvc_show(request.service.name)['result']
-                if 'memberof_hbacsvcgroup' in service_result:
-                    request.service.groups = service_result['memberof_hbacsvcgroup']
-            except:
-                pass
-
-        if options['targethost'] != u'all':
-            try:
-                request.targethost.name = self.canonicalize(options['targethost'])
-                tgthost_result = self.api.Command.host_show(request.targethost.name)['result']
-                groups = tgthost_result['memberof_hostgroup']
-                if 'memberofindirect_hostgroup' in tgthost_result:
-                    groups += tgthost_result['memberofindirect_hostgroup']
-                request.targethost.groups = sorted(set(groups))
-            except:
-                pass
+        (name, groups) = self._resolve_service(options['service'])
+        if name is not None:
+            request.service.name = name
+            request.service.groups = groups
+
+        (name, groups) = self._resolve_host(options['targethost'])
+        if name is not None:
+            request.targethost.name = name
+            request.targethost.groups = groups
 
         matched_rules = []
         notmatched_rules = []
@@ -514,3 +801,151 @@ class hbactest(Command):
         # Propagate integer value for result. It will give proper command line result for scripts
         return int(not output['value'])
 
+
+
+@register()
+class hbactest_batch(hbactest):
+    __doc__ = _('Simulate use of Host-based access controls for many requests')
+
+    has_output = (
+        output.summary,
+        output.Output('count', int, _('Number of requests tested')),
+        output.Output('results', (list, tuple), _('Result of each request')),
+    )
+
+    has_output_params = (
+        Flag('value',
+             label=_('Access granted'),
+        ),
+        Str('matched*',
+            label=_('Matched rules'),
+        ),
+        Str('error*',
+            label=_('Non-existent or invalid rules'),
+        ),
+    )
+
+    takes_options = (
+        Str('user*',
+            cli_name='users',
+            label=_('User name'),
+            doc=_('Users to test with each of the hosts and services'),
+            csv=True,
+        ),
+        Str('targethost*',
+            cli_name='hosts',
+            label=_('Target host'),
+            doc=_('Target hosts to test with each of the users and services'),
+            csv=True,
+        ),
+        Str('service*',
+            cli_name='services',
+            label=_('Service'),
+            doc=_('Services to test with each of the users and hosts'),
+            csv=True,
+        ),
+        Str('request*',
+            cli_name='request',
+            label=_('Request'),
+            doc=_('Request to test, as USER:HOST:SERVICE'),
+        ),
+        Str('rules*',
+             cli_name='rules',
+             label=_('Rules to test. If not specified, --enabled is assumed'),
+             csv=True,
+        ),
+        Flag('nodetail?',
+             cli_name='nodetail',
+             label=_('Hide which rules are matched by each request'),
+        ),
+        Flag('enabled?',
+             cli_name='enabled',
+             label=_('Include all enabled IPA rules into test [default]'),
+        ),
+        Flag('disabled?',
+             cli_name='disabled',
+             label=_('Include all disabled IPA rules into test'),
+        ),
+    )
+
+    def execute(self, *args, **options):
+        requests = []
+        for request in options.get('request') or ():
+            parts = tuple(request.split(u':'))
+            if len(parts) != 3 or not all(parts):
+                raise errors.ValidationError(
+                    name='request', error=_('must be USER:HOST:SERVICE'))
+            requests.append(parts)
+
+        users = options.get('user') or ()
+        hosts = options.get('targethost') or ()
+        services = options.get('service') or ()
+        if users or hosts or services:
+            if not (users and hosts and services):
+                raise errors.ValidationError(
+                    name='user',
+                    error=_('users, hosts and services are all required to '
+                            'test each of their combinations'))
+            requests.extend(itertools.product(users, hosts, services))
+        if not requests:
+            raise errors.RequirementError(name='request')
+
+        testrules = options.get('rules')
+        if testrules:
+            hbacset = []
+            unresolved = []
+            for rule in testrules:
+                try:
+                    hbacset.append(self.api.Command.hbacrule_show(rule)['result'])
+                except errors.NotFound:
+                    unresolved.append(rule)
+            if unresolved:
+                raise errors.NotFound(
+                    reason=_('Unresolved rules in --rules: %s') %
+                    u', '.join(unresolved))
+            ruleset = HBACRuleSet(hbacset)
+            positions = range(len(ruleset.rules))
+        else:
+            ruleset = self._get_ruleset()
+            all_disabled = bool(options['disabled'])
+            all_enabled = bool(options['enabled']) or not all_disabled
+            positions = ruleset.select(all_enabled, all_disabled)
+
+        # each user, host and service is looked up once
+        resolved = dict(user={}, targethost={}, service={})
+        resolvers = dict(user=self._resolve_user,
+                         targethost=self._resolve_host,
+                         service=self._resolve_service)
+        def resolve(element, name):
+            cache = resolved[element]
+            if name not in cache:
+                cache[name] = resolvers[element](name)
+            return cache[name]
+
+        results = []
+        granted = 0
+        for (user, host, service) in requests:
+            (matched, failed) = ruleset.match(
+                positions,
+                user=resolve('user', user),
+                targethost=resolve('targethost', host),
+                service=resolve('service', service))
+            result = dict(user=user, targethost=host, service=service,
+                          value=bool(matched))
+            if not options['nodetail']:
+                result['matched'] = [ruleset.names[i] for i in matched]
+            if failed:
+                result['error'] = [ruleset.names[i] for i in failed]
+            results.append(result)
+            if matched:
+                granted += 1
+
+        summary = ngettext(
+            '%(granted)d of %(count)d request granted',
+            '%(granted)d of %(count)d requests granted', 0) % dict(
+                granted=granted, count=len(results))
+        return dict(summary=unicode(summary), count=len(results),
+                    results=results)
+
+    def output_for_cli(self, textui, output, *args, **options):
+        return Command.output_for_cli(self, textui, output, *args, **options)
@@ -283,6 +283,7 @@ class host(LDAPObject):
     Host object.
     """
     container_dn = api.env.container_host
+    vlv_container_dn = api.env.container_host
     object_name = _('host')
     object_name_plural = _('hosts')
     object_class = ['ipaobject', 'nshost', 'ipahost', 'pkiuser', 'ipaservice']
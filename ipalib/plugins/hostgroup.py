@@ -74,6 +74,7 @@ class hostgroup(LDAPObject):
     Hostgroup object.
     """
     container_dn = api.env.container_hostgroup
+    vlv_container_dn = api.env.container_hostgroup
     object_name = _('host group')
     object_name_plural = _('host groups')
     object_class = ['ipaobject', 'ipahostgroup']
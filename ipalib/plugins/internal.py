@@ -23,18 +23,74 @@
 Plugins not accessible directly through the CLI, commands used internally
 """
 
+import os
 import json
+import hashlib
+import threading
+from types import NoneType
 
 from ipalib import api
 from ipalib import Command
 from ipalib import Str
 from ipalib.output import Output
+from ipalib.request import context
 from ipalib.text import _
 from ipalib.util import json_serialize
+from ipalib.schema import get_schema
 from ipalib.plugable import Registry
 
 register = Registry()
 
+
+def get_languages():
+    """
+    Return the languages messages are translated to in this request, see
+    `ipalib.text.create_translation`.
+    """
+    languages = getattr(context, 'languages', None)
+    if languages is not None:
+        return tuple(languages)
+    # the variables gettext looks at
+    for envar in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
+        value = os.environ.get(envar)
+        if value:
+            return (value,)
+    return ()
+
+
+class OutputCache(object):
+    """
+    Serialized output of a command, cached per language.
+
+    The output of the commands using the cache only depends on the plugins
+    and the language, it is serialized with `json_serialize` only once.
+    Each output has a weak ETag, the hash of its JSON representation, which
+    is stored in ``context.result_etag`` for the RPC server to answer
+    conditional requests, see `ipaserver.rpcserver.WSGIExecutioner`.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__entries = {}
+
+    def get(self, command, key, build):
+        """
+        Return the output of ``command`` for ``key``, ``build()`` returns it
+        when it is not cached yet.
+        """
+        key = (get_languages(),) + key
+        entry = self.__entries.get(key)
+        if entry is None:
+            output = json_serialize(build())
+            etag = 'W/"%s"' % hashlib.sha1(
+                json.dumps(output, sort_keys=True)).hexdigest()
+            with self.__lock:
+                entry = self.__entries.setdefault(key, (output, etag))
+        (output, etag) = entry
+        context.result_etag = (command.name, etag)
+        # the caller may add messages to the output
+        return dict(output)
+
 @register()
 class json_metadata(Command):
     """
@@ -70,77 +126,90 @@ class json_metadata(Command):
         Output('commands', dict, doc=_('Dict of JSON encoded IPA Commands')),
     )
 
-    def execute(self, objname, methodname, **options):
-        objects = dict()
-        methods = dict()
-        commands = dict()
+    def __init__(self):
+        super(json_metadata, self).__init__()
+        self.__cache = OutputCache()
 
+    def execute(self, objname, methodname, **options):
         empty = True
 
-        try:
-            if not objname:
-                objname = options['object']
-            if objname in self.api.Object:
-                o = self.api.Object[objname]
-                objects = dict([(o.name, json_serialize(o))])
-            elif objname == "all":
-                objects = dict(
-                    (o.name, json_serialize(o)) for o in self.api.Object()
-                )
+        if not objname:
+            objname = options.get('object')
+        if objname is not None or 'object' in options:
             empty = False
-        except KeyError:
-            pass
-
-        try:
-            if not methodname:
-                methodname = options['method']
-            if methodname in self.api.Method:
-                m = self.api.Method[methodname]
-                methods = dict([(m.name, json_serialize(m))])
-            elif methodname == "all":
-                methods = dict(
-                    (m.name, json_serialize(m)) for m in self.api.Method()
-                )
+
+        if not methodname:
+            methodname = options.get('method')
+        if methodname is not None or 'method' in options:
             empty = False
-        except KeyError:
-            pass
-
-        try:
-            cmdname = options['command']
-            if cmdname in self.api.Command:
-                c = self.api.Command[cmdname]
-                commands = dict([(c.name, json_serialize(c))])
-            elif cmdname == "all":
-                commands = dict(
-                    (c.name, json_serialize(c)) for c in self.api.Command()
-                )
+
+        cmdname = options.get('command')
+        if 'command' in options:
             empty = False
-        except KeyError:
-            pass
 
         if empty:
-            objects = dict(
-                (o.name, json_serialize(o)) for o in self.api.Object()
-            )
-            methods = dict(
-                (m.name, json_serialize(m)) for m in self.api.Method()
-            )
-            commands = dict(
-                (c.name, json_serialize(c)) for c in self.api.Command()
-            )
-
-        retval = dict([
-            ("objects", objects),
-            ("methods", methods),
-            ("commands", commands),
-        ])
-
-        return retval
+            objname = methodname = cmdname = 'all'
+
+        # names which are not exported are not cached
+        key = (
+            self.__select(self.api.Object, objname),
+            self.__select(self.api.Method, methodname),
+            self.__select(self.api.Command, cmdname),
+        )
+
+        def build():
+            (objname, methodname, cmdname) = key
+            return dict([
+                ("objects", self.__serialize(self.api.Object, objname)),
+                ("methods", self.__serialize(self.api.Method, methodname)),
+                ("commands", self.__serialize(self.api.Command, cmdname)),
+            ])
+
+        return self.__cache.get(self, key, build)
+
+    def __select(self, namespace, name):
+        if name in namespace or name == "all":
+            return name
+        return None
+
+    def __serialize(self, namespace, name):
+        if name == "all":
+            return dict((p.name, p) for p in namespace())
+        elif name is not None:
+            return dict([(name, namespace[name])])
+        return dict()
 
     def output_for_cli(self, textui, result, *args, **options):
         print json.dumps(result, default=json_serialize)
 
 
+@register()
+class schema(Command):
+    """
+    Export the schema of the CLI commands, see ipalib.schema.
+    """
+    NO_CLI = True
+
+    takes_options = (
+        Str('known_fingerprint?',
+            doc=_('Fingerprint of the schema known to the client'),
+        ),
+    )
+
+    has_output = (
+        Output('fingerprint', unicode, doc=_('Fingerprint of the schema')),
+        Output('commands', (dict, NoneType),
+            doc=_('Dict of command schemas, None if the known fingerprint '
+                  'is current')),
+    )
+
+    def execute(self, **options):
+        (commands, fingerprint) = get_schema(self.api)
+        if options.get('known_fingerprint') == fingerprint:
+            commands = None
+        return dict(fingerprint=fingerprint, commands=commands)
+
+
 @register()
 class i18n_messages(Command):
     NO_CLI = True
@@ -819,8 +888,13 @@ class i18n_messages(Command):
     has_output = (
         Output('texts', dict, doc=_('Dict of I18N messages')),
     )
+
+    def __init__(self):
+        super(i18n_messages, self).__init__()
+        self.__cache = OutputCache()
+
     def execute(self, **options):
-        return dict(texts=json_serialize(self.messages))
+        return self.__cache.get(self, (), lambda: dict(texts=self.messages))
 
     def output_for_cli(self, textui, result, *args, **options):
         print json.dumps(result, default=json_serialize)
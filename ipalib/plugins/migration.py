@@ -17,14 +17,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
+import hashlib
+import os
+import Queue
 import re
+import sys
+import threading
 from ldap import MOD_ADD
 
 from ipalib import api, errors, output
-from ipalib import Command, Password, Str, Flag, StrEnum, DNParam, File, Bool
+from ipalib import Command, Password, Str, Flag, StrEnum, DNParam, File, Bool, Int
 from ipalib.cli import to_cli
 from ipalib.plugable import Registry
 from ipalib.plugins.user import NO_UPG_MAGIC
+from ipalib.request import destroy_context
 if api.env.in_server and api.env.context in ['lite', 'server']:
     try:
         from ipaserver.plugins.ldap2 import ldap2
@@ -113,6 +120,16 @@ EXAMPLES:
        --user-ignore-attribute=radiusgroupname \\
        ldap://ds.example.com:389
 
+Users and groups are read from the LDAP server one page at a time. Use
+the --workers option to migrate several of them concurrently, each
+worker uses its own connections to the LDAP server and to IPA.
+
+The primary keys of the migrated users and groups are recorded on the
+IPA server while the migration runs. When an interrupted migration is
+run again with the same LDAP URI and base DN, the users and groups
+migrated by the previous run are skipped. The record is removed when
+the migration completes.
+
 LOGGING
 
 Migration will log warnings and errors to the Apache error log. This
@@ -120,7 +137,7 @@ file should be evaluated post-migration to correct or investigate any
 issues that were discovered.
 
 For every 100 users migrated an info-level message will be displayed to
-give the current progress and duration to make it possible to track
+give the current progress, duration and rate to make it possible to track
 the progress of migration.
 
 If the log level is debug, either by setting debug = True in
@@ -288,30 +305,32 @@ def _update_default_group(ldap, ctx, force):
     # Purposely let this fire when migrate_cnt == 0 so on re-running migration
     # it can catch any users migrated but not added to the default group.
     if force or migrate_cnt % 100 == 0:
-        s = datetime.datetime.now()
-        searchfilter = "(&(objectclass=posixAccount)(!(memberof=%s)))" % group_dn
-        try:
-            (result, truncated) = ldap.find_entries(searchfilter,
-                [''], DN(api.env.container_user, api.env.basedn),
-                scope=ldap.SCOPE_SUBTREE, time_limit=-1, size_limit=-1)
-        except errors.NotFound:
-            api.log.debug('All users have default group set')
-            return
+        # workers of a parallel migration share the context
+        with ctx['lock']:
+            s = datetime.datetime.now()
+            searchfilter = "(&(objectclass=posixAccount)(!(memberof=%s)))" % group_dn
+            try:
+                (result, truncated) = ldap.find_entries(searchfilter,
+                    [''], DN(api.env.container_user, api.env.basedn),
+                    scope=ldap.SCOPE_SUBTREE, time_limit=-1, size_limit=-1)
+            except errors.NotFound:
+                api.log.debug('All users have default group set')
+                return
 
-        member_dns = [m.dn for m in result]
-        modlist = [(MOD_ADD, 'member', ldap.encode(member_dns))]
-        try:
-            with ldap.error_handler():
-                ldap.conn.modify_s(str(group_dn), modlist)
-        except errors.DatabaseError as e:
-            api.log.error('Adding new members to default group failed: %s \n'
-                          'members: %s', e, ','.join(member_dns))
-
-        e = datetime.datetime.now()
-        d = e - s
-        mode = " (forced)" if force else ""
-        api.log.info('Adding %d users to group%s duration %s',
-                      len(member_dns), mode, d)
+            member_dns = [m.dn for m in result]
+            modlist = [(MOD_ADD, 'member', ldap.encode(member_dns))]
+            try:
+                with ldap.error_handler():
+                    ldap.conn.modify_s(str(group_dn), modlist)
+            except errors.DatabaseError as e:
+                api.log.error('Adding new members to default group failed: %s \n'
+                              'members: %s', e, ','.join(member_dns))
+
+            e = datetime.datetime.now()
+            d = e - s
+            mode = " (forced)" if force else ""
+            api.log.info('Adding %d users to group%s duration %s',
+                          len(member_dns), mode, d)
 
 # GROUP MIGRATION CALLBACKS AND VARS
 
@@ -438,6 +457,89 @@ def validate_ldapuri(ugettext, ldapuri):
         raise errors.ValidationError(name='ldap_uri', error=err_msg)
 
 
+class MigrationCheckpoint(object):
+    """
+    File recording the primary keys of the objects migrated from a DS, so
+    that a migration which was interrupted can be resumed.
+
+    Each line of the file is an object name and a primary key separated by
+    a tab.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        self._file = None
+
+    @classmethod
+    def for_source(cls, ldapuri, ds_base_dn, searches):
+        """
+        Return the checkpoint of the migration from ``ds_base_dn`` on the
+        server ``ldapuri``.
+
+        ``searches`` is a list of (object name, search base, search filter)
+        tuples of the objects migrated, a migration with different search
+        options has a different checkpoint.
+        """
+        name = hashlib.sha1('%s\n%s' % (ldapuri.lower().encode('utf-8'),
+                                        ds_base_dn))
+        for (obj_name, search_base, search_filter) in sorted(searches):
+            name.update('\n%s\t%s\t%s' % (
+                obj_name, search_base, search_filter.lower().encode('utf-8')))
+        return cls(os.path.join(paths.IPA_MIGRATION_CHECKPOINT_DIR,
+                                name.hexdigest()))
+
+    def load(self):
+        """
+        Read the primary keys recorded by previous runs and open the file
+        for recording.
+        """
+        size = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        # written partially when the previous run died
+                        break
+                    (obj_name, pkey) = line[:-1].decode('utf-8').split(u'\t', 1)
+                    self.done.setdefault(obj_name, set()).add(pkey)
+                    size += len(line)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        self._file = open(self.path, 'a')
+        # drop the partial line, new lines must not be appended to it
+        self._file.truncate(size)
+
+    def get(self, obj_name):
+        """
+        Return the set of primary keys of ``obj_name`` objects migrated by
+        previous runs.
+        """
+        return self.done.get(obj_name, frozenset())
+
+    def add(self, obj_name, pkey):
+        line = u'%s\t%s\n' % (obj_name, pkey)
+        self._file.write(line.encode('utf-8'))
+        self._file.flush()
+
+    def remove(self):
+        """
+        Remove the file after a complete migration.
+        """
+        self.close()
+        try:
+            os.unlink(self.path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
 @register()
 class migrate_ds(Command):
     __doc__ = _('Migrate users and groups from DS to IPA.')
@@ -484,6 +586,9 @@ class migrate_ds(Command):
     }
     migrate_order = ('user', 'group')
 
+    # number of entries read from DS ahead of each worker
+    queue_size_per_worker = 100
+
     takes_args = (
         Str('ldapuri', validate_ldapuri,
             cli_name='ldap_uri',
@@ -611,6 +716,15 @@ class migrate_ds(Command):
             default=True,
             autofill=True,
         ),
+        Int('workers?',
+            cli_name='workers',
+            label=_('Workers'),
+            doc=_('Number of objects migrated concurrently (default: 1)'),
+            minvalue=1,
+            maxvalue=32,
+            default=1,
+            autofill=True,
+        ),
     )
 
     has_output = (
@@ -696,15 +810,134 @@ can use their Kerberos accounts.''')
             search_bases[ldap_obj_name] = search_base
         return search_bases
 
-    def migrate(self, ldap, config, ds_ldap, ds_base_dn, options):
+    def _iter_ds_entries(self, ds_ldap, ldap_obj, search_filter, search_base,
+                         oc_list, options):
+        """
+        Iterate over entries to be migrated, one page at a time.
+        """
+        found = False
+        try:
+            for entry_attrs in ds_ldap.iter_entries(
+                    search_filter, ['*'], search_base,
+                    ds_ldap.SCOPE_ONELEVEL,
+                    time_limit=0, size_limit=-1,
+                    search_refs=True,   # migrated DS may contain search references
+                    paged_search=True):
+                found = True
+                yield entry_attrs
+        except errors.LimitsExceeded:
+            self.log.error(
+                '%s: %s' % (
+                    ldap_obj.name, self.truncated_err_msg
+                )
+            )
+            return
+        except errors.NotFound:
+            pass
+
+        if not found and not options.get('continue', False):
+            raise errors.NotFound(
+                reason=_('%(container)s LDAP search did not return any result '
+                         '(search base: %(search_base)s, '
+                         'objectclass: %(objectclass)s)')
+                         % {'container': ldap_obj.name,
+                            'search_base': search_base,
+                            'objectclass': ', '.join(oc_list)}
+            )
+
+    def _can_migrate_parallel(self):
+        # worker threads bind with the Kerberos credentials of the request,
+        # which only the server has
+        return (self.api.env.context in ('server', 'lite') and
+                os.environ.get('KRB5CCNAME') is not None)
+
+    def _run_pipeline(self, items, process, workers, connect):
+        """
+        Call ``process(*item)`` for each item of ``items``.
+
+        With more than one worker the items are handed over a bounded queue
+        to ``workers`` threads, each connected by calling ``connect()``, so
+        that only a limited number of items is read ahead.  The first
+        exception raised in a worker stops the pipeline and is re-raised.
+        """
+        if workers < 2:
+            for item in items:
+                process(*item)
+            return
+
+        queue = Queue.Queue(maxsize=workers * self.queue_size_per_worker)
+        failures = []
+        threads = []
+        for n in xrange(workers):
+            thread = threading.Thread(
+                target=self._pipeline_worker,
+                args=(queue, process, connect, failures))
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for item in items:
+                if failures:
+                    break
+                queue.put(item)
+        finally:
+            for thread in threads:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if failures:
+            raise failures[0][0], failures[0][1], failures[0][2]
+
+    def _pipeline_worker(self, queue, process, connect, failures):
+        try:
+            try:
+                connect()
+            except Exception:
+                failures.append(sys.exc_info())
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                if failures:
+                    # keep draining the queue so that the reader never blocks
+                    continue
+                try:
+                    process(*item)
+                except Exception:
+                    failures.append(sys.exc_info())
+        finally:
+            destroy_context()
+
+    def migrate(self, ldap, config, ds_ldap, ds_base_dn, options,
+                ds_connect=None, checkpoint=None):
         """
         Migrate objects from DS to LDAP.
+
+        Entries are read from DS one page at a time and migrated by
+        options['workers'] threads.  Each worker connects to DS with the
+        ``ds_connect`` keyword arguments of `ldap2.connect`.  Primary keys
+        recorded in ``checkpoint`` by a previous run are skipped and the
+        newly migrated ones are added to it.
         """
         assert isinstance(ds_base_dn, DN)
         migrated = {} # {'OBJ': ['PKEY1', 'PKEY2', ...], ...}
         failed = {} # {'OBJ': {'PKEY1': 'Failed 'cos blabla', ...}, ...}
         search_bases = self._get_search_bases(options, ds_base_dn, self.migrate_order)
         migration_start = datetime.datetime.now()
+
+        workers = options.get('workers') or 1
+        if workers > 1 and (ds_connect is None or
+                            not self._can_migrate_parallel()):
+            self.log.info('Parallel migration is not available, migrating '
+                          'with a single worker')
+            workers = 1
+        ccache = os.environ.get('KRB5CCNAME')
+
+        def connect():
+            ldap.connect(ccache=ccache)
+            ds_ldap.connect(**ds_connect)
+
         for ldap_obj_name in self.migrate_order:
             ldap_obj = self.api.Object[ldap_obj_name]
 
@@ -714,36 +947,19 @@ can use their Kerberos accounts.''')
 
             exclude = options['exclude_%ss' % to_cli(ldap_obj_name)]
             context = dict(ds_ldap = ds_ldap)
+            context['lock'] = threading.Lock()
 
             migrated[ldap_obj_name] = []
             failed[ldap_obj_name] = {}
 
-            try:
-                entries, truncated = ds_ldap.find_entries(
-                    search_filter, ['*'], search_bases[ldap_obj_name],
-                    ds_ldap.SCOPE_ONELEVEL,
-                    time_limit=0, size_limit=-1,
-                    search_refs=True    # migrated DS may contain search references
-                )
-            except errors.NotFound:
-                if not options.get('continue',False):
-                    raise errors.NotFound(
-                        reason=_('%(container)s LDAP search did not return any result '
-                                 '(search base: %(search_base)s, '
-                                 'objectclass: %(objectclass)s)')
-                                 % {'container': ldap_obj_name,
-                                    'search_base': search_bases[ldap_obj_name],
-                                    'objectclass': ', '.join(oc_list)}
-                    )
-                else:
-                    truncated = False
-                    entries = []
-            if truncated:
-                self.log.error(
-                    '%s: %s' % (
-                        ldap_obj.name, self.truncated_err_msg
-                    )
-                )
+            if checkpoint is not None:
+                done = checkpoint.get(ldap_obj_name)
+            else:
+                done = frozenset()
+
+            entries = self._iter_ds_entries(
+                ds_ldap, ldap_obj, search_filter, search_bases[ldap_obj_name],
+                oc_list, options)
 
             blacklists = {}
             for blacklist in ('oc_blacklist', 'attr_blacklist'):
@@ -764,26 +980,39 @@ can use their Kerberos accounts.''')
                     raise errors.NotFound(reason=error_msg)
 
             context['has_upg'] = ldap.has_upg()
-
-            valid_gids = set()
-            invalid_gids = set()
-            migrate_cnt = 0
             context['migrate_cnt'] = 0
-            for entry_attrs in entries:
-                context['migrate_cnt'] = migrate_cnt
-                s = datetime.datetime.now()
 
-                ava = entry_attrs.dn[0][0]
-                if ava.attr == ldap_obj.primary_key.name:
-                    # In case if pkey attribute is in the migrated object DN
-                    # and the original LDAP is multivalued, make sure that
-                    # we pick the correct value (the unique one stored in DN)
-                    pkey = ava.value.lower()
-                else:
-                    pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
+            callback_kw = dict(
+                schema=options['schema'],
+                search_bases=search_bases,
+                valid_gids=set(),
+                invalid_gids=set(),
+                **blacklists
+            )
+            lock = threading.Lock()
+            skipped = [0]
+
+            def read_entries():
+                for entry_attrs in entries:
+                    ava = entry_attrs.dn[0][0]
+                    if ava.attr == ldap_obj.primary_key.name:
+                        # In case if pkey attribute is in the migrated object DN
+                        # and the original LDAP is multivalued, make sure that
+                        # we pick the correct value (the unique one stored in DN)
+                        pkey = ava.value.lower()
+                    else:
+                        pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
 
-                if pkey in exclude:
-                    continue
+                    if pkey in exclude:
+                        continue
+                    if pkey in done:
+                        skipped[0] += 1
+                        continue
+
+                    yield (pkey, entry_attrs)
+
+            def migrate_entry(pkey, entry_attrs):
+                s = datetime.datetime.now()
 
                 entry_attrs.dn = ldap_obj.get_dn(pkey)
                 entry_attrs['objectclass'] = list(
@@ -801,17 +1030,13 @@ can use their Kerberos accounts.''')
                         entry_attrs.dn = callback(
                             ldap, pkey, entry_attrs.dn, entry_attrs,
                             failed[ldap_obj_name], config, context,
-                            schema=options['schema'],
-                            search_bases=search_bases,
-                            valid_gids=valid_gids,
-                            invalid_gids=invalid_gids,
-                            **blacklists
+                            **callback_kw
                         )
                         if not entry_attrs.dn:
-                            continue
+                            return
                     except errors.NotFound, e:
                         failed[ldap_obj_name][pkey] = unicode(e.reason)
-                        continue
+                        return
 
                 try:
                     ldap.add_entry(entry_attrs)
@@ -823,26 +1048,42 @@ can use their Kerberos accounts.''')
                                 ldap, entry_attrs.dn, entry_attrs, e, options)
                         except errors.ExecutionError, e:
                             failed[ldap_obj_name][pkey] = unicode(e)
-                            continue
+                            return
                     else:
                         failed[ldap_obj_name][pkey] = unicode(e)
-                        continue
+                        return
 
-                migrated[ldap_obj_name].append(pkey)
+                with lock:
+                    migrate_cnt = len(migrated[ldap_obj_name])
+                    migrated[ldap_obj_name].append(pkey)
+                    if checkpoint is not None:
+                        checkpoint.add(ldap_obj_name, pkey)
 
                 callback = self.migrate_objects[ldap_obj_name]['post_callback']
                 if callable(callback):
+                    # every entry sees the number of entries migrated before
+                    # it, whichever worker migrated them
                     callback(
                         ldap, pkey, entry_attrs.dn, entry_attrs,
-                        failed[ldap_obj_name], config, context)
+                        failed[ldap_obj_name], config,
+                        dict(context, migrate_cnt=migrate_cnt))
                 e = datetime.datetime.now()
                 d = e - s
                 total_dur = e - migration_start
                 migrate_cnt += 1
-                if migrate_cnt > 0 and migrate_cnt % 100 == 0:
-                    api.log.info("%d %ss migrated. %s elapsed." % (migrate_cnt, ldap_obj_name, total_dur))
+                if migrate_cnt % 100 == 0:
+                    rate = migrate_cnt / max(total_dur.total_seconds(), 1e-3)
+                    api.log.info("%d %ss migrated. %s elapsed, %.1f %ss/s." % (
+                        migrate_cnt, ldap_obj_name, total_dur, rate,
+                        ldap_obj_name))
                 api.log.debug("%d %ss migrated, duration: %s (total %s)" % (migrate_cnt, ldap_obj_name, d, total_dur))
 
+            self._run_pipeline(read_entries(), migrate_entry, workers, connect)
+
+            if skipped[0]:
+                api.log.info("%d %ss migrated by a previous run skipped." % (
+                    skipped[0], ldap_obj_name))
+
         if 'def_group_dn' in context:
             _update_default_group(ldap, context, True)
 
@@ -864,19 +1105,25 @@ can use their Kerberos accounts.''')
         # connect to DS
         ds_ldap = ldap2(shared_instance=False, ldap_uri=ldapuri, base_dn='')
 
-        cacert = None
+        tmp_ca_cert_f = None
+        ds_connect = dict(bind_dn=options['binddn'], bind_pw=bindpw)
         if options.get('cacertfile') is not None:
-            #store CA cert into file
+            #store CA cert into file, it is kept until the workers of the
+            #migration are connected
             tmp_ca_cert_f = write_tmp_file(options['cacertfile'])
-            cacert = tmp_ca_cert_f.name
+            ds_connect['tls_cacertfile'] = tmp_ca_cert_f.name
 
-            #start TLS connection
-            ds_ldap.connect(bind_dn=options['binddn'], bind_pw=bindpw,
-                tls_cacertfile=cacert)
+        try:
+            return self._execute(ldap, config, ds_ldap, ds_connect, ds_base_dn,
+                                 ldapuri, options)
+        finally:
+            if tmp_ca_cert_f is not None:
+                tmp_ca_cert_f.close()
 
-            tmp_ca_cert_f.close()
-        else:
-            ds_ldap.connect(bind_dn=options['binddn'], bind_pw=bindpw)
+    def _execute(self, ldap, config, ds_ldap, ds_connect, ds_base_dn, ldapuri,
+                 options):
+        #start TLS connection if a CA certificate was given
+        ds_ldap.connect(**ds_connect)
 
         #check whether the compat plugin is enabled
         if not options.get('compat'):
@@ -902,10 +1149,36 @@ can use their Kerberos accounts.''')
                 except (IndexError, KeyError), e:
                     raise StandardError(str(e))
 
+        search_bases = self._get_search_bases(options, ds_base_dn,
+                                              self.migrate_order)
+        searches = []
+        for ldap_obj_name in self.migrate_order:
+            template = self.migrate_objects[ldap_obj_name]['filter_template']
+            oc_list = options[to_cli(
+                self.migrate_objects[ldap_obj_name]['oc_option'])]
+            searches.append((ldap_obj_name, search_bases[ldap_obj_name],
+                             construct_filter(template, oc_list)))
+        checkpoint = MigrationCheckpoint.for_source(ldapuri, ds_base_dn,
+                                                    searches)
+        try:
+            checkpoint.load()
+        except (IOError, OSError, ValueError), e:
+            self.log.warning('Cannot use migration checkpoint %s, the '
+                             'migration will not be resumable: %s',
+                             checkpoint.path, e)
+            checkpoint = None
+
         # migrate!
-        (migrated, failed) = self.migrate(
-            ldap, config, ds_ldap, ds_base_dn, options
-        )
+        try:
+            (migrated, failed) = self.migrate(
+                ldap, config, ds_ldap, ds_base_dn, options,
+                ds_connect=ds_connect, checkpoint=checkpoint
+            )
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        if checkpoint is not None:
+            checkpoint.remove()
 
         return dict(result=migrated, failed=failed, enabled=True, compat=True)
 
@@ -122,6 +122,7 @@ class user(baseuser):
     """
 
     container_dn              = baseuser.active_container_dn
+    vlv_container_dn          = baseuser.active_container_dn
     label                     = _('Users')
     label_singular            = _('User')
     object_name               = _('user')
@@ -40,6 +40,10 @@ import base64
 import urllib
 import json
 import socket
+import time
+import zlib
+import httplib
+from cStringIO import StringIO
 from urllib2 import urlparse
 
 from xmlrpclib import (Binary, Fault, DateTime, dumps, loads, ServerProxy,
@@ -306,6 +310,109 @@ def json_encode_binary(val, version):
         return val
 
 
+_json_encode_string = json.encoder.encode_basestring_ascii
+
+
+def json_dumps_binary(val, version):
+    """
+    Serialize val to a compact JSON document.
+
+    Values which JSON cannot represent are encoded the same way
+    json_encode_binary() encodes them, but in a single pass over val, without
+    copying it first. Dict keys are not sorted and no whitespace is emitted.
+    """
+    datetime_values = capabilities.client_has_capability(
+        version, 'datetime_values')
+    dns_name_values = capabilities.client_has_capability(
+        version, 'dns_name_values')
+    chunks = []
+    append = chunks.append
+
+    def dump_dict(val):
+        append('{')
+        first = True
+        for k, v in val.iteritems():
+            if first:
+                first = False
+            else:
+                append(',')
+            if isinstance(k, basestring):
+                append(_json_encode_string(k))
+            else:
+                # same as the json module, non-string keys are converted
+                append(json.dumps(unicode(json.dumps(k))))
+            append(':')
+            dump(v)
+        append('}')
+
+    def dump_list(val):
+        if len(val) == 1 and type(val[0]) is unicode:
+            # the usual single valued attribute
+            append('[%s]' % _json_encode_string(val[0]))
+            return
+        append('[')
+        first = True
+        for v in val:
+            if first:
+                first = False
+            else:
+                append(',')
+            dump(v)
+        append(']')
+
+    def dump(val):
+        # exact type checks first, they are much faster than isinstance()
+        t = type(val)
+        if t is unicode:
+            append(_json_encode_string(val))
+        elif t is tuple or t is list:
+            dump_list(val)
+        elif t is dict:
+            dump_dict(val)
+        elif t is str:
+            append('{"__base64__":"%s"}' % base64.b64encode(val))
+        elif val is None:
+            append('null')
+        elif val is True:
+            append('true')
+        elif val is False:
+            append('false')
+        elif t is int or t is long:
+            append(str(val))
+        elif isinstance(val, unicode):
+            append(_json_encode_string(val))
+        elif isinstance(val, dict):
+            dump_dict(val)
+        elif isinstance(val, (list, tuple)):
+            dump_list(val)
+        elif isinstance(val, str):
+            append('{"__base64__":"%s"}' % base64.b64encode(val))
+        elif isinstance(val, (int, long)):
+            append(str(val))
+        elif isinstance(val, Decimal):
+            append('{"__base64__":"%s"}' % base64.b64encode(str(val)))
+        elif isinstance(val, DN):
+            append(_json_encode_string(str(val)))
+        elif isinstance(val, datetime.datetime):
+            value = _json_encode_string(
+                val.strftime(LDAP_GENERALIZED_TIME_FORMAT))
+            if datetime_values:
+                append('{"__datetime__":%s}' % value)
+            else:
+                append(value)
+        elif isinstance(val, DNSName):
+            value = _json_encode_string(unicode(val))
+            if dns_name_values:
+                append('{"__dns_name__":%s}' % value)
+            else:
+                append(value)
+        else:
+            append(json.dumps(val))
+
+    dump(val)
+    return ''.join(chunks)
+
+
 def json_decode_binary(val):
     '''
     JSON cannot transport binary data. In order to transport binary data we
@@ -400,10 +507,36 @@ class DummyParser(object):
 
 
 class MultiProtocolTransport(Transport):
-    """Transport that handles both XML-RPC and JSON"""
-    def __init__(self, protocol):
+    """
+    Transport that handles both XML-RPC and JSON
+
+    The HTTP/1.1 connection to the server is kept open and reused by the
+    following requests until the transport is closed.  ``stats`` counts the
+    ``connections`` opened and the ``requests`` sent.
+    """
+    def __init__(self, protocol, stats=None):
         Transport.__init__(self)
         self.protocol = protocol
+        if stats is None:
+            stats = dict(connections=0, requests=0)
+        self.stats = stats
+
+    def request(self, host, handler, request_body, verbose=0):
+        # Retry once if the server closed a kept-alive connection, like
+        # xmlrpclib does for socket errors.  NSS raises NSPRError instead.
+        for i in (0, 1):
+            conn = self._connection[1]
+            reused = getattr(conn, 'sock', None) is not None
+            try:
+                return self.single_request(host, handler, request_body,
+                                           verbose)
+            except (socket.error, NSPRError, httplib.BadStatusLine), e:
+                self.close()
+                if i or not reused:
+                    raise
+                root_logger.debug(
+                    "kept-alive connection to %s failed, reconnecting: %s",
+                    host, e)
 
     def getparser(self):
         if self.protocol == 'json':
@@ -412,6 +545,21 @@ class MultiProtocolTransport(Transport):
         else:
             return Transport.getparser(self)
 
+    def send_request(self, connection, handler, request_body):
+        if getattr(connection, 'sock', None) is None:
+            # httplib opens the connection when the request is sent
+            self.stats['connections'] += 1
+        self.stats['requests'] += 1
+        connection.putrequest("POST", handler, skip_accept_encoding=True)
+        connection.putheader("Accept-Encoding", "gzip, deflate")
+
+    def parse_response(self, response):
+        # xmlrpclib decodes gzip itself, deflate is decoded here
+        if (hasattr(response, 'getheader') and
+                response.getheader('Content-Encoding', '') == 'deflate'):
+            response = StringIO(zlib.decompress(response.read()))
+        return Transport.parse_response(self, response)
+
     def send_content(self, connection, request_body):
         if self.protocol == 'json':
             connection.putheader("Content-Type", "application/json")
@@ -498,10 +646,12 @@ class SSLTransport(LanguageAwareTransport):
                                  tls_version_max=api.env.tls_version_max)
         self.dbdir=dbdir
 
-        conn.connect()
         if sys.version_info < (2, 7):
+            conn.connect()
             return conn
         else:
+            # httplib connects when the first request is sent and again
+            # after the server closed the connection
             self._connection = host, conn
             return self._connection[1]
 
@@ -568,12 +718,6 @@ class KerbTransport(SSLTransport):
 
         return (host, extra_headers, x509)
 
-    def single_request(self, host, handler, request_body, verbose=0):
-        try:
-            return SSLTransport.single_request(self, host, handler, request_body, verbose)
-        finally:
-            self.close()
-
     def store_session_cookie(self, cookie_header):
         '''
         Given the contents of a Set-Cookie header scan the header and
@@ -648,6 +792,17 @@ class RPCClient(Connectible):
     protocol = None
     env_rpc_uri_key = None
 
+    def __init__(self, shared_instance=False):
+        super(RPCClient, self).__init__(shared_instance)
+        self.stats = dict(connections=0, requests=0)
+
+    def get_stats(self):
+        """
+        Return the numbers of HTTP connections opened and requests sent
+        by this client.
+        """
+        return dict(self.stats)
+
     def get_url_list(self, rpc_uri):
         """
         Create a list of urls consisting of the available IPA servers.
@@ -796,7 +951,8 @@ class RPCClient(Connectible):
                     transport_class = KerbTransport
             else:
                 transport_class = LanguageAwareTransport
-            kw['transport'] = transport_class(protocol=self.protocol)
+            kw['transport'] = transport_class(protocol=self.protocol,
+                                              stats=self.stats)
             self.log.info('trying %s' % url)
             setattr(context, 'request_url', url)
             serverproxy = self.server_proxy_class(url, **kw)
@@ -926,6 +1082,8 @@ class RPCClient(Connectible):
                     dbdir = getattr(current_conn.conn._ServerProxy__transport, 'dbdir', None)
                     if dbdir is not None:
                         self.debug('Using dbdir %s' % dbdir)
+                    # the old transport keeps its connection alive
+                    current_conn.conn._ServerProxy__transport.close()
                 setattr(context, self.id, Connection(serverproxy, self.disconnect))
                 if dbdir is not None:
                     current_conn = getattr(context, self.id, None)
@@ -969,7 +1127,8 @@ class JSONServerProxy(object):
         self._ServerProxy__transport = transport
 
     def __request(self, name, args):
-        payload = {'method': unicode(name), 'params': args, 'id': 0}
+        payload = {'method': unicode(name), 'params': args, 'id': 0,
+                   'compact': True}
         version = args[1].get('version', VERSION_WITHOUT_CAPABILITIES)
         payload = json_encode_binary(payload, version)
 
@@ -1021,3 +1180,160 @@ class jsonclient(RPCClient):
     server_proxy_class = JSONServerProxy
     protocol = 'json'
     env_rpc_uri_key = 'jsonrpc_uri'
+
+
+class BatchFuture(object):
+    """
+    Result of a command call queued in a `BatchQueue`.
+    """
+
+    def __init__(self, queue, command, version):
+        self._queue = queue
+        self.command = command
+        self.version = version
+        self._done = False
+        self._result = None
+        self._error = None
+
+    def done(self):
+        """
+        Return True if the result of the call is known.
+        """
+        return self._done
+
+    def result(self):
+        """
+        Return the result of the call, or raise its error.
+
+        The queue is flushed if the call was not sent yet.
+        """
+        if not self._done:
+            self._queue.flush()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def set_error(self, error):
+        self._error = error
+        self._done = True
+
+
+class BatchQueue(object):
+    """
+    Queue of command calls sent to the server with a single ``batch`` call.
+
+    The arguments of a call are validated when it is queued, like
+    `frontend.Command.__call__` does, and a `BatchFuture` is returned.
+    The queued calls are sent when ``max_size`` calls are queued, when a
+    call is queued more than ``max_delay`` seconds after the oldest one,
+    when the result of a future is demanded and when the queue is used as
+    a context manager and the block exits:
+
+    >>> with BatchQueue(api) as queue:                  # doctest: +SKIP
+    ...     futures = [queue.Command.user_show(uid) for uid in uids]
+    >>> [f.result()['result'] for f in futures]         # doctest: +SKIP
+
+    The errors of the calls are raised by `BatchFuture.result`.  A queue is
+    bound to the connection of the thread which created it and it must not
+    be shared with other threads.
+    """
+
+    def __init__(self, api, max_size=100, max_delay=1.0, parallel=False):
+        self.api = api
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.parallel = parallel
+        self._calls = []
+        self._started = None
+        self.Command = BatchCommands(self)
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def call(self, name, *args, **options):
+        """
+        Queue a call of the command ``name`` and return its `BatchFuture`.
+        """
+        cmd = self.api.Command[name]
+        (args, options) = cmd.prepare(*args, **options)
+        future = BatchFuture(self, cmd, options['version'])
+        if not self._calls:
+            self._started = time.time()
+        self._calls.append((future, args, options))
+        if (len(self._calls) >= self.max_size or
+                time.time() - self._started >= self.max_delay):
+            self.flush()
+        return future
+
+    def flush(self):
+        """
+        Send the queued calls and set the results of their futures.
+        """
+        (calls, self._calls) = (self._calls, [])
+        if not calls:
+            return
+        methods = [
+            dict(method=unicode(future.command.name), params=[args, options])
+            for (future, args, options) in calls
+        ]
+        options = {}
+        if self.parallel:
+            options['parallel'] = True
+        try:
+            results = self.api.Command.batch(*methods, **options)['results']
+        except errors.PublicError, e:
+            for call in calls:
+                call[0].set_error(e)
+            return
+        for (call, result) in zip(calls, results):
+            self._set_result(call[0], result)
+
+    def _set_result(self, future, result):
+        result = dict(result)
+        error = result.pop('error', None)
+        if error is None:
+            try:
+                future.command.process_output(result, future.version)
+            except (ValueError, TypeError), e:
+                future.set_error(e)
+            else:
+                future.set_result(result)
+            return
+        code = result.get('error_code')
+        if code in errors_by_code:
+            future.set_error(errors_by_code[code](message=error))
+        else:
+            future.set_error(UnknownError(
+                code=code,
+                error=error,
+                server=getattr(context, 'request_url', None),
+            ))
+
+
+class BatchCommands(object):
+    """
+    ``api.Command`` like namespace of a `BatchQueue`.
+    """
+
+    def __init__(self, queue):
+        self.__queue = queue
+
+    def __getitem__(self, name):
+        def _call(*args, **options):
+            return self.__queue.call(name, *args, **options)
+        return _call
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
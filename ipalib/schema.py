@@ -0,0 +1,419 @@
+# Copyright (C) 2015  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Command line interface schema.
+
+The server exports the definitions of its commands, their params and
+outputs with the ``schema`` command.  The ``ipa`` client keeps them in
+`SchemaCache` and, when ``cli_schema`` is enabled, builds the command it
+runs from the cache instead of importing all plugin modules, see
+`ipalib.cli.run()`.
+
+A command built from the schema parses, validates and forwards its
+arguments like the original one, with these differences:
+
+  * Normalizers, custom rules and ``default_from`` callbacks are not part
+    of the schema.  The server still applies them, params with a
+    ``default_from`` are optional on the client and are not prompted for
+    with a default value.
+  * The output is not validated again on the client.
+
+Commands with client side code, like a custom `Command.output_for_cli()`
+or interactive prompt callbacks, are not cached and always run with all
+plugins loaded.
+"""
+
+import os
+import json
+import errno
+import locale
+import hashlib
+import decimal
+import tempfile
+import shutil
+import time
+from types import NoneType
+
+from ipalib import frontend, parameters, output
+from ipalib.errors import PublicError
+from ipalib.text import Gettext, ConcatenatedLazyText
+from ipapython.version import API_VERSION
+from ipapython.dn import DN
+from ipapython.dnsutil import DNSName
+
+# Modules of the base classes whose methods only differ from
+# `frontend.Command` on the server.
+SCHEMA_BASE_MODULES = (
+    'ipalib.frontend',
+    'ipalib.crud',
+    'ipalib.plugins.baseldap',
+)
+
+# Methods of a command which are called on the client.
+CLIENT_METHODS = (
+    '__call__',
+    'run',
+    'forward',
+    'output_for_cli',
+    'prompt_param',
+    'interactive_prompt_callback',
+)
+
+
+def serialize_value(value):
+    """
+    Return the JSON representation of a `Param` keyword argument value.
+
+    Raise ValueError if there is none.
+    """
+    if isinstance(value, (Gettext, ConcatenatedLazyText)):
+        return unicode(value)
+    if isinstance(value, (frozenset, set)):
+        return [serialize_value(v) for v in sorted(value)]
+    if isinstance(value, (list, tuple)):
+        return [serialize_value(v) for v in value]
+    if isinstance(value, (bool, int, long, float, unicode, NoneType)):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if isinstance(value, (decimal.Decimal, DN, DNSName)):
+        return unicode(value)
+    raise ValueError('cannot serialize %r' % (value,))
+
+
+def serialize_param(param):
+    """
+    Return the schema of ``param``.
+
+    The schema is a ``(class_name, name, kw)`` list, ``kw`` holds the
+    keyword arguments that differ from the defaults.  Params of classes
+    defined outside `ipalib.parameters` are exported as their closest
+    `ipalib.parameters` base class.
+    """
+    for klass in type(param).__mro__:
+        if klass.__module__ == parameters.__name__:
+            break
+    kwargs = dict((key, default) for (key, kind, default) in klass.kwargs)
+    kw = {}
+    for key in kwargs:
+        if key in ('normalizer', 'default_from'):
+            continue
+        value = getattr(param, key)
+        if value == kwargs[key] or key == 'cli_name' and value == param.name:
+            continue
+        kw[key] = serialize_value(value)
+    if param.default_from is not None:
+        # the default is computed on the server
+        kw.pop('default', None)
+        kw.pop('autofill', None)
+        kw['required'] = False
+    elif param.default is not None:
+        kw['default'] = serialize_value(param.default)
+    return [klass.__name__, param.name, kw]
+
+
+def serialize_output(o):
+    """
+    Return the schema of the `output.Output` ``o``.
+    """
+    for klass in type(o).__mro__:
+        if klass.__module__ == output.__name__:
+            break
+    return [klass.__name__, o.name, serialize_value(o.doc),
+            serialize_value(o.flags)]
+
+
+def needs_client_code(cmd):
+    """
+    Return True if ``cmd`` cannot be built from its schema on the client.
+    """
+    if isinstance(cmd, (frontend.Local, frontend.LocalOrRemote)):
+        return True
+    for name in CLIENT_METHODS:
+        for klass in type(cmd).__mro__:
+            if name in klass.__dict__:
+                if klass.__module__ not in SCHEMA_BASE_MODULES:
+                    return True
+                break
+    try:
+        callbacks = list(cmd.get_callbacks('interactive_prompt'))
+    except (AttributeError, KeyError):
+        callbacks = []
+    for callback in callbacks:
+        if getattr(callback, '__module__', None) not in SCHEMA_BASE_MODULES:
+            return True
+    return False
+
+
+def serialize_command(cmd):
+    """
+    Return the schema of the `frontend.Command` ``cmd``.
+
+    Args and options are taken from `Command.get_args()` and
+    `Command.get_options()` so the params used only by the client are
+    included; the client filters them by its own context.
+    """
+    client_code = needs_client_code(cmd)
+    data = dict(
+        name=cmd.name,
+        doc=serialize_value(cmd.doc),
+        args=[],
+        options=[],
+        output=[],
+        output_params=[],
+        client_code=client_code,
+    )
+    if client_code:
+        return data
+    try:
+        data['args'] = [serialize_param(parameters.create_param(p))
+                        for p in cmd.get_args()]
+        data['options'] = [serialize_param(parameters.create_param(p))
+                           for p in cmd.get_options()]
+        data['output'] = [serialize_output(o) for o in cmd.output()]
+        data['output_params'] = [serialize_param(p)
+                                 for p in cmd.output_params()]
+    except (ValueError, TypeError, AttributeError):
+        data['client_code'] = True
+    return data
+
+
+def get_schema(api):
+    """
+    Return the ``(commands, fingerprint)`` schema of the CLI commands of
+    ``api``.
+    """
+    commands = dict(
+        (cmd.name, serialize_command(cmd))
+        for cmd in api.Command() if not cmd.NO_CLI
+    )
+    fingerprint = hashlib.sha1(
+        json.dumps(commands, sort_keys=True)).hexdigest()
+    return (commands, unicode(fingerprint))
+
+
+def restore_value(kind, value):
+    """
+    Convert the JSON ``value`` of a keyword argument to the type ``kind``
+    declared in `Param.kwargs`.
+    """
+    kinds = kind if type(kind) is tuple else (kind,)
+    if isinstance(value, list):
+        value = tuple(value)
+    if value is None or isinstance(value, kinds):
+        return value
+    return kinds[0](value)
+
+
+def build_param(data):
+    """
+    Return the `parameters.Param` defined by the schema ``data``.
+    """
+    (class_name, name, kw) = data
+    klass = getattr(parameters, class_name)
+    kinds = dict((key, kind) for (key, kind, default) in klass.kwargs)
+    if kw.get('multivalue'):
+        kinds['default'] = tuple
+    else:
+        kinds['default'] = klass.type
+    kw = dict(
+        (str(key), restore_value(kinds[key], value))
+        for (key, value) in kw.iteritems()
+    )
+    return klass(str(name), **kw)
+
+
+def build_output(data):
+    """
+    Return the `output.Output` defined by the schema ``data``.
+    """
+    (class_name, name, doc, flags) = data
+    klass = getattr(output, class_name, output.Output)
+    return klass(str(name), doc=doc, flags=[str(f) for f in flags])
+
+
+class SchemaCommand(frontend.Command):
+    """
+    Base class of the commands built by `build_command()`.
+    """
+
+    # The server validated the output, the outputs of the schema only
+    # describe how to print it.
+    use_output_validation = False
+
+    schema = None
+
+    def get_args(self):
+        for data in self.schema['args']:
+            yield build_param(data)
+
+    def get_options(self):
+        for data in self.schema['options']:
+            yield build_param(data)
+
+    def get_output_params(self):
+        for data in self.schema['output_params']:
+            yield build_param(data)
+
+
+def build_command(data):
+    """
+    Return a `SchemaCommand` subclass for the command schema ``data``.
+    """
+    # build the params now, a schema the client cannot handle should not
+    # fail later when the command is finalized
+    for key in ('args', 'options', 'output_params'):
+        for param in data[key]:
+            build_param(param)
+    return type(str(data['name']), (SchemaCommand,), dict(
+        __doc__=data['doc'],
+        schema=data,
+        has_output=tuple(build_output(o) for o in data['output']),
+    ))
+
+
+def get_language():
+    try:
+        lang = locale.setlocale(locale.LC_ALL, '').split('.')[0].lower()
+    except locale.Error:
+        lang = 'en_us'
+    return lang
+
+
+class SchemaCache(object):
+    """
+    Schema of the server the client talks to, cached in ``~/.ipa/schema``.
+
+    The cache is keyed by the server URI, the API version and the language
+    of the client.  Each fingerprint of the server schema has its own
+    directory with a JSON file per command, so only the command that runs
+    is read.  The ``fingerprint`` file names the current directory, it is
+    checked with the server again when it is older than
+    ``api.env.cli_schema_ttl`` seconds.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        key = '\0'.join((api.env.xmlrpc_uri, API_VERSION, get_language()))
+        self.path = os.path.join(
+            api.env.dot_ipa, 'schema', hashlib.sha1(key).hexdigest())
+        self.fingerprint_file = os.path.join(self.path, 'fingerprint')
+
+    def get_fingerprint(self):
+        """
+        Return the fingerprint of the cached schema, None if there is none.
+        """
+        try:
+            with open(self.fingerprint_file) as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
+
+    def is_current(self):
+        """
+        Return True if the cached schema does not need to be checked with
+        the server.
+        """
+        try:
+            mtime = os.stat(self.fingerprint_file).st_mtime
+        except OSError:
+            return False
+        return time.time() - mtime < self.api.env.cli_schema_ttl
+
+    def get_command(self, name):
+        """
+        Return the command class ``name`` built from the cached schema.
+
+        Return None if the schema is not current or it cannot be used to
+        build the command.
+        """
+        if not self.is_current():
+            return None
+        fingerprint = self.get_fingerprint()
+        if fingerprint is None:
+            return None
+        filename = os.path.join(self.path, fingerprint, '%s.json' % name)
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        try:
+            return build_command(data)
+        except (ValueError, TypeError, AttributeError, KeyError), e:
+            self.api.log.debug('cannot build %s from schema: %s', name, e)
+            return None
+
+    def _write(self, filename, data):
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(filename))
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp, filename)
+
+    def store(self, commands, fingerprint):
+        """
+        Replace the cached schema.
+        """
+        try:
+            os.makedirs(self.path, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        directory = os.path.join(self.path, fingerprint)
+        if not os.path.isdir(directory):
+            tmpdir = tempfile.mkdtemp(dir=self.path)
+            try:
+                for (name, data) in commands.iteritems():
+                    if data['client_code']:
+                        continue
+                    self._write(os.path.join(tmpdir, '%s.json' % name),
+                                json.dumps(data))
+                os.rename(tmpdir, directory)
+            except OSError:
+                # another client stored the same schema meanwhile
+                shutil.rmtree(tmpdir, ignore_errors=True)
+                if not os.path.isdir(directory):
+                    raise
+        self._write(self.fingerprint_file, fingerprint)
+        for entry in os.listdir(self.path):
+            if entry not in ('fingerprint', fingerprint) and len(entry) == 40:
+                shutil.rmtree(os.path.join(self.path, entry),
+                              ignore_errors=True)
+
+    def update(self):
+        """
+        Check the cached schema with the server and update it if needed.
+
+        Errors are only logged, the cache is an optimization.
+        """
+        cli = self.api.Backend.cli
+        fingerprint = self.get_fingerprint()
+        options = {}
+        if fingerprint is not None:
+            options['known_fingerprint'] = unicode(fingerprint)
+        try:
+            cli.create_context()
+            try:
+                result = self.api.Command.schema(**options)
+            finally:
+                cli.destroy_context()
+            if result['commands'] is None:
+                os.utime(self.fingerprint_file, None)
+            else:
+                self.store(result['commands'], str(result['fingerprint']))
+        except (PublicError, EnvironmentError), e:
+            self.api.log.debug('cannot update CLI schema cache: %s', e)
@@ -22,6 +22,15 @@ import errors
 import os
 import re
 import time
+import thread
+import threading
+import hashlib
+import cPickle
+import struct
+import tempfile
+import fcntl
+import mmap
+import krbV
 from urllib2 import urlparse
 from text import _
 from ipapython.ipa_log_manager import *
@@ -721,6 +730,16 @@ class SessionManager(object):
     requests.
     '''
 
+    # Session data keys which change on every request and which do not
+    # by themselves require the session data to be stored.
+    volatile_session_keys = ('session_access_timestamp',
+                             'session_expiration_timestamp',
+                             'session_stored_state')
+
+    # Number of seconds an expiration timestamp may move forward without
+    # the session data being stored, see `session_data_changed()`.
+    store_expiration_slack = 60
+
     def __init__(self):
         '''
         :returns:
@@ -730,6 +749,7 @@ class SessionManager(object):
         log_mgr.get_logger(self, True)
         self.generated_session_ids = set()
         self.auth_mgr = SessionAuthManager()
+        self.store_stats = dict(stored=0, skipped=0)
 
     def generate_session_id(self, n_bits=128):
         '''
@@ -778,35 +798,124 @@ class SessionManager(object):
         self.generated_session_ids.add(session_id)
         return session_id
 
+    def get_session_state(self, session_data):
+        '''
+        Return the state of the session data which decides whether it
+        has to be written back to the session store.
+
+        The state is a two-tuple of a digest of the session data,
+        excluding the timestamps which change on every request, and the
+        session expiration timestamp.
+
+        :parameters:
+          session_data
+            Session data dict.
+        :returns:
+          (digest, expiration timestamp) tuple
+        '''
+        items = sorted((key, value) for key, value in session_data.iteritems()
+                       if key not in self.volatile_session_keys)
+        digest = hashlib.sha1(cPickle.dumps(items, cPickle.HIGHEST_PROTOCOL))
+        return (digest.hexdigest(), session_data['session_expiration_timestamp'])
+
+    def session_data_changed(self, session_data, state, now):
+        '''
+        Return True if session data with the given state must be
+        written back to the session store.
+
+        Session data is unchanged if its digest matches the one it was
+        last stored with and its expiration moved forward by less than
+        `store_expiration_slack` seconds. The slack is capped at half of
+        the remaining lifetime of the stored session, so an active
+        session does not expire in the store.
+
+        :parameters:
+          session_data
+            Session data dict as loaded from the session store.
+          state
+            State of the session data, see `get_session_state()`.
+          now
+            Current time.
+        :returns:
+          True if the session data must be stored, False otherwise.
+        '''
+        stored_state = session_data.get('session_stored_state')
+        if stored_state is None:
+            return True
+
+        digest, expiration = state
+        stored_digest, stored_expiration = stored_state
+        if digest != stored_digest:
+            return True
+        if expiration == stored_expiration:
+            return False
+        slack = min(self.store_expiration_slack, (stored_expiration - now) / 2)
+        return not 0 <= expiration - stored_expiration < slack
 
-class MemcacheSessionManager(SessionManager):
+    def get_store_statistics(self):
+        '''
+        Return the counts of session data stores done by this process.
+
+        :returns:
+          dict with the number of times session data was written to the
+          session store ('stored') and the number of times writing it
+          was skipped because it did not change ('skipped').
+        '''
+        return dict(self.store_stats)
+
+
+class SessionStore(object):
     '''
+    Interface of the stores session data is kept in.
 
-    This class is used to assign a session id to a HTTP server client
-    and then store client specific data associated with the session in
-    a memcached memory cache instance. Multiple processes may share
-    the memory cache permitting session data to be shared between
-    forked HTTP server children handling server requests.
+    A session store maps string keys to picklable values. Every value
+    carries an expiration timestamp (Unix time) after which it is no
+    longer returned, zero implies no expiration. The store must be
+    shared by all the processes serving requests.
+    '''
 
-    The session id is guaranteed to be unique.
+    def get(self, key):
+        '''
+        Return the value stored under key, None if there is none or if
+        it expired.
+        '''
+        raise NotImplementedError('%s.get()' % self.__class__.__name__)
 
-    The session id is set into a session cookie returned to the client
-    and is secure (see `generate_cookie()`). Future requests from the
-    client will send the session id which is then used to retrieve the
-    session data (see `load_session_data()`)
+    def set(self, key, value, expiration=0):
+        '''
+        Store value under key until the expiration timestamp.
+        '''
+        raise NotImplementedError('%s.set()' % self.__class__.__name__)
+
+    def delete(self, key):
+        '''
+        Remove the value stored under key, if any.
+        '''
+        raise NotImplementedError('%s.delete()' % self.__class__.__name__)
+
+    def get_statistics(self):
+        '''
+        Return a dict of store specific statistics.
+        '''
+        return {}
+
+
+class MemcacheSessionStore(SessionStore):
+    '''
+    Session store kept in a memcached instance listening on a local
+    socket.
     '''
 
     memcached_socket_path = paths.VAR_RUN_IPA_MEMCACHED
-    session_cookie_name = 'ipa_session'
     mc_server_stat_name_re = re.compile(r'(.+)\s+\((\d+)\)')
 
     def __init__(self):
         '''
         :returns:
-          `MemcacheSessionManager` object.
+          `MemcacheSessionStore` object.
         '''
 
-        super(MemcacheSessionManager, self).__init__()
+        log_mgr.get_logger(self, True)
         self.servers = ['unix:%s' % self.memcached_socket_path]
         self.mc = memcache.Client(self.servers, debug=0)
 
@@ -853,6 +962,328 @@ class MemcacheSessionManager(SessionManager):
         stats = self.get_server_statistics()
         return len(self.servers) == len(stats)
 
+    def get(self, key):
+        return self.mc.get(key)
+
+    def set(self, key, value, expiration=0):
+        '''
+        The expiration is always passed to memcached, otherwise the
+        memcache expiration defaults to zero which implies no
+        expiration.
+        '''
+        self.mc.set(key, value, time=expiration)
+
+    def delete(self, key):
+        self.mc.delete(key)
+
+    def get_statistics(self):
+        return self.get_server_statistics()
+
+
+class LocalSessionStore(SessionStore):
+    '''
+    Session store kept in a memory mapped file, shared by the processes
+    of the local host without a separate daemon.
+
+    The file is a hash table of fixed size slots, each holding one
+    pickled value. A key hashes to `probes` consecutive slots. A value
+    is written to the slot already holding its key, or else to the first
+    free or expired slot. When all of them hold live values, or when the
+    value does not fit in a slot, an error is raised rather than losing
+    a session. Slots are locked with fcntl byte range locks between
+    processes and with thread locks between the threads of a process.
+
+    The number and size of the slots are set by the session_store_slots,
+    session_store_slot_size and session_store_probes configuration
+    options. A file created with a different geometry is replaced by a
+    new file, processes still using the old one are not affected.
+    '''
+
+    magic = 'IPASESS1'
+    file_header = struct.Struct('>8sII')
+    file_header_size = 4096
+    slot_header = struct.Struct('>16sdI')
+    free_digest = '\0' * 16
+    thread_lock_count = 64
+
+    def __init__(self, path=paths.IPA_SESSION_STORE, slots=None,
+                 slot_size=None, probes=None):
+        '''
+        :parameters:
+          path
+            Path of the store file, created if it does not exist.
+          slots
+            Number of slots of the hash table, session_store_slots if
+            None.
+          slot_size
+            Size of a slot in bytes, this limits the size of a
+            pickled value, session_store_slot_size if None.
+          probes
+            Number of slots a key can be stored in,
+            session_store_probes if None.
+        :returns:
+          `LocalSessionStore` object.
+        '''
+
+        log_mgr.get_logger(self, True)
+        if slots is None:
+            slots = getattr(api.env, 'session_store_slots', 4096)
+        if slot_size is None:
+            slot_size = getattr(api.env, 'session_store_slot_size', 16384)
+        if probes is None:
+            probes = getattr(api.env, 'session_store_probes', 8)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.probes = min(probes, slots)
+        self.thread_locks = [threading.Lock()
+                             for i in xrange(self.thread_lock_count)]
+
+        self.size = self.file_header_size + slots * slot_size
+        self.header = self.file_header.pack(self.magic, slots, slot_size)
+        self.fd = self._open()
+        self.mm = mmap.mmap(self.fd, self.size)
+
+    def _open(self):
+        '''
+        Open the store file, initializing it if it is new.
+        '''
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX, self.file_header_size, 0)
+                try:
+                    ready = self._check(fd)
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, self.file_header_size, 0)
+            except:
+                os.close(fd)
+                raise
+            if ready:
+                return fd
+            os.close(fd)
+
+    def _check(self, fd):
+        '''
+        Check the store file open as ``fd`` can be used, initializing it
+        if it is new. Return False if it must be opened again.
+
+        A file initialized with a different geometry may be mapped by
+        other processes, so it is never truncated. A new file is renamed
+        over it instead.
+        '''
+        if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+            # replaced by another process
+            return False
+
+        header = os.read(fd, len(self.header))
+        if header == self.header:
+            return True
+        if not header:
+            self.debug('initializing session store file "%s"', self.path)
+            self._initialize(fd)
+            return True
+
+        self.info('replacing session store file "%s" created with a '
+                  'different geometry', self.path)
+        self._replace()
+        return False
+
+    def _initialize(self, fd):
+        os.ftruncate(fd, self.size)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, self.header)
+
+    def _replace(self):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        try:
+            try:
+                self._initialize(fd)
+            finally:
+                os.close(fd)
+            os.rename(tmp_path, self.path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def _get_slots(self, key):
+        digest = hashlib.md5(key).digest()
+        first = struct.unpack_from('>Q', digest)[0] % self.slots
+        return digest, [(first + i) % self.slots for i in xrange(self.probes)]
+
+    def _get_offset(self, slot):
+        return self.file_header_size + slot * self.slot_size
+
+    def _lock(self, slot, operation):
+        thread_lock = self.thread_locks[slot % self.thread_lock_count]
+        thread_lock.acquire()
+        try:
+            fcntl.lockf(self.fd, operation, self.slot_size,
+                        self._get_offset(slot))
+        except:
+            thread_lock.release()
+            raise
+
+    def _unlock(self, slot):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, self.slot_size,
+                        self._get_offset(slot))
+        finally:
+            self.thread_locks[slot % self.thread_lock_count].release()
+
+    def _read_header(self, slot):
+        return self.slot_header.unpack_from(self.mm, self._get_offset(slot))
+
+    def _write(self, slot, digest, expiration, data):
+        offset = self._get_offset(slot)
+        start = offset + self.slot_header.size
+        self.mm[start:start + len(data)] = data
+        self.slot_header.pack_into(self.mm, offset, digest, expiration,
+                                   len(data))
+
+    def _is_free(self, digest, expiration, now):
+        return digest == self.free_digest or 0 < expiration <= now
+
+    def get(self, key):
+        digest, slots = self._get_slots(key)
+        for slot in slots:
+            # slot headers are peeked at without a lock and checked again
+            # once the slot is locked
+            if self._read_header(slot)[0] != digest:
+                continue
+            self._lock(slot, fcntl.LOCK_SH)
+            try:
+                slot_digest, expiration, length = self._read_header(slot)
+                if slot_digest != digest:
+                    continue
+                if 0 < expiration <= time.time():
+                    return None
+                start = self._get_offset(slot) + self.slot_header.size
+                data = self.mm[start:start + length]
+            finally:
+                self._unlock(slot)
+            return cPickle.loads(data)
+        return None
+
+    def set(self, key, value, expiration=0):
+        data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slot_size - self.slot_header.size:
+            self.error('value of "%s" is too large for the session store '
+                       '(%d bytes), increase session_store_slot_size',
+                       key, len(data))
+            raise errors.ExecutionError(
+                message=_('session data too large for the session store'))
+
+        digest, slots = self._get_slots(key)
+        now = time.time()
+        stored = False
+        for slot in slots:
+            slot_digest, slot_expiration, length = self._read_header(slot)
+            if slot_digest != digest and (
+                    stored or
+                    not self._is_free(slot_digest, slot_expiration, now)):
+                continue
+            self._lock(slot, fcntl.LOCK_EX)
+            try:
+                slot_digest, slot_expiration, length = self._read_header(slot)
+                if stored:
+                    # drop a copy left by a concurrent store
+                    if slot_digest == digest:
+                        self._write(slot, self.free_digest, 0, '')
+                elif (slot_digest == digest or
+                        self._is_free(slot_digest, slot_expiration, now)):
+                    self._write(slot, digest, expiration, data)
+                    stored = True
+            finally:
+                self._unlock(slot)
+        if stored:
+            return
+
+        # all slots hold live sessions, which are not evicted
+        self.error('no free slot for "%s" in the session store, increase '
+                   'session_store_slots or session_store_probes', key)
+        raise errors.ExecutionError(
+            message=_('the session store is full'))
+
+    def delete(self, key):
+        digest, slots = self._get_slots(key)
+        for slot in slots:
+            if self._read_header(slot)[0] != digest:
+                continue
+            self._lock(slot, fcntl.LOCK_EX)
+            try:
+                if self._read_header(slot)[0] == digest:
+                    self._write(slot, self.free_digest, 0, '')
+            finally:
+                self._unlock(slot)
+
+    def get_statistics(self):
+        '''
+        :returns:
+          dict with the number of slots and the number of slots holding
+          live values.
+        '''
+        now = time.time()
+        used = 0
+        for slot in xrange(self.slots):
+            digest, expiration, length = self._read_header(slot)
+            if not self._is_free(digest, expiration, now):
+                used += 1
+        return dict(slots=self.slots, used=used)
+
+
+# Session stores selectable by the session_store configuration option.
+session_stores = {
+    'memcache': MemcacheSessionStore,
+    'local': LocalSessionStore,
+}
+
+
+class StoreSessionManager(SessionManager):
+    '''
+
+    This class is used to assign a session id to a HTTP server client
+    and then store client specific data associated with the session in
+    a `SessionStore`. Multiple processes share the session store
+    permitting session data to be shared between forked HTTP server
+    children handling server requests.
+
+    The session id is guaranteed to be unique.
+
+    The session id is set into a session cookie returned to the client
+    and is secure (see `generate_cookie()`). Future requests from the
+    client will send the session id which is then used to retrieve the
+    session data (see `load_session_data()`)
+    '''
+
+    session_cookie_name = 'ipa_session'
+
+    def __init__(self, store=None):
+        '''
+        :parameters:
+          store
+            The `SessionStore` to use. If None the store is chosen by
+            the session_store configuration option when it is first
+            used.
+        :returns:
+          `StoreSessionManager` object.
+        '''
+
+        super(StoreSessionManager, self).__init__()
+        self._store = store
+
+    @property
+    def store(self):
+        if self._store is None:
+            name = getattr(api.env, 'session_store', 'memcache')
+            try:
+                store_class = session_stores[name]
+            except KeyError:
+                self.error('unknown session store "%s", using memcache', name)
+                store_class = MemcacheSessionStore
+            self._store = store_class()
+        return self._store
+
     def new_session_id(self, max_retries=5):
         '''
         Returns a new *unique* session id. See `generate_session_id()`
@@ -860,7 +1291,7 @@ class MemcacheSessionManager(SessionManager):
 
         The scope of the uniqueness of the id is limited to id's
         generated by this instance of the `SessionManager` and session
-        id's currently stored in the memcache instance.
+        id's currently stored in the session store.
 
         :parameters:
           max_retries
@@ -870,7 +1301,7 @@ class MemcacheSessionManager(SessionManager):
         '''
         n_retries = 0
         while n_retries < max_retries:
-            session_id = super(MemcacheSessionManager, self).new_session_id(max_retries)
+            session_id = super(StoreSessionManager, self).new_session_id(max_retries)
             session_data = self.get_session_data(session_id)
             if session_data is None:
                 break
@@ -912,14 +1343,14 @@ class MemcacheSessionManager(SessionManager):
 
     def session_key(self, session_id):
         '''
-        Given a session id return a memcache key used to look up the
-        session data in the memcache.
+        Given a session id return a key used to look up the session
+        data in the session store.
 
         :parameters:
           session_id
-            The session id from which the memcache key will be derived.
+            The session id from which the key will be derived.
         :returns:
-          A key (string) used to look up the session data in the memcache.
+          A key (string) used to look up the session data in the store.
         '''
         return 'ipa.session.%s' % (session_id)
 
@@ -935,7 +1366,7 @@ class MemcacheSessionManager(SessionManager):
           Session data if found, None otherwise.
         '''
         session_key = self.session_key(session_id)
-        session_data = self.mc.get(session_key)
+        session_data = self.store.get(session_key)
 
         if session_data is not None:
             # update the access timestamp
@@ -983,20 +1414,20 @@ class MemcacheSessionManager(SessionManager):
         information.
 
         * If no session id is found then a new session id and new
-          session data dict will be generated, stored in the memcache
+          session data dict will be generated, stored in the session store
           and returned. The new session data dict will contain the new
           session id.
 
         * If the session id is found in the cookie an attempt is made
-          to retrieve the session data from the memcache using the
+          to retrieve the session data from the session store using the
           session id.
 
-          - If existing session data is found in the memcache it is
+          - If existing session data is found in the session store it is
             returned.
 
-          - If no session data is found in the memcache then a new
+          - If no session data is found in the session store then a new
             session data dict will be generated, stored in the
-            memcache and returned. The new session data dict will
+            session store and returned. The new session data dict will
             contain the session id found in the cookie header.
 
         :parameters:
@@ -1027,7 +1458,10 @@ class MemcacheSessionManager(SessionManager):
 
     def store_session_data(self, session_data):
         '''
-        Store the supplied session_data dict in the memcached instance.
+        Store the supplied session_data dict in the session store.
+
+        The session data is not stored if it did not change since it was
+        loaded, see `session_data_changed()`.
 
         The session_expiration_timestamp is always passed to memcached
         when the session data is written back to the memcache. This is
@@ -1053,13 +1487,21 @@ class MemcacheSessionManager(SessionManager):
 
         session_expiration_timestamp = session_data['session_expiration_timestamp']
 
+        state = self.get_session_state(session_data)
+        if not self.session_data_changed(session_data, state, now):
+            self.store_stats['skipped'] += 1
+            self.debug('session data unchanged, skipping store: session_id=%s', session_id)
+            return session_id
+        session_data['session_stored_state'] = state
+
         self.debug('store session: session_id=%s start_timestamp=%s access_timestamp=%s expiration_timestamp=%s',
                    session_id,
                    fmt_time(session_data['session_start_timestamp']),
                    fmt_time(session_data['session_access_timestamp']),
                    fmt_time(session_data['session_expiration_timestamp']))
 
-        self.mc.set(session_key, session_data, time=session_expiration_timestamp)
+        self.store.set(session_key, session_data, session_expiration_timestamp)
+        self.store_stats['stored'] += 1
         return session_id
 
     def generate_cookie(self, url_path, session_id, expiration=None, add_header=False):
@@ -1194,7 +1636,7 @@ class MemcacheSessionManager(SessionManager):
 
     def delete_session_data(self, session_id):
         '''
-        Given a session id removed the session data bound to the id from the memcache.
+        Given a session id removed the session data bound to the id from the session store.
 
         :parameters:
           session_id
@@ -1204,8 +1646,17 @@ class MemcacheSessionManager(SessionManager):
         '''
         session_key = self.session_key(session_id)
 
-        self.debug('delete session data from memcache, session_id=%s', session_id)
-        self.mc.delete(session_key)
+        self.debug('delete session data from session store, session_id=%s', session_id)
+        self.store.delete(session_key)
+
+
+class MemcacheSessionManager(StoreSessionManager):
+    '''
+    Session manager which always keeps session data in memcached.
+    '''
+
+    def __init__(self):
+        super(MemcacheSessionManager, self).__init__(MemcacheSessionStore())
 
 
 #-------------------------------------------------------------------------------
@@ -1215,15 +1666,112 @@ krbccache_prefix = 'krbcc_'
 def _get_krbccache_pathname():
     return os.path.join(krbccache_dir, '%s%s' % (krbccache_prefix, os.getpid()))
 
+def _get_krbccache_memory_name():
+    # MEMORY ccaches are shared by all threads of the process
+    return '%s%s_%s' % (krbccache_prefix, os.getpid(), thread.get_ident())
+
 def get_ipa_ccache_name(scheme='FILE'):
     if scheme == 'FILE':
         name = os.path.join(krbccache_dir, '%s%s' % (krbccache_prefix, os.getpid()))
+    elif scheme == 'MEMORY':
+        name = _get_krbccache_memory_name()
     else:
         raise ValueError('ccache scheme "%s" unsupported', scheme)
 
     ccache_name = krb5_unparse_ccache(scheme, name)
     return ccache_name
 
+# Parsed ccache data of the MEMORY ccaches bound by bind_ipa_ccache(),
+# indexed by ccache name.
+_memory_ccaches = {}
+
+def _krbV_principal(principal, context):
+    return krbV.Principal(krb5_format_principal(principal), context)
+
+def _bind_memory_ccache(ccache_name, ccache_data):
+    header, principal, creds = krb5_parse_ccache_data(ccache_data)
+    context = krbV.default_context()
+    ccache = krbV.CCache(name=ccache_name, context=context)
+    ccache.init(_krbV_principal(principal, context))
+    for cred, raw in creds:
+        (client, server, keyblock, times, is_skey, ticket_flags, addrs,
+         ticket, second_ticket, authdata) = cred
+        ccache.store((_krbV_principal(client, context),
+                      _krbV_principal(server, context),
+                      keyblock, times, is_skey, ticket_flags,
+                      addrs or None, ticket, second_ticket or None,
+                      authdata or None))
+    _memory_ccaches[ccache_name] = (header, principal, creds)
+
+def _ccache_cred(cred, client, server):
+    '''
+    Convert a krbV credentials tuple to a `krb5_parse_ccache_data()`
+    credential tuple.
+    '''
+    def tagged(values):
+        return tuple((int(tag), str(data)) for tag, data in values or ())
+
+    keyblock = cred[2]
+    return (client, server, (int(keyblock[0]), str(keyblock[1])),
+            tuple(int(t) for t in cred[3]), int(bool(cred[4])), int(cred[5]),
+            tagged(cred[6]), str(cred[7] or ''), str(cred[8] or ''),
+            tagged(cred[9]))
+
+def _load_memory_ccache(ccache_name):
+    '''
+    Return the contents of a MEMORY ccache in the FILE ccache format.
+
+    krbV cannot iterate a ccache, so credentials are looked up by the
+    service principals the ccache was bound with plus the LDAP service
+    principal. Configuration entries and credentials Kerberos did not
+    replace keep their original encoding, so the data only differs from
+    the bound data when the ccache was actually updated.
+    '''
+    header, principal, creds = _memory_ccaches[ccache_name]
+    ccache = KRB5_CCache(ccache_name)
+
+    def lookup(server):
+        name = krb5_format_principal(server)
+        try:
+            cred = ccache.get_credentials(name)
+            return krb5_pack_ccache_cred(_ccache_cred(cred, principal, server))
+        except KeyError:
+            return None
+        except Exception, e:
+            root_logger.error('unable to read credential for "%s" from "%s", %s',
+                              name, ccache_name, e)
+            return None
+
+    data = [header]
+    seen = set()
+    for cred, raw in creds:
+        client, server = cred[:2]
+        key = server[1:]
+        if (server[1] == 'X-CACHECONF:' or client != principal or
+                key in seen):
+            data.append(raw)
+            continue
+        seen.add(key)
+        data.append(lookup(server) or raw)
+
+    realm, components = krb5_split_principal_name(
+        krb5_format_service_principal_name('ldap', api.env.host, api.env.realm))
+    if (realm, components) not in seen:
+        cred = lookup((KRB5_NT_PRINCIPAL, realm, components))
+        if cred is not None:
+            data.append(cred)
+
+    return ''.join(data)
+
+def _release_memory_ccache(ccache_name):
+    ccache_info = _memory_ccaches.pop(ccache_name, None)
+    if ccache_info is not None:
+        # krbV cannot destroy a ccache, reinitializing it drops the
+        # credentials
+        context = krbV.default_context()
+        ccache = krbV.CCache(name=ccache_name, context=context)
+        ccache.init(_krbV_principal(ccache_info[1], context))
+
 
 def load_ccache_data(ccache_name):
     scheme, name = krb5_parse_ccache(ccache_name)
@@ -1233,6 +1781,9 @@ def load_ccache_data(ccache_name):
         ccache_data = src.read()
         src.close()
         return ccache_data
+    elif scheme == 'MEMORY':
+        root_logger.debug('reading ccache data from memory ccache "%s"', name)
+        return _load_memory_ccache(ccache_name)
     else:
         raise ValueError('ccache scheme "%s" unsupported (%s)', scheme, ccache_name)
 
@@ -1243,6 +1794,10 @@ def bind_ipa_ccache(ccache_data, scheme='FILE'):
         dst = open(name, 'w')
         dst.write(ccache_data)
         dst.close()
+    elif scheme == 'MEMORY':
+        name = _get_krbccache_memory_name()
+        root_logger.debug('storing ccache data into memory ccache "%s"', name)
+        _bind_memory_ccache(krb5_unparse_ccache(scheme, name), ccache_data)
     else:
         raise ValueError('ccache scheme "%s" unsupported', scheme)
 
@@ -1254,7 +1809,8 @@ def release_ipa_ccache(ccache_name):
     '''
     Stop using the current request's ccache.
       * Remove KRB5CCNAME from the enviroment
-      * Remove the ccache file from the file system
+      * Remove the ccache file from the file system, or drop the
+        credentials of a MEMORY ccache
 
     Note, we do not demand any of these elements exist, but if they
     do we'll remove them.
@@ -1275,6 +1831,11 @@ def release_ipa_ccache(ccache_name):
                 os.unlink(name)
             except Exception, e:
                 root_logger.error('unable to delete session ccache file "%s", %s', name, e)
+    elif scheme == 'MEMORY':
+        try:
+            _release_memory_ccache(ccache_name)
+        except krbV.Krb5Error, e:
+            root_logger.error('unable to clear session ccache "%s", %s', ccache_name, e)
     else:
         raise ValueError('ccache scheme "%s" unsupported (%s)', scheme, ccache_name)
 
@@ -1306,4 +1867,4 @@ api.register(session_logout)
 #-------------------------------------------------------------------------------
 
 
-session_mgr = MemcacheSessionManager()
+session_mgr = StoreSessionManager()
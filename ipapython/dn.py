@@ -529,6 +529,36 @@ def cmp_rdns(a, b):
             return r
     return 0
 
+
+def _rdn_key(rdn):
+    # Sorts the same way as cmp_rdns: by the number of AVA's first, then by
+    # the case folded AVA's.
+    return (len(rdn),) + tuple((a[0].lower(), (a[1] or '').lower())
+                               for a in rdn)
+
+
+# Parsed DN strings. DN's are immutable, so DN objects constructed from the
+# same string can share the parsed RDN's. The cache is simply dropped when
+# it reaches _STR2DN_CACHE_SIZE entries.
+_str2dn_cache = {}
+_STR2DN_CACHE_SIZE = 4096
+
+
+def _str2rdns(value):
+    rdns = _str2dn_cache.get(value)
+    if rdns is None:
+        try:
+            rdns = str2dn(value)
+        except DECODING_ERROR:
+            raise ValueError("malformed RDN string = \"%s\"" % value)
+        for rdn in rdns:
+            sort_avas(rdn)
+        rdns = tuple(tuple(tuple(ava) for ava in rdn) for rdn in rdns)
+        if len(_str2dn_cache) >= _STR2DN_CACHE_SIZE:
+            _str2dn_cache.clear()
+        _str2dn_cache[value] = rdns
+    return rdns
+
 class AVA(object):
     '''
     AVA(arg0, ...)
@@ -1072,7 +1102,18 @@ class DN(object):
     RDN_type = RDN
 
     def __init__(self, *args, **kwds):
-        self.rdns = self._rdns_from_sequence(args)
+        if len(args) == 1 and isinstance(args[0], DN):
+            # DN's are immutable, share the RDN's and the cached values
+            other = args[0]
+            self.rdns = other.rdns
+            self._key = other._key
+            self._hash = other._hash
+            self._str = other._str
+        else:
+            self.rdns = self._rdns_from_sequence(args)
+            self._key = None
+            self._hash = None
+            self._str = None
 
     def _copy_rdns(self, rdns=None):
         if not rdns:
@@ -1081,34 +1122,37 @@ class DN(object):
 
     def _rdns_from_value(self, value):
         if isinstance(value, basestring):
-            try:
-                if isinstance(value, unicode):
-                    value = value.encode('utf-8')
-                rdns = str2dn(value)
-            except DECODING_ERROR:
-                raise ValueError("malformed RDN string = \"%s\"" % value)
-            for rdn in rdns:
-                sort_avas(rdn)
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            rdns = _str2rdns(value)
         elif isinstance(value, DN):
-            rdns = value._copy_rdns()
+            rdns = value.rdns
         elif isinstance(value, (tuple, list, AVA)):
             ava = get_ava(value)
-            rdns = [[ava]]
+            rdns = ((tuple(ava),),)
         elif isinstance(value, RDN):
-            rdns = [value.to_openldap()]
+            rdns = (tuple(tuple(ava) for ava in value._avas),)
         else:
             raise TypeError("must be str, unicode, tuple, or RDN or DN, got %s instead" %
                             type(value))
         return rdns
 
     def _rdns_from_sequence(self, seq):
-        rdns = []
+        if len(seq) == 1:
+            return self._rdns_from_value(seq[0])
 
+        rdns = ()
         for item in seq:
-            rdn = self._rdns_from_value(item)
-            rdns.extend(rdn)
+            rdns += self._rdns_from_value(item)
         return rdns
 
+    def _get_key(self):
+        # Case folded RDN's, used for hashing and comparison
+        key = self._key
+        if key is None:
+            key = self._key = tuple(_rdn_key(rdn) for rdn in self.rdns)
+        return key
+
     def __deepcopy__(self, memo):
         return self
 
@@ -1116,12 +1160,14 @@ class DN(object):
         return self.RDN_type(*rdn, **{'raw': True})
 
     def __str__(self):
-        try:
-            return dn2str(self.rdns)
-        except Exception, e:
-            print len(self.rdns)
-            print self.rdns
-            raise
+        if self._str is None:
+            try:
+                self._str = dn2str(self.rdns)
+            except Exception, e:
+                print len(self.rdns)
+                print self.rdns
+                raise
+        return self._str
 
     def __repr__(self):
         return "%s.%s('%s')" % (self.__module__, self.__class__.__name__, self.__str__())
@@ -1143,6 +1189,12 @@ class DN(object):
             cls = self.__class__
             new_dn = cls.__new__(cls)
             new_dn.rdns = self.rdns[key]
+            if self._key is not None:
+                new_dn._key = self._key[key]
+            else:
+                new_dn._key = None
+            new_dn._hash = None
+            new_dn._str = None
             return new_dn
         elif isinstance(key, basestring):
             for rdn in self.rdns:
@@ -1155,34 +1207,29 @@ class DN(object):
                                 (key.__class__.__name__))
 
     def __hash__(self):
-        # Hash is computed from DN's string representation.
-        #
         # Because attrs & values are comparison case-insensitive the
         # hash value between two objects which compare as equal but
-        # differ in case must yield the same hash value.
-
-        str_dn = ';,'.join([
-            '++'.join(
-                ['=='.join((atype, avalue or '')) for atype,avalue,dummy in rdn]
-            ) for rdn in self.rdns
-        ])
-        return hash(str_dn.lower())
+        # differ in case must yield the same hash value, so the hash is
+        # computed from the case folded RDN's.
+        if self._hash is None:
+            self._hash = hash(self._get_key())
+        return self._hash
 
     def __eq__(self, other):
+        # Perform comparison between objects of same type
+        if isinstance(other, DN):
+            return self._get_key() == other._get_key()
+
         # Try coercing to DN, if successful compare to coerced object
         if isinstance(other, (basestring, RDN, AVA)):
             try:
                 other_dn = DN(other)
-                return self.__eq__(other_dn)
             except Exception:
                 return False
+            return self._get_key() == other_dn._get_key()
 
         # If it's not an DN it can't be equal
-        if not isinstance(other, DN):
-            return False
-
-        # Perform comparison between objects of same type
-        return self.__cmp__(other) == 0
+        return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -1194,21 +1241,12 @@ class DN(object):
         result = cmp(len(self), len(other))
         if result != 0:
             return result
-        return self._cmp_sequence(other, 0, len(self))
+        return cmp(self._get_key(), other._get_key())
 
     def _cmp_sequence(self, pattern, self_start, pat_len):
-
-        self_idx = self_start
-        self_len = len(self)
-        pat_idx = 0
-        #  and self_idx < self_len
-        while pat_idx < pat_len:
-            r = cmp_rdns(self.rdns[self_idx], pattern.rdns[pat_idx])
-            if r != 0:
-                return r
-            self_idx += 1
-            pat_idx += 1
-        return 0
+        self_key = self._get_key()[self_start:self_start + pat_len]
+        pat_key = pattern._get_key()[:pat_len]
+        return cmp(self_key, pat_key)
 
     def __add__(self, other):
         return self.__class__(self, other)
@@ -1244,6 +1282,12 @@ class DN(object):
                     return True
             return False
 
+        if (isinstance(suffix, DN) and start == 0 and end == sys.maxsize and
+                len(suffix)):
+            # fast path for the common "is this entry below base" test
+            pat_key = suffix._get_key()
+            return self._get_key()[-len(pat_key):] == pat_key
+
         return self._tailmatch(suffix, start, end, +1)
 
     def _tailmatch(self, pattern, start, end, direction):
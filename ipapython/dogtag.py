@@ -19,6 +19,7 @@
 
 import os
 import httplib
+import threading
 import xml.dom.minidom
 import ConfigParser
 from urllib import urlencode
@@ -233,9 +234,29 @@ def ca_status(ca_host=None, use_proxy=True):
     return _parse_ca_status(body)
 
 
-def https_request(host, port, url, secdir, password, nickname, **kw):
+_nss_lock = threading.Lock()
+
+
+def init_nss(secdir, connection_pool=None):
+    """
+    Initialize NSS with the database ``secdir`` unless it is in use already.
+
+    Initializing NSS again breaks all open SSL sockets, so the connections
+    kept in ``connection_pool`` are closed first.
+    """
+    with _nss_lock:
+        if not nsslib.is_initialized(secdir):
+            if connection_pool is not None:
+                connection_pool.flush()
+            nsslib.init_database(secdir)
+
+
+def https_request(host, port, url, secdir, password, nickname,
+                  connection_pool=None, **kw):
     """
     :param url: The path (not complete URL!) to post to.
+    :param connection_pool: Pool of keep-alive connections to use, see
+                            _httplib_request().
     :param kw:  Keyword arguments to encode into POST body.
     :return:   (http_status, http_reason_phrase, http_headers, http_body)
                as (integer, unicode, dict, str)
@@ -244,7 +265,11 @@ def https_request(host, port, url, secdir, password, nickname, **kw):
     """
 
     def connection_factory(host, port):
-        conn = nsslib.NSSConnection(host, port, dbdir=secdir,
+        # connections kept in a pool must survive the creation of others
+        no_init = connection_pool is not None
+        if no_init:
+            init_nss(secdir, connection_pool)
+        conn = nsslib.NSSConnection(host, port, dbdir=secdir, no_init=no_init,
                                     tls_version_min=api.env.tls_version_min,
                                     tls_version_max=api.env.tls_version_max)
         conn.set_debuglevel(0)
@@ -256,12 +281,15 @@ def https_request(host, port, url, secdir, password, nickname, **kw):
 
     body = urlencode(kw)
     return _httplib_request(
-        'https', host, port, url, connection_factory, body)
+        'https', host, port, url, connection_factory, body,
+        connection_pool=connection_pool)
 
 
-def http_request(host, port, url, **kw):
+def http_request(host, port, url, connection_pool=None, **kw):
     """
     :param url: The path (not complete URL!) to post to.
+    :param connection_pool: Pool of keep-alive connections to use, see
+                            _httplib_request().
     :param kw: Keyword arguments to encode into POST body.
     :return:   (http_status, http_reason_phrase, http_headers, http_body)
                 as (integer, unicode, dict, str)
@@ -270,7 +298,8 @@ def http_request(host, port, url, **kw):
     """
     body = urlencode(kw)
     return _httplib_request(
-        'http', host, port, url, httplib.HTTPConnection, body)
+        'http', host, port, url, httplib.HTTPConnection, body,
+        connection_pool=connection_pool)
 
 
 def unauthenticated_https_request(host, port, url, **kw):
@@ -288,11 +317,17 @@ def unauthenticated_https_request(host, port, url, **kw):
 
 
 def _httplib_request(
-        protocol, host, port, path, connection_factory, request_body):
+        protocol, host, port, path, connection_factory, request_body,
+        connection_pool=None):
     """
     :param request_body: Request body
     :param connection_factory: Connection class to use. Will be called
         with the host and port arguments.
+    :param connection_pool: Object with get(key) and put(key, conn)
+        methods keeping idle connections, or None. A connection taken from
+        the pool is returned to it after the request unless the server
+        closes it. A request which fails on a reused connection, which the
+        server may have closed meanwhile, is retried once on a new one.
 
     Perform a HTTP(s) request.
     """
@@ -301,21 +336,44 @@ def _httplib_request(
     uri = '%s://%s%s' % (protocol, ipautil.format_netloc(host, port), path)
     root_logger.debug('request %r', uri)
     root_logger.debug('request body %r', request_body)
+    pool_key = (protocol, host, port)
+    conn = None
     try:
-        conn = connection_factory(host, port)
-        conn.request(
-            'POST', uri,
-            body=request_body,
-            headers={'Content-type': 'application/x-www-form-urlencoded'},
-        )
-        res = conn.getresponse()
+        while True:
+            if connection_pool is not None:
+                conn = connection_pool.get(pool_key)
+            reused = conn is not None
+            if not reused:
+                conn = connection_factory(host, port)
+            try:
+                conn.request(
+                    'POST', uri,
+                    body=request_body,
+                    headers={'Content-type': 'application/x-www-form-urlencoded'},
+                )
+                res = conn.getresponse()
+            except Exception, e:
+                conn.close()
+                conn = None
+                if not reused:
+                    raise
+                root_logger.debug('request on reused connection failed, '
+                                  'retrying: %s', e)
+                continue
+            break
 
         http_status = res.status
         http_reason_phrase = unicode(res.reason, 'utf-8')
         http_headers = res.msg.dict
         http_body = res.read()
-        conn.close()
+        if connection_pool is not None and not res.will_close:
+            connection_pool.put(pool_key, conn)
+        else:
+            conn.close()
+        conn = None
     except Exception, e:
+        if conn is not None:
+            conn.close()
         raise NetworkError(uri=uri, error=str(e))
 
     root_logger.debug('request status %d',        http_status)
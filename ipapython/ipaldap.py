@@ -24,18 +24,24 @@ import time
 import datetime
 import shutil
 from decimal import Decimal
-from copy import deepcopy
 import contextlib
 import collections
 import os
 import pwd
+import threading
+import hashlib
+import json
+import tempfile
 
 import ldap
 import ldap.sasl
 import ldap.filter
 from ldap.ldapobject import SimpleLDAPObject
-from ldap.controls import SimplePagedResultsControl
+from ldap.controls import (SimplePagedResultsControl, RequestControl,
+    ResponseControl, KNOWN_RESPONSE_CONTROLS)
 import ldapurl
+from pyasn1.type import univ, namedtype, tag
+from pyasn1.codec.ber import encoder, decoder
 
 from ipalib import errors, _
 from ipalib.constants import LDAP_GENERALIZED_TIME_FORMAT
@@ -94,20 +100,26 @@ class _ServerSchema(object):
     Properties of a schema retrieved from an LDAP server.
     '''
 
-    def __init__(self, server, schema):
+    def __init__(self, server, schema, attribute_table=None):
         self.server = server
         self.schema = schema
+        self.attribute_table = attribute_table
         self.retrieve_timestamp = time.time()
 
 
 class SchemaCache(object):
     '''
     Cache the schema's from individual LDAP servers.
+
+    If cache_dir is set, the attribute type table of each server is also
+    stored on disk, so that new processes do not have to retrieve and parse
+    the whole subschema entry just to decode attribute values.
     '''
 
     def __init__(self):
         self.log = log_mgr.get_logger(self)
         self.servers = {}
+        self.cache_dir = None
 
     def get_schema(self, url, conn, force_update=False):
         '''
@@ -127,8 +139,46 @@ class SchemaCache(object):
             schema = self._retrieve_schema_from_server(url, conn)
             server_schema = _ServerSchema(url, schema)
             self.servers[url] = server_schema
+        elif server_schema.schema is None:
+            # only the attribute type table was loaded from disk
+            server_schema.schema = self._retrieve_schema_from_server(url, conn)
         return server_schema.schema
 
+    def get_attribute_table(self, url, conn):
+        '''
+        Return attribute type table belonging to a specific LDAP server.
+
+        The table maps lower-cased names and OIDs of attribute types to
+        (names, syntax, single_value) tuples. If the schema has not been
+        retrieved by this process yet, the table is loaded from the on-disk
+        cache, which is validated against the modification timestamp and
+        CSN of the server's subschema entry.
+        '''
+        server_schema = self.servers.get(url)
+        if server_schema is not None:
+            if server_schema.attribute_table is None:
+                server_schema.attribute_table = self._make_attribute_table(
+                    server_schema.schema)
+            return server_schema.attribute_table
+
+        schema_key = None
+        table = None
+        if self.cache_dir is not None:
+            schema_key = self._retrieve_schema_key(url, conn)
+            if schema_key is not None:
+                table = self._load_attribute_table(url, schema_key)
+
+        if table is not None:
+            self.servers[url] = _ServerSchema(url, None, table)
+            return table
+
+        schema = self.get_schema(url, conn)
+        table = self._make_attribute_table(schema)
+        self.servers[url].attribute_table = table
+        if schema_key is not None:
+            self._store_attribute_table(url, schema_key, table)
+        return table
+
     def flush(self, url):
         self.log.debug('flushing %s from SchemaCache', url)
         try:
@@ -136,6 +186,82 @@ class SchemaCache(object):
         except KeyError:
             pass
 
+    def _make_attribute_table(self, schema):
+        table = {}
+        for oid in schema.listall(ldap.schema.AttributeType):
+            obj = schema.get_obj(ldap.schema.AttributeType, oid)
+            if obj is None:
+                continue
+            item = (tuple(obj.names), obj.syntax, bool(obj.single_value))
+            table[oid.lower()] = item
+            for name in obj.names:
+                table[name.lower()] = item
+        return table
+
+    def _get_cache_file(self, url):
+        return os.path.join(self.cache_dir,
+                            'schema-%s.json' % hashlib.sha1(url).hexdigest())
+
+    def _retrieve_schema_key(self, url, conn):
+        '''
+        Return a value identifying the current version of the server schema.
+
+        This is a single base search of the subschema entry, which is much
+        cheaper than retrieving the schema itself.
+        '''
+        try:
+            schema_entry = conn.search_s(
+                'cn=schema', ldap.SCOPE_BASE,
+                attrlist=['modifyTimestamp', 'nsSchemaCSN'])[0]
+        except (ldap.LDAPError, IndexError), e:
+            self.log.debug('unable to retrieve schema CSN from %s: %s', url, e)
+            return None
+
+        attrs = CIDict(schema_entry[1])
+        schema_key = '%s;%s' % (attrs.get('modifyTimestamp', [''])[0],
+                                attrs.get('nsSchemaCSN', [''])[0])
+        if schema_key == ';':
+            return None
+        return schema_key
+
+    def _load_attribute_table(self, url, schema_key):
+        path = self._get_cache_file(url)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError), e:
+            self.log.debug('unable to read schema cache %s: %s', path, e)
+            return None
+
+        if data.get('url') != url or data.get('key') != schema_key:
+            self.log.debug('schema cache %s is stale', path)
+            return None
+
+        self.log.debug('loaded attribute types of %s from %s', url, path)
+        table = {}
+        for name, (names, syntax, single_value) in (
+                data['attributes'].iteritems()):
+            table[name.encode('utf-8')] = (
+                tuple(n.encode('utf-8') for n in names),
+                syntax.encode('utf-8') if syntax is not None else None,
+                single_value)
+        return table
+
+    def _store_attribute_table(self, url, schema_key, table):
+        path = self._get_cache_file(url)
+        data = dict(url=url, key=schema_key, attributes=table)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                os.rename(tmp_path, path)
+            except:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError), e:
+            self.log.debug('unable to write schema cache %s: %s', path, e)
+
     def _retrieve_schema_from_server(self, url, conn):
         """
         Retrieve the LDAP schema from the provided url and determine if
@@ -187,6 +313,245 @@ class SchemaCache(object):
 schema_cache = SchemaCache()
 
 
+class LDAPConnectionPool(object):
+    '''
+    Per-process pool of bound python-ldap connections.
+
+    Connections are stored under an opaque key (typically the LDAP URI
+    together with the identity the connection is bound as) so that a
+    connection is only ever handed out to a caller acting as the same
+    identity it was bound with.
+
+    Idle connections are discarded after idle_timeout seconds. Connections
+    which have been idle for more than check_interval seconds are checked
+    with a cheap "Who am I?" extended operation before they are reused.
+    At most max_size idle connections are kept, the least recently used
+    ones are unbound first.
+    '''
+
+    def __init__(self, max_size=10, idle_timeout=60, check_interval=5):
+        self.log = log_mgr.get_logger(self)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._idle = []
+        self.stats = dict(hits=0, misses=0, released=0, discarded=0,
+                          failed_checks=0)
+
+    def __len__(self):
+        return len(self._idle)
+
+    def _discard(self, conn):
+        self.stats['discarded'] += 1
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _is_alive(self, conn):
+        try:
+            conn.whoami_s()
+        except ldap.LDAPError, e:
+            self.log.debug('pooled LDAP connection failed check: %s', e)
+            self.stats['failed_checks'] += 1
+            return False
+        return True
+
+    def get(self, key):
+        '''
+        Return an idle connection stored under key or None.
+        '''
+        now = time.time()
+        expired = []
+        conn = None
+        with self._lock:
+            for i in xrange(len(self._idle) - 1, -1, -1):
+                item_key, item_conn, last_used = self._idle[i]
+                if now - last_used > self.idle_timeout:
+                    expired.append(item_conn)
+                    del self._idle[i]
+                elif conn is None and item_key == key:
+                    conn = item_conn
+                    idle_time = now - last_used
+                    del self._idle[i]
+
+        for item_conn in expired:
+            self._discard(item_conn)
+
+        if (conn is not None and idle_time > self.check_interval and
+                not self._is_alive(conn)):
+            self._discard(conn)
+            conn = None
+
+        with self._lock:
+            if conn is None:
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+        return conn
+
+    def put(self, key, conn):
+        '''
+        Return a connection bound as key to the pool.
+        '''
+        evicted = []
+        with self._lock:
+            self.stats['released'] += 1
+            self._idle.append((key, conn, time.time()))
+            while len(self._idle) > self.max_size:
+                evicted.append(self._idle.pop(0)[1])
+
+        for item_conn in evicted:
+            self._discard(item_conn)
+
+    def flush(self):
+        '''
+        Unbind all idle connections.
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for key, conn, last_used in idle:
+            self._discard(conn)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['idle'] = len(self._idle)
+        return stats
+
+
+def _context_tag(number, format=tag.tagFormatSimple):
+    return tag.Tag(tag.tagClassContext, format, number)
+
+
+class _SortKey(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('attributeType', univ.OctetString()),
+        namedtype.OptionalNamedType('orderingRule', univ.OctetString().subtype(
+            implicitTag=_context_tag(0))),
+        namedtype.DefaultedNamedType('reverseOrder', univ.Boolean(False).subtype(
+            implicitTag=_context_tag(1))),
+    )
+
+
+class _SortKeyList(univ.SequenceOf):
+    componentType = _SortKey()
+
+
+class SortRequestControl(RequestControl):
+    """
+    Server side sorting request control, see RFC 2891.
+
+    ``sort_keys`` is a list of attribute names, prefixed with ``-`` for the
+    reverse order.
+    """
+    controlType = '1.2.840.113556.1.4.473'
+
+    def __init__(self, sort_keys, criticality=True):
+        RequestControl.__init__(self, self.controlType, criticality)
+        self.sort_keys = sort_keys
+
+    def encodeControlValue(self):
+        key_list = _SortKeyList()
+        for (i, name) in enumerate(self.sort_keys):
+            key = _SortKey()
+            key.setComponentByName('attributeType', name.lstrip('-'))
+            if name.startswith('-'):
+                key.setComponentByName('reverseOrder', True)
+            key_list.setComponentByPosition(i, key)
+        return encoder.encode(key_list)
+
+
+class _ByOffset(univ.Sequence):
+    tagSet = univ.Sequence.tagSet.tagImplicitly(
+        _context_tag(0, tag.tagFormatConstructed))
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('offset', univ.Integer()),
+        namedtype.NamedType('contentCount', univ.Integer()),
+    )
+
+
+class _VLVTarget(univ.Choice):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('byOffset', _ByOffset()),
+        namedtype.NamedType('greaterThanOrEqual', univ.OctetString().subtype(
+            implicitTag=_context_tag(1))),
+    )
+
+
+class _VLVRequest(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('beforeCount', univ.Integer()),
+        namedtype.NamedType('afterCount', univ.Integer()),
+        namedtype.NamedType('target', _VLVTarget()),
+        namedtype.OptionalNamedType('contextID', univ.OctetString()),
+    )
+
+
+class _VLVResponse(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('targetPosition', univ.Integer()),
+        namedtype.NamedType('contentCount', univ.Integer()),
+        namedtype.NamedType('virtualListViewResult', univ.Enumerated()),
+        namedtype.OptionalNamedType('contextID', univ.OctetString()),
+    )
+
+
+class VLVRequestControl(RequestControl):
+    """
+    Virtual list view request control selecting the entries by offset, see
+    draft-ietf-ldapext-ldapv3-vlv.
+
+    ``offset`` is the 1-based position of the target entry in the sorted
+    result, ``before_count`` and ``after_count`` the numbers of entries
+    returned before and after it.  It must be sent with a
+    `SortRequestControl`.
+    """
+    controlType = '2.16.840.1.113730.3.4.9'
+
+    def __init__(self, offset, before_count=0, after_count=0,
+                 content_count=0, criticality=True):
+        RequestControl.__init__(self, self.controlType, criticality)
+        self.offset = offset
+        self.before_count = before_count
+        self.after_count = after_count
+        self.content_count = content_count
+
+    def encodeControlValue(self):
+        by_offset = _ByOffset()
+        by_offset.setComponentByName('offset', self.offset)
+        by_offset.setComponentByName('contentCount', self.content_count)
+        target = _VLVTarget()
+        target.setComponentByName('byOffset', by_offset)
+        request = _VLVRequest()
+        request.setComponentByName('beforeCount', self.before_count)
+        request.setComponentByName('afterCount', self.after_count)
+        request.setComponentByName('target', target)
+        return encoder.encode(request)
+
+
+class VLVResponseControl(ResponseControl):
+    """
+    Virtual list view response control, with the position of the target
+    entry and the server's estimate of the number of entries.
+    """
+    controlType = '2.16.840.1.113730.3.4.10'
+
+    # virtualListViewResult of an offset past the end of the list
+    OFFSET_RANGE_ERROR = 61
+
+    def decodeControlValue(self, encodedControlValue):
+        (response, rest) = decoder.decode(encodedControlValue,
+                                          asn1Spec=_VLVResponse())
+        self.target_position = int(response.getComponentByName('targetPosition'))
+        self.content_count = int(response.getComponentByName('contentCount'))
+        self.result = int(response.getComponentByName('virtualListViewResult'))
+
+
+KNOWN_RESPONSE_CONTROLS[VLVResponseControl.controlType] = VLVResponseControl
+
+
 class LDAPEntry(collections.MutableMapping):
     __slots__ = ('_conn', '_dn', '_names', '_nice', '_raw', '_sync',
                  '_not_list', '_orig', '_raw_view', '_single_value_view')
@@ -295,6 +660,16 @@ class LDAPEntry(collections.MutableMapping):
         if nice == nice_sync and raw == raw_sync:
             return
 
+        if not nice and not nice_sync and not raw_sync:
+            # Fast path for values just received from the server: decode
+            # the raw values in their original order, without computing
+            # differences.
+            nice.extend(self._conn.decode(raw, name))
+            self._sync[name] = (list(nice), list(raw))
+            if len(nice) > 1:
+                self._not_list.discard(name)
+            return
+
         nice_adds = set(nice) - set(nice_sync)
         nice_dels = set(nice_sync) - set(nice)
         raw_adds = set(raw) - set(raw_sync)
@@ -324,7 +699,8 @@ class LDAPEntry(collections.MutableMapping):
                 continue
             nice.append(value)
 
-        self._sync[name] = (deepcopy(nice), deepcopy(raw))
+        # All supported value types are immutable, a shallow copy is enough
+        self._sync[name] = (list(nice), list(raw))
 
         if len(nice) > 1:
             self._not_list.discard(name)
@@ -344,13 +720,11 @@ class LDAPEntry(collections.MutableMapping):
         if name in self._names:
             return self._names[name]
 
-        if self._conn.schema is not None:
-            attrtype = self._conn.schema.get_obj(
-                ldap.schema.AttributeType, name.encode('utf-8'))
-            if attrtype is not None:
-                for altname in attrtype.names:
-                    altname = altname.decode('utf-8')
-                    self._names[altname] = name
+        attrtype = self._conn._get_attribute(name.encode('utf-8'))
+        if attrtype is not None:
+            for altname in attrtype[0]:
+                altname = altname.decode('utf-8')
+                self._names[altname] = name
 
         self._names[name] = name
 
@@ -489,7 +863,8 @@ class LDAPEntry(collections.MutableMapping):
         if other is None:
             other = self
         assert isinstance(other, LDAPEntry)
-        self._orig = deepcopy(dict(other.raw))
+        # raw values are always lists of str, a shallow copy is enough
+        self._orig = dict((k, list(v)) for k, v in other.raw.iteritems())
 
     def generate_modlist(self):
         modlist = []
@@ -509,8 +884,10 @@ class LDAPEntry(collections.MutableMapping):
             # We used to convert to sets and use difference to calculate
             # the changes but this did not preserve order which is important
             # particularly for schema
-            adds = [value for value in new if value not in old]
-            dels = [value for value in old if value not in new]
+            old_values = set(old)
+            new_values = set(new)
+            adds = [value for value in new if value not in old_values]
+            dels = [value for value in old if value not in new_values]
             if adds and self.conn.get_attribute_single_value(name):
                 if len(adds) > 1:
                     raise errors.OnlyOneValueAllowed(attr=name)
@@ -713,6 +1090,8 @@ class LDAPClient(object):
         self._conn = None
         self._has_schema = False
         self._schema = None
+        self._has_attribute_table = False
+        self._attribute_table = None
 
         self._connect()
 
@@ -738,6 +1117,45 @@ class LDAPClient(object):
 
         return self._schema
 
+    def _get_attribute_table(self):
+        if self._no_schema:
+            return None
+
+        if not self._has_attribute_table:
+            try:
+                if self._force_schema_updates:
+                    # make sure the table is built from a fresh schema
+                    self._get_schema()
+                attribute_table = schema_cache.get_attribute_table(
+                    self.ldap_uri, self.conn)
+            except (errors.ExecutionError, IndexError):
+                attribute_table = None
+
+            # bypass ldap2's locking
+            object.__setattr__(self, '_attribute_table', attribute_table)
+            object.__setattr__(self, '_has_attribute_table', True)
+
+        return self._attribute_table
+
+    def _get_attribute(self, name_or_oid):
+        '''
+        Return the (names, syntax, single_value) tuple of an attribute type,
+        or None if it is not known.
+
+        A schema this instance already retrieved is used directly, the
+        attribute type table from the schema cache otherwise.
+        '''
+        if self._has_schema and self._schema is not None:
+            obj = self._schema.get_obj(ldap.schema.AttributeType, name_or_oid)
+            if obj is None:
+                return None
+            return (tuple(obj.names), obj.syntax, bool(obj.single_value))
+
+        attribute_table = self._get_attribute_table()
+        if attribute_table is None:
+            return None
+        return attribute_table.get(name_or_oid.lower())
+
     def _flush_schema(self):
         '''
         Force this instance to forget it's cached schema and reacquire
@@ -766,6 +1184,8 @@ class LDAPClient(object):
         # bypass ldap2's locking
         object.__setattr__(self, '_has_schema', False)
         object.__setattr__(self, '_schema', None)
+        object.__setattr__(self, '_has_attribute_table', False)
+        object.__setattr__(self, '_attribute_table', None)
 
     def get_attribute_type(self, name_or_oid):
         if not self._decode_attrs:
@@ -778,12 +1198,10 @@ class LDAPClient(object):
         if name_or_oid in self._SYNTAX_OVERRIDE:
             return self._SYNTAX_OVERRIDE[name_or_oid]
 
-        schema = self._get_schema()
-        if schema is not None:
-            # Try to lookup the syntax in the schema returned by the server
-            obj = schema.get_obj(ldap.schema.AttributeType, name_or_oid)
-            if obj is not None and obj.syntax in self._SYNTAX_MAPPING:
-                return self._SYNTAX_MAPPING[obj.syntax]
+        # Try to lookup the syntax in the schema returned by the server
+        obj = self._get_attribute(name_or_oid)
+        if obj is not None and obj[1] in self._SYNTAX_MAPPING:
+            return self._SYNTAX_MAPPING[obj[1]]
 
         return unicode
 
@@ -810,11 +1228,9 @@ class LDAPClient(object):
         if name_or_oid in self._SINGLE_VALUE_OVERRIDE:
             return self._SINGLE_VALUE_OVERRIDE[name_or_oid]
 
-        schema = self._get_schema()
-        if schema is not None:
-            obj = schema.get_obj(ldap.schema.AttributeType, name_or_oid)
-            if obj is not None:
-                return obj.single_value
+        obj = self._get_attribute(name_or_oid)
+        if obj is not None:
+            return obj[2]
 
         return None
 
@@ -1294,13 +1710,46 @@ class LDAPClient(object):
         :raises: errors.NotFound if result set is empty
                                  or base_dn doesn't exist
         """
+        res = []
+        truncated = False
+        try:
+            for entry in self.iter_entries(
+                    filter=filter, attrs_list=attrs_list, base_dn=base_dn,
+                    scope=scope, time_limit=time_limit,
+                    size_limit=size_limit, search_refs=search_refs,
+                    paged_search=paged_search):
+                res.append(entry)
+        except errors.LimitsExceeded:
+            truncated = True
+
+        if not res and not truncated:
+            raise errors.EmptyResult(reason='no matching entry found')
+
+        return (res, truncated)
+
+    def iter_entries(self, filter=None, attrs_list=None, base_dn=None,
+                     scope=ldap.SCOPE_SUBTREE, time_limit=None,
+                     size_limit=None, search_refs=False, paged_search=False):
+        """
+        Iterate over entries matching specified search parameters.
+
+        Takes the same arguments as find_entries(). Entries are yielded as
+        they are received from the server, so with paged_search only a
+        single entry is held in memory at a time. If the iteration is
+        stopped early, the search is abandoned and the paged search is
+        cancelled on the server.
+
+        Unlike find_entries(), an empty result set is not an error.
+
+        :raises: errors.LimitsExceeded if search hit a server limit, after
+                 the entries received so far were yielded
+        :raises: errors.NotFound if base_dn doesn't exist
+        """
         if base_dn is None:
             base_dn = DN()
         assert isinstance(base_dn, DN)
         if not filter:
             filter = '(objectClass=*)'
-        res = []
-        truncated = False
 
         if time_limit is None or time_limit == 0:
             time_limit = -1.0
@@ -1325,11 +1774,13 @@ class LDAPClient(object):
             filter = self.encode(filter)
             attrs_list = self.encode(attrs_list)
 
-            while True:
-                if paged_search:
-                    sctrls = [SimplePagedResultsControl(0, page_size, cookie)]
+            id = None
+            try:
+                while True:
+                    if paged_search:
+                        sctrls = [
+                            SimplePagedResultsControl(0, page_size, cookie)]
 
-                try:
                     id = self.conn.search_ext(
                         str(base_dn), scope, filter, attrs_list,
                         serverctrls=sctrls, timeout=time_limit,
@@ -1344,7 +1795,8 @@ class LDAPClient(object):
                         if (objtype == ldap.RES_SEARCH_ENTRY or
                                 (search_refs and
                                     objtype == ldap.RES_SEARCH_REFERENCE)):
-                            res.append(res_list[0])
+                            yield res_list[0]
+                    id = None
 
                     if paged_search:
                         # Get cookie for the next page
@@ -1354,34 +1806,106 @@ class LDAPClient(object):
                                 break
                         else:
                             cookie = ''
-                except ldap.LDAPError, e:
-                    # If paged search is in progress, try to cancel it
-                    if paged_search and cookie:
-                        sctrls = [SimplePagedResultsControl(0, 0, cookie)]
-                        try:
-                            self.conn.search_ext_s(
-                                str(base_dn), scope, filter, attrs_list,
-                                serverctrls=sctrls, timeout=time_limit,
-                                sizelimit=size_limit)
-                        except ldap.LDAPError, e:
-                            self.log.warning(
-                                "Error cancelling paged search: %s", e)
-                        cookie = ''
 
-                    try:
-                        raise e
-                    except (ldap.ADMINLIMIT_EXCEEDED, ldap.TIMELIMIT_EXCEEDED,
-                            ldap.SIZELIMIT_EXCEEDED):
-                        truncated = True
+                    if not paged_search or not cookie:
                         break
+            except ldap.LDAPError:
+                # the failed search has already finished on the server
+                id = None
+                raise
+            finally:
+                if id is not None:
+                    # The iteration was stopped before the search finished
+                    try:
+                        self.conn.abandon(id)
+                    except ldap.LDAPError, e:
+                        self.log.warning("Error abandoning search: %s", e)
 
-                if not paged_search or not cookie:
-                    break
+                # If paged search is in progress, try to cancel it
+                if paged_search and cookie:
+                    sctrls = [SimplePagedResultsControl(0, 0, cookie)]
+                    try:
+                        self.conn.search_ext_s(
+                            str(base_dn), scope, filter, attrs_list,
+                            serverctrls=sctrls, timeout=time_limit,
+                            sizelimit=size_limit)
+                    except ldap.LDAPError, e:
+                        self.log.warning(
+                            "Error cancelling paged search: %s", e)
+
+    def find_entries_sorted(self, filter=None, attrs_list=None, base_dn=None,
+                            scope=ldap.SCOPE_SUBTREE, sort_key=None,
+                            offset=0, limit=1, time_limit=None):
+        """
+        Return a page of the entries matching specified search parameters
+        sorted by the server, and the server's estimate of the number of
+        matching entries ([entries], total).
 
-        if not res and not truncated:
-            raise errors.EmptyResult(reason='no matching entry found')
+        The page is selected with the virtual list view control, so the
+        server only sends the entries of the page.
 
-        return (res, truncated)
+        Keyword arguments:
+        sort_key -- attribute the entries are sorted by
+        offset -- 0-based position of the first entry of the page
+        limit -- maximum number of entries of the page
+        Other arguments are the same as for find_entries().
+
+        :raises: errors.DatabaseError if the server cannot sort the entries
+                 or select the page
+        :raises: errors.NotFound if base_dn doesn't exist
+        """
+        if base_dn is None:
+            base_dn = DN()
+        assert isinstance(base_dn, DN)
+        assert limit > 0
+        if not filter:
+            filter = '(objectClass=*)'
+
+        if time_limit is None or time_limit == 0:
+            time_limit = -1.0
+        if not isinstance(time_limit, float):
+            time_limit = float(time_limit)
+
+        if attrs_list:
+            attrs_list = [a.lower() for a in set(attrs_list)]
+
+        sctrls = [
+            SortRequestControl([sort_key]),
+            VLVRequestControl(offset + 1, after_count=limit - 1),
+        ]
+
+        entries = []
+        with self.error_handler():
+            filter = self.encode(filter)
+            attrs_list = self.encode(attrs_list)
+
+            id = self.conn.search_ext(
+                str(base_dn), scope, filter, attrs_list,
+                serverctrls=sctrls, timeout=time_limit)
+            while True:
+                result = self.conn.result3(id, 0)
+                objtype, res_list, res_id, res_ctrls = result
+                res_list = self._convert_result(res_list)
+                if not res_list:
+                    break
+                if objtype == ldap.RES_SEARCH_ENTRY:
+                    entries.append(res_list[0])
+
+        for ctrl in res_ctrls:
+            if isinstance(ctrl, VLVResponseControl):
+                break
+        else:
+            raise errors.DatabaseError(
+                desc='virtual list view', info='no response control')
+        if ctrl.result == VLVResponseControl.OFFSET_RANGE_ERROR:
+            entries = []
+        elif ctrl.result != 0:
+            raise errors.DatabaseError(
+                desc='virtual list view', info='result %d' % ctrl.result)
+        elif offset >= ctrl.content_count:
+            # the server returns the last entries for an offset past the end
+            entries = []
+        return (entries[:limit], ctrl.content_count)
 
     def find_entry_by_attr(self, attr, value, object_class, attrs_list=None,
                            base_dn=None):
@@ -119,6 +119,34 @@ def client_auth_data_callback(ca_names, chosen_nickname, password, certdb):
                 return False
         return False
 
+def is_initialized(dbdir):
+    """
+    Return True if NSS is initialized with the database ``dbdir``.
+    """
+    return current_dbdir == dbdir and nss.nss_is_initialized()
+
+def init_database(dbdir):
+    """
+    Initialize NSS with the database ``dbdir``, shutting down the database
+    currently open. This breaks the SSL sockets open with the previous
+    database.
+    """
+    if nss.nss_is_initialized():
+        ssl.clear_session_cache()
+        try:
+            nss.nss_shutdown()
+        except NSPRError, e:
+            if e.errno != error.SEC_ERROR_NOT_INITIALIZED:
+                raise e
+
+    if not dbdir:
+        raise RuntimeError("dbdir is required")
+
+    nss.nss_init(dbdir)
+
+    global current_dbdir
+    current_dbdir = dbdir
+
 _af_dict = {
     socket.AF_INET: io.PR_AF_INET,
     socket.AF_INET6: io.PR_AF_INET6,
@@ -194,22 +222,7 @@ class NSSConnection(httplib.HTTPConnection, NSSAddressFamilyFallback):
 
         # If initialization is requested, initialize the new database.
         if not no_init:
-
-            if nss.nss_is_initialized():
-                ssl.clear_session_cache()
-                try:
-                    nss.nss_shutdown()
-                except NSPRError, e:
-                    if e.errno != error.SEC_ERROR_NOT_INITIALIZED:
-                        raise e
-
-            if not dbdir:
-                raise RuntimeError("dbdir is required")
-
-            nss.nss_init(dbdir)
-
-            global current_dbdir
-            current_dbdir = dbdir
+            init_database(dbdir)
 
         ssl.set_domestic_policy()
         nss.set_password_callback(self.password_callback)
@@ -702,7 +702,7 @@ class DsInstance(service.Service):
         self._ldap_mod("replica-s4u2proxy.ldif", self.sub_dict)
 
     def __create_indices(self):
-        self._ldap_mod("indices.ldif")
+        self._ldap_mod("indices.ldif", self.sub_dict)
 
     def __certmap_conf(self):
         shutil.copyfile(ipautil.SHARE_DIR + "certmap.conf.template",
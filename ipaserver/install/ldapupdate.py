@@ -518,8 +518,11 @@ class LDAPUpdate:
 
         return all_updates
 
-    def create_index_task(self, attribute):
-        """Create a task to update an index for an attribute"""
+    def create_index_task(self, attribute, vlv=False):
+        """Create a task to update an index for an attribute
+
+        With vlv, attribute is the name of a VLV index to update.
+        """
 
         # Sleep a bit to ensure previous operations are complete
         time.sleep(5)
@@ -536,8 +539,11 @@ class LDAPUpdate:
             objectClass=['top', 'extensibleObject'],
             cn=[cn],
             nsInstance=['userRoot'],
-            nsIndexAttribute=[attribute],
         )
+        if vlv:
+            e['nsIndexVLVAttribute'] = [attribute]
+        else:
+            e['nsIndexAttribute'] = [attribute]
 
         self.info("Creating task to index attribute: %s", attribute)
         self.debug("Task id: %s", dn)
@@ -812,6 +818,13 @@ class LDAPUpdate:
                                 ('cn', 'config'))) and (added or updated):
             taskid = self.create_index_task(entry.single_value['cn'])
             self.monitor_index_task(taskid)
+        elif entry.dn.endswith(DN(('cn', 'userRoot'), ('cn', 'ldbm database'),
+                                  ('cn', 'plugins'), ('cn', 'config'))) and \
+                'vlvindex' in [o.lower() for o in entry.get('objectclass', [])] \
+                and (added or updated):
+            # entries added before the VLV index are only indexed by a task
+            taskid = self.create_index_task(entry.single_value['cn'], vlv=True)
+            self.monitor_index_task(taskid)
         return
 
     def _delete_record(self, updates):
@@ -127,40 +127,40 @@ class update_idrange_baserid(Updater):
             "with ipaBaseRID != 0"
         )
 
-        try:
-            (entries, truncated) = ldap.find_entries(
-                search_filter, ['ipabaserid'], base_dn,
-                paged_search=True, time_limit=0, size_limit=0)
+        entries = ldap.iter_entries(
+            search_filter, ['ipabaserid'], base_dn,
+            paged_search=True, time_limit=0, size_limit=0)
 
-        except errors.NotFound:
-            root_logger.debug("update_idrange_baserid: no AD domain "
-                              "range with posix attributes found")
-            return False, []
+        error = False
+        count = 0
 
+        try:
+            # Set the range type
+            for entry in entries:
+                count += 1
+                entry['ipabaserid'] = 0
+                try:
+                    root_logger.info("Updating existing idrange: %s" % (entry.dn))
+                    ldap.update_entry(entry)
+                    root_logger.info("Done")
+                except (errors.EmptyModlist, errors.NotFound):
+                    pass
+                except errors.ExecutionError, e:
+                    root_logger.debug("update_idrange_type: cannot "
+                                      "update idrange: %s", e)
+                    error = True
         except errors.ExecutionError, e:
             root_logger.error("update_idrange_baserid: cannot retrieve "
                               "list of affected ranges: %s", e)
             return False, []
 
-        root_logger.debug("update_idrange_baserid: found %d "
-                          "idranges possible to update",
-                          len(entries))
-
-        error = False
+        if not count:
+            root_logger.debug("update_idrange_baserid: no AD domain "
+                              "range with posix attributes found")
+            return False, []
 
-        # Set the range type
-        for entry in entries:
-            entry['ipabaserid'] = 0
-            try:
-                root_logger.info("Updating existing idrange: %s" % (entry.dn))
-                ldap.update_entry(entry)
-                root_logger.info("Done")
-            except (errors.EmptyModlist, errors.NotFound):
-                pass
-            except errors.ExecutionError, e:
-                root_logger.debug("update_idrange_type: cannot "
-                                  "update idrange: %s", e)
-                error = True
+        root_logger.debug("update_idrange_baserid: processed %d "
+                          "idranges possible to update", count)
 
         if error:
             root_logger.error("update_idrange_baserid: error(s) "
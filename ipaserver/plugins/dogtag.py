@@ -240,6 +240,7 @@ digits and nothing else follows.
 import datetime
 from lxml import etree
 import tempfile
+import threading
 import time
 import urllib2
 
@@ -249,6 +250,7 @@ from pki.kra import KRAClient
 
 from ipalib import Backend
 from ipapython.dn import DN
+from ipapython.ipa_log_manager import root_logger
 import ipapython.dogtag
 from ipapython import ipautil
 from ipaserver.install.certs import CertDB
@@ -1210,6 +1212,52 @@ def parse_unrevoke_cert_xml(doc):
     return response
 
 
+class MasterCache(object):
+    """
+    Per-process cache of the results of host_has_service() and
+    select_any_master(), so that bulk certificate operations do not search
+    the masters for every certificate.
+
+    Results are used for ``ttl`` seconds; ``ttl`` 0 disables the cache.
+    Lookups which fail are not cached, so that a transient error does not
+    make the CA unavailable for ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def lookup(self, key, func, default=None):
+        """
+        Return the cached result stored under ``key`` or the result of
+        calling ``func()``. If ``func()`` raises an exception, ``default``
+        is returned and nothing is cached.
+        """
+        now = time.time()
+        with self._lock:
+            if key in self._results:
+                result, stored = self._results[key]
+                if now - stored < self.ttl:
+                    return result
+        try:
+            result = func()
+        except Exception, e:
+            root_logger.debug('%s lookup failed: %s', key[0], e)
+            return default
+        if self.ttl > 0:
+            with self._lock:
+                self._results[key] = (result, now)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+master_cache = MasterCache()
+
+
 def host_has_service(host, ldap2, service='CA'):
     """
     :param host: A host which might be a master for a service.
@@ -1219,21 +1267,25 @@ def host_has_service(host, ldap2, service='CA'):
 
     Check if a specified host is a master for a specified service.
     """
-    base_dn = DN(('cn', host), ('cn', 'masters'), ('cn', 'ipa'),
-                 ('cn', 'etc'), api.env.basedn)
-    filter_attrs = {
-        'objectClass': 'ipaConfigObject',
-        'cn': service,
-        'ipaConfigString': 'enabledService',
-        }
-    query_filter = ldap2.make_filter(filter_attrs, rules='&')
-    try:
-        ent, trunc = ldap2.find_entries(filter=query_filter, base_dn=base_dn)
-        if len(ent):
-            return True
-    except Exception:
-        pass
-    return False
+    def lookup():
+        base_dn = DN(('cn', host), ('cn', 'masters'), ('cn', 'ipa'),
+                     ('cn', 'etc'), api.env.basedn)
+        filter_attrs = {
+            'objectClass': 'ipaConfigObject',
+            'cn': service,
+            'ipaConfigString': 'enabledService',
+            }
+        query_filter = ldap2.make_filter(filter_attrs, rules='&')
+        try:
+            ent, trunc = ldap2.find_entries(filter=query_filter, base_dn=base_dn)
+            if len(ent):
+                return True
+        except errors.NotFound:
+            pass
+        return False
+
+    return master_cache.lookup(('host_has_service', host, service), lookup,
+                               False)
 
 
 def select_any_master(ldap2, service='CA'):
@@ -1244,21 +1296,94 @@ def select_any_master(ldap2, service='CA'):
 
     Select any host which is a master for a specified service.
     """
-    base_dn = DN(('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'),
-                  api.env.basedn)
-    filter_attrs = {
-         'objectClass': 'ipaConfigObject',
-         'cn': service,
-         'ipaConfigString': 'enabledService',}
-    query_filter = ldap2.make_filter(filter_attrs, rules='&')
-    try:
-        ent, trunc = ldap2.find_entries(filter=query_filter, base_dn=base_dn)
-        if len(ent):
-            entry = random.choice(ent)
-            return entry.dn[1].value
-    except Exception:
-        pass
-    return None
+    def lookup():
+        base_dn = DN(('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'),
+                      api.env.basedn)
+        filter_attrs = {
+             'objectClass': 'ipaConfigObject',
+             'cn': service,
+             'ipaConfigString': 'enabledService',}
+        query_filter = ldap2.make_filter(filter_attrs, rules='&')
+        try:
+            ent, trunc = ldap2.find_entries(filter=query_filter, base_dn=base_dn)
+            if len(ent):
+                entry = random.choice(ent)
+                return entry.dn[1].value
+        except errors.NotFound:
+            pass
+        return None
+
+    return master_cache.lookup(('select_any_master', service), lookup)
+
+
+class ConnectionPool(object):
+    """
+    Per-process pool of keep-alive connections to the CA, see
+    ipapython.dogtag._httplib_request().
+
+    Connections are stored under a (protocol, host, port) key. Idle
+    connections are closed after ``idle_timeout`` seconds, at most
+    ``max_size`` of them are kept, the least recently used ones are closed
+    first.
+    """
+
+    def __init__(self, max_size=4, idle_timeout=15):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def __len__(self):
+        return len(self._idle)
+
+    def get(self, key):
+        """
+        Return an idle connection stored under ``key`` or None.
+        """
+        now = time.time()
+        expired = []
+        conn = None
+        with self._lock:
+            for i in xrange(len(self._idle) - 1, -1, -1):
+                item_key, item_conn, last_used = self._idle[i]
+                if now - last_used > self.idle_timeout:
+                    expired.append(item_conn)
+                    del self._idle[i]
+                elif conn is None and item_key == key:
+                    conn = item_conn
+                    del self._idle[i]
+
+        for item_conn in expired:
+            item_conn.close()
+        return conn
+
+    def put(self, key, conn):
+        """
+        Return a connection stored under ``key`` to the pool.
+        """
+        evicted = []
+        with self._lock:
+            self._idle.append((key, conn, time.time()))
+            while len(self._idle) > self.max_size:
+                evicted.append(self._idle.pop(0)[1])
+
+        for item_conn in evicted:
+            item_conn.close()
+
+    def flush(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for key, conn, last_used in idle:
+            conn.close()
+
+
+# Client authenticated HTTPS connections of the RA agent, and HTTP
+# connections, to the CA are kept in a per-process pool and reused for
+# later requests.
+connection_pool = ConnectionPool()
 
 #-------------------------------------------------------------------------------
 
@@ -1268,9 +1393,9 @@ if api.env.ra_plugin != 'dogtag':
     raise SkipPluginModule(reason='dogtag not selected as RA plugin')
 import os, random
 from ipaserver.plugins import rabase
+from ipalib import errors
 from ipalib.errors import CertificateOperationError
 from ipalib.constants import TYPE_ERROR
-from ipalib.util import cachedproperty
 from ipapython import dogtag
 from ipalib import _
 from ipaplatform.paths import paths
@@ -1320,14 +1445,17 @@ class ra(rabase.rabase):
         self.error('%s.%s(): %s', self.fullname, func_name, err_msg)
         raise CertificateOperationError(error=err_msg)
 
-    @cachedproperty
+    @property
     def ca_host(self):
         """
         :return:   host
                    as str
 
         Select our CA host.
+
+        The masters found are cached in master_cache.
         """
+        master_cache.ttl = self.env.ra_master_cache_ttl
         ldap2 = self.api.Backend.ldap2
         if host_has_service(api.env.ca_host, ldap2, "CA"):
             return api.env.ca_host
@@ -1349,7 +1477,8 @@ class ra(rabase.rabase):
 
         Perform an HTTP request.
         """
-        return dogtag.http_request(self.ca_host, port, url, **kw)
+        return self._pooled_request(
+            dogtag.http_request, self.ca_host, port, url, **kw)
 
     def _sslget(self, url, port, **kw):
         """
@@ -1360,7 +1489,39 @@ class ra(rabase.rabase):
 
         Perform an HTTPS request
         """
-        return dogtag.https_request(self.ca_host, port, url, self.sec_dir, self.password, self.ipa_certificate_nickname, **kw)
+        return self._pooled_request(
+            dogtag.https_request, self.ca_host, port, url, self.sec_dir,
+            self.password, self.ipa_certificate_nickname, **kw)
+
+    def init_nss(self):
+        """
+        Initialize NSS with the RA agent database.
+        """
+        dogtag.init_nss(self.sec_dir, self._get_connection_pool())
+
+    def _get_connection_pool(self):
+        """
+        Return the connection pool or None if pooling is disabled.
+        """
+        if not self.env.ra_pool_size:
+            return None
+        connection_pool.max_size = self.env.ra_pool_size
+        connection_pool.idle_timeout = self.env.ra_pool_idle_timeout
+        return connection_pool
+
+    def _pooled_request(self, request_func, *args, **kw):
+        """
+        Call ``request_func`` with a pooled connection.
+
+        When the CA cannot be reached the cached masters are forgotten, so
+        that the next request selects the CA host again.
+        """
+        try:
+            return request_func(
+                connection_pool=self._get_connection_pool(), *args, **kw)
+        except errors.NetworkError:
+            master_cache.clear()
+            raise
 
     def get_parse_result_xml(self, xml_text, parse_func):
         '''
@@ -1742,12 +1903,40 @@ class ra(rabase.rabase):
 
         return cmd_result
 
+    # number of certificates requested from the CA at a time by find()
+    find_page_size = 1000
+
     def find(self, options):
         """
         Search for certificates
 
         :param options: dictionary of search options
         """
+        results = []
+        sizelimit = options.get('sizelimit', 100)
+        for cert in self.iter_find(options):
+            if len(results) >= sizelimit:
+                break
+            results.append(cert)
+        return results
+
+    def iter_find(self, options):
+        """
+        Iterate over the certificates matching the search options in serial
+        number order.
+
+        The certificates are requested from the CA one page at a time, each
+        page starting after the serial number of the last certificate of the
+        previous one, and every page is parsed as it is received. A page
+        with fewer certificates than requested ends the search, so
+        find_page_size must not exceed the page size limit of the CA. The
+        'sizelimit' option only limits the page size.
+
+        :param options: dictionary of search options, the 'cursor' option is
+                        the serial number of the first certificate returned
+                        and 'pkey_only' limits the certificates to their
+                        serial numbers and status
+        """
 
         def convert_time(value):
             """
@@ -1756,13 +1945,7 @@ class ra(rabase.rabase):
             ts = time.strptime(value, '%Y-%m-%d')
             return int(time.mktime(ts) * 1000)
 
-        self.debug('%s.find()', self.fullname)
-
-        # Create the root element
-        page = etree.Element('CertSearchRequest')
-
-        # Make a new document tree
-        doc = etree.ElementTree(page)
+        self.debug('%s.iter_find()', self.fullname)
 
         # This matches the default configuration of the pki tool.
         booloptions = {'serialNumberRangeInUse': True,
@@ -1778,27 +1961,21 @@ class ra(rabase.rabase):
                        'validityLengthInUse': False,
                        'certTypeInUse': False}
 
+        # search elements except the serial number range
+        elements = []
+
         if options.get('exactly', False):
             booloptions['matchExactly'] = True
 
         if 'subject' in options:
-            node = etree.SubElement(page, 'commonName')
-            node.text = options['subject']
+            elements.append(('commonName', options['subject']))
             booloptions['subjectInUse'] = True
 
         if 'revocation_reason' in options:
-            node = etree.SubElement(page, 'revocationReason')
-            node.text = unicode(options['revocation_reason'])
+            elements.append(
+                ('revocationReason', unicode(options['revocation_reason'])))
             booloptions['revocationReasonInUse'] = True
 
-        if 'min_serial_number' in options:
-            node = etree.SubElement(page, 'serialFrom')
-            node.text = unicode(options['min_serial_number'])
-
-        if 'max_serial_number' in options:
-            node = etree.SubElement(page, 'serialTo')
-            node.text = unicode(options['max_serial_number'])
-
         # date_types is a tuple that consists of:
         #   1. attribute name passed from IPA API
         #   2. attribute name used by REST API
@@ -1818,67 +1995,103 @@ class ra(rabase.rabase):
         for (attr, dattr, battr) in date_types:
             if attr in options:
                 epoch = convert_time(options[attr])
-                node = etree.SubElement(page, dattr)
-                node.text = unicode(epoch)
+                elements.append((dattr, unicode(epoch)))
                 booloptions[battr] = True
 
         # Add the boolean options to our XML document
         for opt in booloptions:
-            e = etree.SubElement(page, opt)
-            e.text = str(booloptions[opt]).lower()
-
-        payload = etree.tostring(doc, pretty_print=False, xml_declaration=True, encoding='UTF-8')
-        self.debug('%s.find(): request: %s', self.fullname, payload)
+            elements.append((opt, str(booloptions[opt]).lower()))
 
-        url = 'http://%s/ca/rest/certs/search?size=%d' % (ipautil.format_netloc(self.ca_host, ipapython.dogtag.configured_constants().UNSECURE_PORT), options.get('sizelimit', 100))
-
-        opener = urllib2.build_opener()
-        opener.addheaders = [('Accept-Encoding', 'gzip, deflate'),
-                             ('User-Agent', 'IPA')]
-
-        req = urllib2.Request(url=url, data=payload, headers={'Content-Type': 'application/xml'})
-        try:
-            response = opener.open(req)
-        except urllib2.HTTPError, e:
-            self.debug('HTTP Response code: %d' % e.getcode())
-            if e.getcode() == 501:
-                self.raise_certificate_operation_error('find',
-                    detail=_('find not supported on CAs upgraded from 9 to 10'))
-            self.raise_certificate_operation_error('find',
-                                                   detail=e.msg)
-        except urllib2.URLError, e:
-            self.raise_certificate_operation_error('find',
-                                                   detail=e.reason)
-
-        data = response.readlines()
-        self.debug('%s.find(): response: %s', self.fullname, data)
-        parser = etree.XMLParser()
-        try:
-            doc = etree.fromstring(data[0], parser)
-        except etree.XMLSyntaxError, e:
-            self.raise_certificate_operation_error('find',
-                                                   detail=e.msg)
+        serial_from = max(options.get('min_serial_number', 0),
+                          options.get('cursor', 0))
+        serial_to = options.get('max_serial_number')
+        pkey_only = options.get('pkey_only', False)
 
-        # Grab all the certificates
-        certs = doc.xpath('//CertDataInfo')
+        # a page one certificate larger than the size limit tells whether
+        # there are more certificates
+        page_size = self.find_page_size
+        if options.get('sizelimit') is not None:
+            page_size = min(page_size, options['sizelimit'] + 1)
 
-        results = []
+        url = 'http://%s/ca/rest/certs/search?size=%d' % (
+            ipautil.format_netloc(
+                self.ca_host,
+                ipapython.dogtag.configured_constants().UNSECURE_PORT),
+            page_size)
 
-        for cert in certs:
-            response_request = {}
-            response_request['serial_number'] = int(cert.get('id'), 16) # parse as hex
-            response_request['serial_number_hex'] = u'0x%X' % response_request['serial_number']
+        opener = urllib2.build_opener()
+        opener.addheaders = [('User-Agent', 'IPA')]
 
-            dn = cert.xpath('SubjectDN')
-            if len(dn) == 1:
-                response_request['subject'] = unicode(dn[0].text)
-            status = cert.xpath('Status')
-            if len(status) == 1:
-                response_request['status'] = unicode(status[0].text)
-            results.append(response_request)
+        while serial_to is None or serial_from <= serial_to:
+            # Create the root element
+            page = etree.Element('CertSearchRequest')
 
-        return results
+            # Make a new document tree
+            doc = etree.ElementTree(page)
 
+            node = etree.SubElement(page, 'serialFrom')
+            node.text = unicode(serial_from)
+            if serial_to is not None:
+                node = etree.SubElement(page, 'serialTo')
+                node.text = unicode(serial_to)
+
+            for (tag, text) in elements:
+                node = etree.SubElement(page, tag)
+                node.text = text
+
+            payload = etree.tostring(doc, pretty_print=False, xml_declaration=True, encoding='UTF-8')
+            self.debug('%s.iter_find(): request: %s', self.fullname, payload)
+
+            req = urllib2.Request(url=url, data=payload, headers={'Content-Type': 'application/xml'})
+            try:
+                response = opener.open(req)
+            except urllib2.HTTPError, e:
+                self.debug('HTTP Response code: %d' % e.getcode())
+                if e.getcode() == 501:
+                    self.raise_certificate_operation_error('find',
+                        detail=_('find not supported on CAs upgraded from 9 to 10'))
+                self.raise_certificate_operation_error('find',
+                                                       detail=e.msg)
+            except urllib2.URLError, e:
+                self.raise_certificate_operation_error('find',
+                                                       detail=e.reason)
+
+            count = 0
+            try:
+                try:
+                    for (event, cert) in etree.iterparse(
+                            response, tag='CertDataInfo'):
+                        count += 1
+                        serial_number = int(cert.get('id'), 16) # parse as hex
+                        response_request = {}
+                        response_request['serial_number'] = serial_number
+                        response_request['serial_number_hex'] = u'0x%X' % serial_number
+
+                        if not pkey_only:
+                            dn = cert.find('SubjectDN')
+                            if dn is not None:
+                                response_request['subject'] = unicode(dn.text)
+                        status = cert.find('Status')
+                        if status is not None:
+                            response_request['status'] = unicode(status.text)
+
+                        # free the certificates parsed so far
+                        cert.clear()
+                        while cert.getprevious() is not None:
+                            del cert.getparent()[0]
+
+                        serial_from = serial_number + 1
+                        yield response_request
+                except etree.XMLSyntaxError, e:
+                    self.raise_certificate_operation_error('find',
+                                                           detail=e.msg)
+            finally:
+                response.close()
+
+            self.debug('%s.iter_find(): %d certificates received',
+                       self.fullname, count)
+            if count < page_size:
+                break
 
 api.register(ra)
 
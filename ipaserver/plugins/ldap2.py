@@ -27,14 +27,19 @@ Backend plugin for LDAP.
 # binding encodes them into the appropriate representation. This applies to
 # everything except the CrudBackend methods, where dn is part of the entry dict.
 
+import collections
 import os
 import pwd
+import threading
+import time
 
 import krbV
 import ldap as _ldap
 
 from ipapython.dn import DN
-from ipapython.ipaldap import SASL_GSSAPI, LDAPClient
+from ipapython.ipaldap import (
+    SASL_GSSAPI, LDAPClient, LDAPConnectionPool, schema_cache)
+from ipaplatform.paths import paths
 
 
 try:
@@ -55,12 +60,88 @@ from ipalib import api, errors, _
 from ipalib.crud import CrudBackend
 from ipalib.request import context
 
+# GSSAPI bound connections are not unbound at the end of a request, they are
+# kept in a per-process pool and reused for later requests of the same
+# principal.
+connection_pool = LDAPConnectionPool()
+
+
+class IPAConfigCache(object):
+    """
+    Process-wide cache of the IPA configuration entry.
+
+    The raw attribute values of the entry are kept with its modifyTimestamp
+    and entryUSN.  When the entry was checked more than ``ttl`` seconds ago,
+    these two attributes are read again and the entry is only fetched if
+    they changed.
+
+    The entry is kept per principal, as principals may be allowed to read
+    different attributes of it.  Only the entries of the ``max_size`` most
+    recent principals are kept.
+    """
+
+    max_size = 16
+
+    def __init__(self):
+        self.ttl = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, principal):
+        """
+        Return a ``(raw, version, checked)`` tuple, None if nothing is
+        cached for ``principal``.
+        """
+        with self._lock:
+            entry = self._entries.pop(principal, None)
+            if entry is not None:
+                self._entries[principal] = entry
+            return entry
+
+    def set(self, principal, raw, version):
+        with self._lock:
+            self._entries.pop(principal, None)
+            self._entries[principal] = (raw, version, time.time())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+config_cache = IPAConfigCache()
+
+
+def _context_property(name):
+    """
+    Property stored on the thread-local `request.context`, so that every
+    thread using a shared ldap2 instance has its own value.
+    """
+    def fget(self):
+        return getattr(context, '%s_%s' % (self.id, name), None)
+
+    def fset(self, value):
+        setattr(context, '%s_%s' % (self.id, name), value)
+
+    return property(fget, fset)
+
 
 class ldap2(LDAPClient, CrudBackend):
     """
     LDAP Backend Take 2.
     """
 
+    # maximum number of member values changed by a single modify in
+    # add_entries_to_group and remove_entries_from_group
+    member_batch_size = 1000
+
+    # the LDAP connection is thread-local, like Connectible.conn
+    _conn = _context_property('conn')
+    _pool_key = _context_property('pool_key')
+    # the principal the connection is bound as with Kerberos credentials
+    _bind_principal = _context_property('bind_principal')
+
     def __init__(self, shared_instance=False, ldap_uri=None, base_dn=None,
                  schema=None):
         self.__ldap_uri = None
@@ -147,8 +228,43 @@ class ldap2(LDAPClient, CrudBackend):
 
         object.__setattr__(self, '_force_schema_updates',
                            self.api.env.context in ('installer', 'updates'))
+        if self.api.env.context == 'server':
+            # let new Apache processes load attribute types from disk
+            schema_cache.cache_dir = paths.IPA_SCHEMA_CACHE_DIR
+
+        principal = None
+        if ccache is not None:
+            if isinstance(ccache, krbV.CCache):
+                principal = ccache.principal().name
+                # Get a fully qualified CCACHE name (schema+name)
+                # As we do not use the krbV.CCache object later,
+                # we can safely overwrite it
+                ccache = "%(type)s:%(name)s" % dict(type=ccache.type,
+                                                    name=ccache.name)
+            else:
+                principal = krbV.CCache(name=ccache,
+                    context=krbV.default_context()).principal().name
+
+        pool = self._get_connection_pool()
+        if pool is not None and principal is not None and not serverctrls:
+            pool_key = (self.ldap_uri, principal)
+            conn = pool.get(pool_key)
+            if conn is not None:
+                # bypass ldap2's locking
+                object.__setattr__(self, '_conn', conn)
+                object.__setattr__(self, '_pool_key', pool_key)
+                object.__setattr__(self, '_bind_principal', principal)
+                self._flush_schema()
+                os.environ['KRB5CCNAME'] = ccache
+                setattr(context, 'principal', principal)
+                return conn
+        else:
+            pool_key = None
+
         LDAPClient._connect(self)
         conn = self._conn
+        # bypass ldap2's locking
+        object.__setattr__(self, '_bind_principal', None)
 
         with self.error_handler():
             if self.ldap_uri.startswith('ldapi://') and ccache:
@@ -164,21 +280,13 @@ class ldap2(LDAPClient, CrudBackend):
                     conn.set_option(_ldap.OPT_X_SASL_SSF_MAX, minssf)
 
         if ccache is not None:
-            if isinstance(ccache, krbV.CCache):
-                principal = ccache.principal().name
-                # Get a fully qualified CCACHE name (schema+name)
-                # As we do not use the krbV.CCache object later,
-                # we can safely overwrite it
-                ccache = "%(type)s:%(name)s" % dict(type=ccache.type,
-                                                    name=ccache.name)
-            else:
-                principal = krbV.CCache(name=ccache,
-                    context=krbV.default_context()).principal().name
-
             os.environ['KRB5CCNAME'] = ccache
             self.gssapi_bind(server_controls=serverctrls,
                              client_controls=clientctrls)
             setattr(context, 'principal', principal)
+            # bypass ldap2's locking
+            object.__setattr__(self, '_pool_key', pool_key)
+            object.__setattr__(self, '_bind_principal', principal)
         else:
             # no kerberos ccache, use simple bind or external sasl
             if autobind:
@@ -193,8 +301,45 @@ class ldap2(LDAPClient, CrudBackend):
 
         return conn
 
+    def _get_connection_pool(self):
+        """
+        Return the connection pool or None if pooling is disabled.
+
+        Connections are only pooled in the server context, never while
+        installing or updating, where the schema may change underneath.
+        """
+        env = self.api.env
+        if (not env.in_server or self._force_schema_updates or
+                not env.ldap_pool_size):
+            return None
+        connection_pool.max_size = env.ldap_pool_size
+        connection_pool.idle_timeout = env.ldap_pool_idle_timeout
+        return connection_pool
+
+    def _get_config_cache(self):
+        """
+        Return the IPA configuration cache or None if caching is disabled.
+
+        Like connections, the configuration is only cached in the server
+        context.
+        """
+        env = self.api.env
+        if (not env.in_server or self._force_schema_updates or
+                env.ldap_config_cache_ttl <= 0):
+            return None
+        config_cache.ttl = env.ldap_config_cache_ttl
+        return config_cache
+
     def destroy_connection(self):
         """Disconnect from LDAP server."""
+        pool_key = self._pool_key
+        if pool_key is not None and self._conn is not None:
+            # bypass ldap2's locking
+            object.__setattr__(self, '_pool_key', None)
+            connection_pool.put(pool_key, self._conn)
+            LDAPClient._disconnect(self)
+            return
+
         try:
             if self._conn is not None:
                 self.unbind()
@@ -203,7 +348,7 @@ class ldap2(LDAPClient, CrudBackend):
             # ignore when trying to unbind multiple times
             pass
 
-    def find_entries(self, filter=None, attrs_list=None, base_dn=None,
+    def iter_entries(self, filter=None, attrs_list=None, base_dn=None,
                      scope=_ldap.SCOPE_SUBTREE, time_limit=None,
                      size_limit=None, search_refs=False, paged_search=False):
 
@@ -221,42 +366,140 @@ class ldap2(LDAPClient, CrudBackend):
         if size_limit is None:
             size_limit = _get_limits()['size']
 
-        res, truncated = super(ldap2, self).find_entries(
+        return super(ldap2, self).iter_entries(
             filter=filter, attrs_list=attrs_list, base_dn=base_dn, scope=scope,
             time_limit=time_limit, size_limit=size_limit,
             search_refs=search_refs, paged_search=paged_search)
-        return (res, truncated)
+
+    def find_entries_sorted(self, filter=None, attrs_list=None, base_dn=None,
+                            scope=_ldap.SCOPE_SUBTREE, sort_key=None,
+                            offset=0, limit=1, time_limit=None):
+        if time_limit is None:
+            config = self.get_ipa_config()
+            time_limit = config.get('ipasearchtimelimit', [None])[0]
+
+        return super(ldap2, self).find_entries_sorted(
+            filter=filter, attrs_list=attrs_list, base_dn=base_dn, scope=scope,
+            sort_key=sort_key, offset=offset, limit=limit,
+            time_limit=time_limit)
 
     config_defaults = {'ipasearchtimelimit': [2], 'ipasearchrecordslimit': [0]}
-    def get_ipa_config(self, attrs_list=None):
-        """Returns the IPA configuration entry (dn, entry_attrs)."""
+    config_version_attrs = ('modifytimestamp', 'entryusn')
+
+    def get_ipa_config(self, attrs_list=None, fresh=False):
+        """
+        Returns the IPA configuration entry (dn, entry_attrs).
+
+        The entry is cached in the request context and, in the server, in
+        the process-wide `config_cache`, which holds all the attributes the
+        bound principal can read.
+        Use ``fresh`` to read the entry from the server, e.g. to validate a
+        change of the configuration.
+        """
 
         dn = self.api.Object.config.get_dn()
         assert isinstance(dn, DN)
 
-        try:
-            config_entry = getattr(context, 'config_entry')
-            if config_entry.conn is self.conn:
-                return config_entry
-        except AttributeError:
-            # Not in our context yet
-            pass
-        try:
-            (entries, truncated) = self.find_entries(
-                None, attrs_list, base_dn=dn, scope=self.SCOPE_BASE,
-                time_limit=2, size_limit=10
-            )
-            if truncated:
-                raise errors.LimitsExceeded()
-            config_entry = entries[0]
-        except errors.NotFound:
+        if not fresh:
+            try:
+                config_entry = getattr(context, 'config_entry')
+                if config_entry.conn is self.conn:
+                    return config_entry
+            except AttributeError:
+                # Not in our context yet
+                pass
+
+        cache = self._get_config_cache()
+        principal = self._bind_principal
+        if principal is None:
+            # not bound with Kerberos credentials
+            cache = None
+        cached = None
+        if cache is not None and not fresh:
+            cached = cache.get(principal)
+        if cached is not None and time.time() - cached[2] >= cache.ttl:
+            version = self._get_ipa_config_version(dn)
+            if version == cached[1]:
+                cache.set(principal, cached[0], version)
+            else:
+                cached = None
+
+        if cached is None:
+            if cache is not None:
+                attrs_list = ['*'] + list(self.config_version_attrs)
+            try:
+                (entries, truncated) = self.find_entries(
+                    None, attrs_list, base_dn=dn, scope=self.SCOPE_BASE,
+                    time_limit=2, size_limit=10
+                )
+                if truncated:
+                    raise errors.LimitsExceeded()
+                config_entry = entries[0]
+            except errors.NotFound:
+                config_entry = self.make_entry(dn)
+            if cache is not None:
+                version = tuple(config_entry.raw.get(name)
+                                for name in self.config_version_attrs)
+                raw = {}
+                for (name, values) in config_entry.raw.iteritems():
+                    if name.lower() not in self.config_version_attrs:
+                        raw[name] = list(values)
+                cache.set(principal, raw, version)
+                cached = (raw, version)
+
+        if cached is not None:
+            # the values are copied, callers may modify the entry
             config_entry = self.make_entry(dn)
+            config_entry.raw.update(
+                (name, list(values)) for (name, values) in cached[0].iteritems()
+            )
+            config_entry.reset_modlist()
+
         for a in self.config_defaults:
             if a not in config_entry:
                 config_entry[a] = self.config_defaults[a]
         context.config_entry = config_entry
         return config_entry
 
+    def _get_ipa_config_version(self, dn):
+        """
+        Return the modifyTimestamp and entryUSN of the IPA configuration
+        entry.
+        """
+        try:
+            (entries, truncated) = self.find_entries(
+                None, list(self.config_version_attrs), base_dn=dn,
+                scope=self.SCOPE_BASE, time_limit=2, size_limit=10
+            )
+        except errors.NotFound:
+            return (None,) * len(self.config_version_attrs)
+        return tuple(entries[0].raw.get(name)
+                     for name in self.config_version_attrs)
+
+    def _invalidate_ipa_config(self, dn):
+        """
+        Drop the cached IPA configuration entry if ``dn`` is its DN.
+        """
+        try:
+            config_dn = self.api.Object.config.get_dn()
+        except AttributeError:
+            return
+        if dn == config_dn:
+            config_cache.clear()
+            try:
+                delattr(context, 'config_entry')
+            except AttributeError:
+                pass
+
+    def update_entry(self, entry):
+        super(ldap2, self).update_entry(entry)
+        self._invalidate_ipa_config(entry.dn)
+
+    def modify_s(self, dn, modlist):
+        result = super(ldap2, self).modify_s(dn, modlist)
+        self._invalidate_ipa_config(dn)
+        return result
+
     def has_upg(self):
         """Returns True/False whether User-Private Groups are enabled.
 
@@ -293,10 +536,7 @@ class ldap2(LDAPClient, CrudBackend):
 
         assert isinstance(dn, DN)
 
-        principal = getattr(context, 'principal')
-        entry = self.find_entry_by_attr("krbprincipalname", principal,
-            "krbPrincipalAux", base_dn=self.api.env.basedn)
-        sctrl = [GetEffectiveRightsControl(True, "dn: " + str(entry.dn))]
+        sctrl = [self._get_effective_rights_control()]
         self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, sctrl)
         try:
             entry = self.get_entry(dn, attrs_list)
@@ -305,6 +545,34 @@ class ldap2(LDAPClient, CrudBackend):
             self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
         return entry
 
+    def find_entries_with_rights(self, filter, attrs_list, base_dn,
+                                 scope=_ldap.SCOPE_SUBTREE):
+        """Returns the entries matching filter along with the rights the
+           currently bound user has for each of them.
+
+           Like get_effective_rights(), but for many entries in a single
+           search. Returns the result of find_entries().
+        """
+
+        assert isinstance(base_dn, DN)
+
+        sctrl = [self._get_effective_rights_control()]
+        # read the search limits now, so that the configuration entry is not
+        # searched with the control
+        self.get_ipa_config()
+        self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, sctrl)
+        try:
+            return self.find_entries(filter, attrs_list, base_dn, scope)
+        finally:
+            # remove the control so subsequent operations don't include GER
+            self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
+
+    def _get_effective_rights_control(self):
+        principal = getattr(context, 'principal')
+        entry = self.find_entry_by_attr("krbprincipalname", principal,
+            "krbPrincipalAux", base_dn=self.api.env.basedn)
+        return GetEffectiveRightsControl(True, "dn: " + str(entry.dn))
+
     def can_write(self, dn, attr):
         """Returns True/False if the currently bound user has write permissions
            on the attribute. This only operates on a single attribute at a time.
@@ -394,6 +662,51 @@ class ldap2(LDAPClient, CrudBackend):
             new_pass = self.encode(new_pass)
             self.conn.passwd_s(str(dn), old_pass, new_pass)
 
+    def _modify_group_members(self, group_dn, mod_op, member_attr, dns):
+        modlist = [(mod_op, member_attr, dns)]
+        with self.error_handler():
+            modlist = [(a, self.encode(b), self.encode(c))
+                       for a, b, c in modlist]
+            self.conn.modify_s(str(group_dn), modlist)
+
+    def _modify_group_members_bulk(self, group_dn, mod_op, member_attr,
+                                   members, member_error, error):
+        """
+        Add or remove member values of group_dn in batches of
+        member_batch_size values.
+
+        members is a list of (dn, value) tuples. When a batch fails, its
+        values are modified one by one to find out which of them failed.
+
+        Return a list of (dn, exception) tuples for the failed values.
+        """
+        failed = []
+        batch_size = self.member_batch_size
+        for i in xrange(0, len(members), batch_size):
+            batch = members[i:i + batch_size]
+            try:
+                self._modify_group_members(
+                    group_dn, mod_op, member_attr,
+                    [value for dn, value in batch])
+            except errors.PublicError, e:
+                if len(batch) > 1:
+                    self.log.debug(
+                        "batch modify of %s failed (%s), modifying %d "
+                        "values one by one", group_dn, e, len(batch))
+            else:
+                continue
+
+            for dn, value in batch:
+                try:
+                    self._modify_group_members(
+                        group_dn, mod_op, member_attr, [value])
+                except member_error:
+                    failed.append((dn, error()))
+                except errors.PublicError, e:
+                    failed.append((dn, e))
+
+        return failed
+
     def add_entry_to_group(self, dn, group_dn, member_attr='member', allow_same=False):
         """
         Add entry designaed by dn to group group_dn in the member attribute
@@ -419,17 +732,62 @@ class ldap2(LDAPClient, CrudBackend):
             raise errors.SameGroupError()
 
         # add dn to group entry's `member_attr` attribute
-        modlist = [(_ldap.MOD_ADD, member_attr, [dn])]
-
-        # update group entry
         try:
-            with self.error_handler():
-                modlist = [(a, self.encode(b), self.encode(c))
-                           for a, b, c in modlist]
-                self.conn.modify_s(str(group_dn), modlist)
+            self._modify_group_members(
+                group_dn, _ldap.MOD_ADD, member_attr, [dn])
         except errors.DatabaseError:
             raise errors.AlreadyGroupMember()
 
+    def add_entries_to_group(self, dns, group_dn, member_attr='member',
+                             allow_same=False):
+        """
+        Add entries designated by dns to group group_dn in the member
+        attribute member_attr.
+
+        This is the bulk version of add_entry_to_group: all the values are
+        added using a single modify per member_batch_size values. Instead of
+        raising an exception, return a list of (dn, exception) tuples for the
+        entries which could not be added.
+        """
+
+        assert isinstance(group_dn, DN)
+
+        self.log.debug(
+            "add_entries_to_group: %d dns group_dn=%s member_attr=%s",
+            len(dns), group_dn, member_attr)
+
+        try:
+            group = self.get_entry(group_dn, [member_attr])
+        except errors.NotFound, e:
+            return [(dn, e) for dn in dns]
+        current = set(group.get(member_attr, []))
+
+        failed = []
+        members = []
+        for dn in dns:
+            assert isinstance(dn, DN)
+
+            # check if the entry exists
+            try:
+                entry = self.get_entry(dn, [''])
+            except errors.PublicError, e:
+                failed.append((dn, e))
+                continue
+
+            # check if we're not trying to add group into itself
+            if entry.dn == group_dn and not allow_same:
+                failed.append((dn, errors.SameGroupError()))
+            elif entry.dn in current:
+                failed.append((dn, errors.AlreadyGroupMember()))
+            else:
+                current.add(entry.dn)
+                members.append((dn, entry.dn))
+
+        failed.extend(self._modify_group_members_bulk(
+            group_dn, _ldap.MOD_ADD, member_attr, members,
+            errors.DatabaseError, errors.AlreadyGroupMember))
+        return failed
+
     def remove_entry_from_group(self, dn, group_dn, member_attr='member'):
         """Remove entry from group."""
 
@@ -441,17 +799,42 @@ class ldap2(LDAPClient, CrudBackend):
             dn, group_dn, member_attr)
 
         # remove dn from group entry's `member_attr` attribute
-        modlist = [(_ldap.MOD_DELETE, member_attr, [dn])]
-
-        # update group entry
         try:
-            with self.error_handler():
-                modlist = [(a, self.encode(b), self.encode(c))
-                           for a, b, c in modlist]
-                self.conn.modify_s(str(group_dn), modlist)
+            self._modify_group_members(
+                group_dn, _ldap.MOD_DELETE, member_attr, [dn])
         except errors.MidairCollision:
             raise errors.NotGroupMember()
 
+    def remove_entries_from_group(self, dns, group_dn, member_attr='member'):
+        """
+        Remove entries from group.
+
+        This is the bulk version of remove_entry_from_group. Return a list of
+        (dn, exception) tuples for the entries which could not be removed.
+        """
+
+        assert isinstance(group_dn, DN)
+
+        self.log.debug(
+            "remove_entries_from_group: %d dns group_dn=%s member_attr=%s",
+            len(dns), group_dn, member_attr)
+
+        failed = []
+        members = []
+        seen = set()
+        for dn in dns:
+            assert isinstance(dn, DN)
+            if dn in seen:
+                failed.append((dn, errors.NotGroupMember()))
+            else:
+                seen.add(dn)
+                members.append((dn, dn))
+
+        failed.extend(self._modify_group_members_bulk(
+            group_dn, _ldap.MOD_DELETE, member_attr, members,
+            errors.MidairCollision, errors.NotGroupMember))
+        return failed
+
     def set_entry_active(self, dn, active):
         """Mark entry active/inactive."""
 
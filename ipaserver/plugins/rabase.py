@@ -118,3 +118,19 @@ class rabase(Backend):
         :param options: dictionary of search options
         """
         raise errors.NotImplementedError(name='%s.find' % self.name)
+
+    def iter_find(self, options):
+        """
+        Iterate over the certificates matching the search options in serial
+        number order
+
+        :param options: dictionary of search options
+        """
+        raise errors.NotImplementedError(name='%s.iter_find' % self.name)
+
+    def init_nss(self):
+        """
+        Initialize NSS for the connections to the CA before sending requests
+        from several threads, which must not initialize it again.
+        """
+        raise errors.NotImplementedError(name='%s.init_nss' % self.name)
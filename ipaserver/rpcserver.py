@@ -30,6 +30,7 @@ import datetime
 import urlparse
 import json
 import traceback
+import zlib
 from krbV import Krb5Error
 
 import ldap.controls
@@ -44,7 +45,7 @@ from ipalib.errors import (PublicError, InternalError, CommandError, JSONError,
     ExecutionError, PasswordExpired)
 from ipalib.request import context, destroy_context
 from ipalib.rpc import (xml_dumps, xml_loads,
-    json_encode_binary, json_decode_binary)
+    json_encode_binary, json_decode_binary, json_dumps_binary)
 from ipalib.util import parse_time_duration, normalize_name
 from ipapython.dn import DN
 from ipaserver.plugins.ldap2 import ldap2
@@ -62,6 +63,7 @@ from ipapython.version import VERSION
 from ipalib.text import _
 
 HTTP_STATUS_SUCCESS = '200 Success'
+HTTP_STATUS_NOT_MODIFIED = '304 Not Modified'
 HTTP_STATUS_SERVER_ERROR = '500 Internal Server Error'
 
 _not_found_template = """<html>
@@ -229,6 +231,65 @@ def extract_query(environ):
     return query
 
 
+def accepted_encoding(environ):
+    """
+    Return the response content coding accepted by the client, ``'gzip'``,
+    ``'deflate'`` or ``None``.
+
+    gzip is preferred over deflate when the client accepts both.
+    """
+    accepted = set()
+    for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = [p.strip() for p in coding.split(';')]
+        name = params[0].lower()
+        quality = 1.0
+        for param in params[1:]:
+            key, sep, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name)
+    for name in ('gzip', 'deflate'):
+        if name in accepted:
+            return name
+    return None
+
+
+def etag_matches(environ, etag):
+    """
+    Return True if the ``If-None-Match`` header of the request matches the
+    ETag ``etag``, using the weak comparison.
+    """
+    def opaque(tag):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        return tag
+
+    for tag in environ.get('HTTP_IF_NONE_MATCH', '').split(','):
+        tag = opaque(tag)
+        if tag == '*' or tag == opaque(etag):
+            return True
+    return False
+
+
+def compress_response(response, encoding, level=6):
+    """
+    Compress the response body with the ``gzip`` or ``deflate`` content
+    coding.
+    """
+    if encoding == 'gzip':
+        # a 16 offset to the window size makes zlib write a gzip wrapper
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(response) + compressor.flush()
+    elif encoding == 'deflate':
+        return zlib.compress(response, level)
+    raise ValueError('unsupported content coding %r' % encoding)
+
+
 class wsgi_dispatch(Executioner, HTTP_Status):
     """
     WSGI routing middleware and entry point into IPA server.
@@ -387,9 +448,31 @@ class WSGIExecutioner(Executioner):
                       name,
                       type(e).__name__)
 
+        if error is None and name:
+            etag = self.get_result_etag(name)
+            if etag is not None:
+                context.response_etag = etag
+                if etag_matches(environ, etag):
+                    # the client has the result already
+                    return None
+
         version = options.get('version', VERSION_WITHOUT_CAPABILITIES)
         return self.marshal(result, error, _id, version)
 
+    def get_result_etag(self, name):
+        """
+        Return the ETag of the result of the command ``name``, None if it
+        has none.
+
+        Commands with a cacheable result store ``(name, etag)`` in
+        ``context.result_etag``, the name makes sure the ETag of a command
+        executed by ``batch`` is not used for the batch.
+        """
+        value = getattr(context, 'result_etag', None)
+        if value is not None and value[0] == name:
+            return value[1]
+        return None
+
     def simple_unmarshal(self, environ):
         name = environ['PATH_INFO'].strip('/')
         options = extract_query(environ)
@@ -419,9 +502,36 @@ class WSGIExecutioner(Executioner):
                                                          session_data['session_expiration_timestamp'])
             headers.append(('Set-Cookie', session_cookie))
 
+        etag = getattr(context, 'response_etag', None)
+        if status == HTTP_STATUS_SUCCESS and etag is not None:
+            headers.append(('ETag', etag))
+            if response is None:
+                status = HTTP_STATUS_NOT_MODIFIED
+                response = ''
+
+        if status == HTTP_STATUS_SUCCESS:
+            response = self.compress(environ, response, headers)
+
         start_response(status, headers)
         return [response]
 
+    def compress(self, environ, response, headers):
+        """
+        Compress the response if the client accepts a compressed content
+        coding and the response is at least ``rpc_compress_threshold``
+        bytes long.
+        """
+        threshold = self.api.env.rpc_compress_threshold
+        if (threshold <= 0 or not isinstance(response, str) or
+                len(response) < threshold):
+            return response
+        headers.append(('Vary', 'Accept-Encoding'))
+        encoding = accepted_encoding(environ)
+        if encoding is None:
+            return response
+        headers.append(('Content-Encoding', encoding))
+        return compress_response(response, encoding)
+
     def unmarshal(self, data):
         raise NotImplementedError('%s.unmarshal()' % self.fullname)
 
@@ -447,9 +557,28 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
 
         self.debug('WSGI jsonserver.__call__:')
 
+        # compact responses can be requested in the Accept header or in the
+        # request itself, see unmarshal()
+        context.json_compact = self.accepts_compact(environ)
+
         response = super(jsonserver, self).__call__(environ, start_response)
         return response
 
+    def accepts_compact(self, environ):
+        """
+        Return True if the client asked for compact responses with
+        ``Accept: application/json; compact``.
+        """
+        for media_range in environ.get('HTTP_ACCEPT', '').split(','):
+            params = [p.strip() for p in media_range.split(';')]
+            if params[0].lower() != self.content_type:
+                continue
+            for param in params[1:]:
+                name, sep, value = param.partition('=')
+                if name.strip() == 'compact':
+                    return value.strip().lower() not in ('0', 'false')
+        return False
+
     def marshal(self, result, error, _id=None,
                 version=VERSION_WITHOUT_CAPABILITIES):
         if error:
@@ -467,6 +596,8 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
             principal=unicode(principal),
             version=unicode(VERSION),
         )
+        if getattr(context, 'json_compact', False):
+            return json_dumps_binary(response, version)
         response = json_encode_binary(response, version)
         return json.dumps(response, sort_keys=True, indent=4)
 
@@ -482,6 +613,8 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
         if 'params' not in d:
             raise JSONError(error=_('Request is missing "params"'))
         d = json_decode_binary(d)
+        if d.get('compact'):
+            context.json_compact = True
         method = d['method']
         params = d['params']
         _id = d.get('id')
@@ -788,7 +921,8 @@ class jsonserver_session(jsonserver, KerberosSession):
             self.debug('no ccache, need login')
             return self.need_login(start_response)
 
-        ipa_ccache_name = bind_ipa_ccache(ccache_data)
+        ipa_ccache_name = bind_ipa_ccache(
+            ccache_data, self.api.env.session_ccache_scheme)
 
         # Redirect to login if Kerberos credentials are expired
         cc = KRB5_CCache(ipa_ccache_name)
@@ -1240,7 +1374,8 @@ class xmlserver_session(xmlserver, KerberosSession):
             self.debug('xmlserver_session.__call_: no ccache, need TGT')
             return self.need_login(start_response)
 
-        ipa_ccache_name = bind_ipa_ccache(ccache_data)
+        ipa_ccache_name = bind_ipa_ccache(
+            ccache_data, self.api.env.session_ccache_scheme)
 
         # Redirect to /ipa/xml if Kerberos credentials are expired
         cc = KRB5_CCache(ipa_ccache_name)
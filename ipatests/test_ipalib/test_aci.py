@@ -22,7 +22,10 @@
 Test the `ipalib.aci` module.
 """
 
+from ipalib import api
 from ipalib.aci import ACI
+from ipalib.plugins import aci as aci_plugin
+from ipapython.dn import DN
 
 def check_aci_parsing(source, expected):
     a = ACI(source)
@@ -157,3 +160,190 @@ def test_aci_parsing_8():
 def test_aci_parsing_9():
     check_aci_parsing('(targetfilter = "(|(objectClass=person)(objectClass=krbPrincipalAux)(objectClass=posixAccount)(objectClass=groupOfNames)(objectClass=posixGroup))")(targetattr != "aci || userPassword || krbPrincipalKey || sambaLMPassword || sambaNTPassword || passwordHistory")(version 3.0; acl "Account Admins can manage Users and Groups"; allow (add, delete, read, write) groupdn = "ldap:///cn=admins,cn=groups,cn=accounts,dc=greyoak,dc=com";)',
         '(targetattr != "aci || userPassword || krbPrincipalKey || sambaLMPassword || sambaNTPassword || passwordHistory")(targetfilter = "(|(objectClass=person)(objectClass=krbPrincipalAux)(objectClass=posixAccount)(objectClass=groupOfNames)(objectClass=posixGroup))")(version 3.0;acl "Account Admins can manage Users and Groups";allow (add,delete,read,write) groupdn = "ldap:///cn=admins,cn=groups,cn=accounts,dc=greyoak,dc=com";)')
+
+
+def _group_dn(cn):
+    return DN(('cn', cn), api.env.container_group, api.env.basedn)
+
+
+def make_test_acistrs():
+    editors = _group_dn('editors')
+    admins = _group_dn('admins')
+    self_aci = ('(targetattr = "telephoneNumber")(version 3.0;'
+                'acl "selfservice:Self phone";allow (write) '
+                'userdn = "ldap:///self";)')
+    return [
+        '(targetattr = "title || givenName")(target = "%s")(version 3.0;'
+        'acl "delegation:User edit";allow (read,write) '
+        'groupdn = "ldap:///%s";)' % (aci_plugin._type_map['user'], editors),
+        '(targetattr = "member")(target = "ldap:///%s")(version 3.0;'
+        'acl "delegation:Admins members";allow (write) '
+        'groupdn = "ldap:///%s";)' % (admins, _group_dn('helpdesk')),
+        self_aci,
+        '(targetattr = "Title")(targetfilter = "(memberOf=%s)")(version 3.0;'
+        'acl "delegation:Admins title";allow (write) '
+        'groupdn = "ldap:///%s";)' % (admins, editors),
+        '(target = "%s")(version 3.0;acl "Group add";allow (add,delete) '
+        'groupdn = "ldap:///%s";)' % (aci_plugin._type_map['group'], editors),
+        # equal ACIs are listed once
+        self_aci,
+        '(targetattr = "cn")(target = "ldap:///%s")(version 3.0;'
+        'acl "delegation:Ipausers cn";allow (read) '
+        'groupdn = "ldap:///%s";)' % (_group_dn('ipausers'), admins),
+        '(targetattr = "cn")(target = "ldap:///%s")(version 3.0;'
+        'acl "delegation:Admins hosts";allow (read) '
+        'groupdn = "ldap:///%s";)' % (
+            DN(('cn', 'admins'), api.env.container_hostgroup,
+               api.env.basedn), admins),
+        'not an aci',
+    ]
+
+
+def _dn_cn(uri):
+    try:
+        dn = DN(uri.replace('ldap:///', ''))
+        return dn, dn[0]['cn']
+    except (ValueError, IndexError, KeyError):
+        return None, None
+
+
+def _old_filters():
+    """
+    The filters aci_find applied to each ACI before ACIIndex was added.
+    """
+    def attrs(a, key):
+        if 'targetattr' not in a.target:
+            return False
+        alist = set(t.lower() for t in a.target['targetattr']['expression'])
+        return set(t.lower() for t in key) <= alist
+
+    def target(a):
+        if 'target' not in a.target:
+            return None
+        return a.target['target']['expression']
+
+    def targetgroup(a, key):
+        if target(a) is None:
+            return False
+        dn, cn = _dn_cn(target(a))
+        return (dn is not None and
+                dn.endswith(DN(api.env.container_group, api.env.basedn)) and
+                cn == key)
+
+    return {
+        'attrs': attrs,
+        'permissions': lambda a, key: set(key) <= set(a.permissions),
+        'memberof': lambda a, key: (
+            'targetfilter' in a.target and
+            a.target['targetfilter']['expression'] ==
+            '(memberOf=%s)' % _group_dn(key)),
+        'type': lambda a, key: target(a) == aci_plugin._type_map[key],
+        'selfaci': lambda a, key: (
+            a.bindrule['expression'] == u'ldap:///self'),
+        'group': lambda a, key: _dn_cn(a.bindrule['expression'])[1] == key,
+        'targetgroup': targetgroup,
+        'subtree': lambda a, key: (
+            target(a) is not None and target(a).lower() == key.lower()),
+    }
+
+
+def _index_lookup(index, kind, key):
+    """
+    Look ``key`` up in ``index`` the way aci_find does.
+    """
+    if kind == 'attrs':
+        positions = set(xrange(len(index.acis)))
+        for attr in set(t.lower() for t in key):
+            positions &= index.lookup('attr', attr)
+        return positions
+    if kind == 'permissions':
+        positions = set(xrange(len(index.acis)))
+        for permission in set(key):
+            positions &= index.lookup('permission', permission)
+        return positions
+    if kind == 'memberof':
+        return index.lookup('targetfilter', '(memberOf=%s)' % _group_dn(key))
+    if kind == 'type':
+        return index.lookup('target', aci_plugin._type_map[key])
+    if kind == 'selfaci':
+        return index.lookup('bindrule', u'ldap:///self')
+    if kind == 'subtree':
+        return index.lookup('subtree', key.lower())
+    return index.lookup(kind, key)
+
+
+def test_aci_index():
+    index = aci_plugin.ACIIndex(make_test_acistrs())
+    acis = index.acis
+    assert len(acis) == 8
+    assert index.acistrs == make_test_acistrs()[:-1]
+
+    keys = {
+        'attrs': [['title'], ['TITLE', 'givenname'], ['member'], ['cn'],
+                  ['title', 'member'], ['sn']],
+        'permissions': [['write'], ['read', 'write'], ['add'], ['search']],
+        'memberof': ['admins', 'editors'],
+        'type': sorted(aci_plugin._type_map),
+        'selfaci': [True],
+        'group': ['editors', 'admins', 'helpdesk', 'self', 'nobody'],
+        'targetgroup': ['admins', 'ipausers', 'editors'],
+        'subtree': [aci_plugin._type_map['user'].upper(),
+                    'ldap:///%s' % _group_dn('admins'), 'ldap:///cn=none'],
+    }
+    for (kind, matches) in _old_filters().iteritems():
+        for key in keys[kind]:
+            expected = [a for a in acis if matches(a, key)]
+            found = [acis[i] for i in sorted(_index_lookup(index, kind, key))]
+            assert found == expected, (kind, key)
+
+
+def test_aci_index_names():
+    index = aci_plugin.ACIIndex(make_test_acistrs())
+    acis = index.acis
+
+    for term in ('admins', 'SELF', 'delegation:', 'edit', 'none'):
+        # the old search by term skipped ACIs equal to one already found
+        expected = []
+        for a in acis:
+            if term.lower() in a.name.lower() and a not in expected:
+                expected.append(a)
+        assert [acis[i] for i in sorted(index.search(term))] == expected
+
+    for (prefix, name) in (('delegation', 'Admins title'),
+                           ('selfservice', 'self phone'),
+                           (u'none', 'Group add')):
+        i = aci_plugin._find_aci_in_index(index, prefix, name)
+        assert acis[i] is aci_plugin._find_aci_by_name(acis, prefix, name)
+    assert index.lookup('aciname', 'Admins title') == set([3])
+    assert index.lookup('aciprefix', u'none') == set([4])
+    assert index.find('delegation:nothing') is None
+
+
+class FakeEntry(dict):
+    def __init__(self, dn, acistrs):
+        super(FakeEntry, self).__init__(aci=list(acistrs))
+        self.dn = dn
+
+
+def test_aci_cache():
+    cache = aci_plugin.ACICache()
+    acistrs = make_test_acistrs()
+    entry = FakeEntry(api.env.basedn, acistrs)
+
+    index = cache.get(entry)
+    assert cache.get(FakeEntry(api.env.basedn, acistrs)) is index
+
+    # a changed aci value is a miss
+    entry = FakeEntry(api.env.basedn, acistrs[:1] + acistrs[2:])
+    changed = cache.get(entry)
+    assert changed is not index
+    assert len(changed.acis) == 7
+    assert cache.get(entry) is changed
+
+    # values of another entry are cached separately
+    other = FakeEntry(_group_dn('admins'), acistrs[:2])
+    assert len(cache.get(other).acis) == 2
+    assert cache.get(entry) is changed
+
+    cache.clear()
+    assert cache.get(entry) is not changed
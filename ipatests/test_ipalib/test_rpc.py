@@ -22,14 +22,21 @@ Test the `ipalib.rpc` module.
 """
 
 from xmlrpclib import Binary, Fault, dumps, loads
+import datetime
+import errno
+import json
+import socket
 
 import nose
-from ipatests.util import raises, assert_equal, PluginTester, DummyClass
+from ipatests.util import (raises, assert_equal, PluginTester, DummyClass,
+    create_test_api)
 from ipatests.data import binary_bytes, utf8_bytes, unicode_str
 from ipalib.frontend import Command
 from ipalib.request import context, Connection
-from ipalib import rpc, errors, api, request
+from ipalib import rpc, errors, api, request, parameters, output
 from ipapython.version import API_VERSION
+from ipapython.dn import DN
+from ipapython.dnsutil import DNSName
 
 
 std_compound = (binary_bytes, utf8_bytes, unicode_str)
@@ -182,6 +189,196 @@ def test_xml_loads():
         assert type(e.faultString) is unicode
 
 
+def _json_find_response(count):
+    base_dn = DN(('cn', 'users'), ('cn', 'accounts'), ('dc', 'example'),
+                 ('dc', 'com'))
+    entries = []
+    for i in xrange(count):
+        entries.append(dict(
+            dn=DN(('uid', 'user%d' % i), base_dn),
+            uid=(u'user%d' % i,),
+            cn=(unicode_str,),
+            uidnumber=(u'%d' % (1000 + i),),
+            memberof_group=(u'ipausers', u'admins'),
+            krbextradata=(binary_bytes,),
+            krblastpwdchange=(datetime.datetime(2014, 1, 1),),
+            idnsname=(DNSName(u'user%d.example.com.' % i),),
+            nsaccountlock=False,
+        ))
+    return dict(
+        result=dict(result=entries, count=count, truncated=False,
+                    summary=u'%d users matched' % count),
+        error=None,
+        id=0,
+        principal=u'admin@EXAMPLE.COM',
+        version=u'4.2.0',
+    )
+
+
+def test_json_dumps_binary():
+    """
+    Test the `ipalib.rpc.json_dumps_binary` function.
+    """
+    f = rpc.json_dumps_binary
+    response = _json_find_response(3)
+    for version in (API_VERSION, u'2.0'):
+        expected = json.dumps(rpc.json_encode_binary(response, version))
+        assert_equal(json.loads(f(response, version)), json.loads(expected))
+
+    assert_equal(f([None, True, 1, 1.5, {1: u'a'}], API_VERSION),
+                 '[null,true,1,1.5,{"1":"a"}]')
+    assert_equal(rpc.json_decode_binary(json.loads(
+        f(std_compound, API_VERSION))), std_compound)
+
+
+def test_json_dumps_binary_size():
+    """
+    Test the compact JSON encoding is equivalent to and smaller than the
+    indented one.
+    """
+    response = _json_find_response(2000)
+    indented = json.dumps(rpc.json_encode_binary(response, API_VERSION),
+                          sort_keys=True, indent=4)
+    compact = rpc.json_dumps_binary(response, API_VERSION)
+    assert json.loads(compact) == json.loads(indented)
+    assert len(compact) < len(indented)
+
+
+class _FakeResponse(object):
+    status = 200
+    reason = 'OK'
+
+    def __init__(self, body):
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return default
+
+    def read(self, amt=None):
+        (data, self.body) = (self.body, '')
+        return data
+
+
+class _FakeConnection(object):
+    """
+    HTTP connection whose socket goes stale when ``stale`` is set.
+    """
+    stale = False
+
+    def __init__(self):
+        self.sock = None
+
+    def putrequest(self, method, handler, **kw):
+        if self.sock is None:
+            self.sock = object()
+
+    def putheader(self, name, value):
+        pass
+
+    def endheaders(self, body=None):
+        if self.stale:
+            raise socket.error(errno.EPIPE, 'Broken pipe')
+
+    def getresponse(self, buffering=False):
+        return _FakeResponse('{"result": null}')
+
+    def close(self):
+        self.sock = None
+
+
+class _FakeTransport(rpc.MultiProtocolTransport):
+    def make_connection(self, host):
+        if self._connection[1] is None:
+            self._connection = (host, _FakeConnection())
+        return self._connection[1]
+
+
+def test_transport_keep_alive():
+    """
+    Test that `ipalib.rpc.MultiProtocolTransport` reuses its connection.
+    """
+    transport = _FakeTransport('json')
+    for i in xrange(3):
+        transport.request('localhost', '/ipa/json', '{}')
+    assert transport.stats == dict(connections=1, requests=3)
+
+    # a connection closed by the server is re-established
+    transport._connection[1].stale = True
+    transport.request('localhost', '/ipa/json', '{}')
+    assert transport.stats == dict(connections=2, requests=5)
+
+    # a new connection is not retried
+    transport.close()
+    _FakeConnection.stale = True
+    try:
+        raises(socket.error, transport.request, 'localhost', '/ipa/json',
+               '{}')
+    finally:
+        _FakeConnection.stale = False
+    assert transport.stats == dict(connections=3, requests=6)
+
+
+def test_batch_queue():
+    """
+    Test the `ipalib.rpc.BatchQueue` class.
+    """
+    sent = []
+
+    class batch(Command):
+        takes_args = (parameters.Any('methods*'),)
+        takes_options = (parameters.Flag('parallel?'),)
+        has_output = (
+            output.Output('count', int),
+            output.Output('results', (list, tuple)),
+        )
+
+        def execute(self, methods, **options):
+            sent.append([m['params'][0][0] for m in methods])
+            results = []
+            for m in methods:
+                uid = m['params'][0][0]
+                if uid == u'nobody':
+                    results.append(dict(
+                        error=u'nobody: user not found',
+                        error_code=4001,
+                        error_name=u'NotFound',
+                    ))
+                else:
+                    results.append(dict(result=uid, error=None))
+            return dict(count=len(results), results=results)
+
+    class user_show(Command):
+        takes_args = (parameters.Str('uid'),)
+
+    (api, home) = create_test_api(in_server=True)
+    api.register(batch)
+    api.register(user_show)
+    api.finalize()
+
+    queue = rpc.BatchQueue(api, max_size=3)
+    # arguments are validated when the call is queued
+    raises(errors.RequirementError, queue.Command.user_show)
+
+    futures = [queue.Command.user_show(uid)
+               for uid in (u'alice', u'bob', u'nobody', u'carol')]
+    assert sent == [[u'alice', u'bob', u'nobody']]
+    assert [f.done() for f in futures] == [True, True, True, False]
+    assert len(queue) == 1
+    assert futures[0].result() == dict(result=u'alice')
+    e = raises(errors.NotFound, futures[2].result)
+    assert_equal(e.args[0], u'nobody: user not found')
+
+    # demanding a result sends the queued calls
+    assert futures[3].result() == dict(result=u'carol')
+    assert sent[1:] == [[u'carol']]
+
+    with rpc.BatchQueue(api) as queue:
+        future = queue.Command['user_show'](u'dave')
+        assert not sent[2:]
+    assert sent[2:] == [[u'dave']]
+    assert future.result() == dict(result=u'dave')
+
+
 class test_xmlclient(PluginTester):
     """
     Test the `ipalib.rpc.xmlclient` plugin.
@@ -0,0 +1,105 @@
+# Copyright (C) 2015  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the `ipalib.schema` module.
+"""
+
+import json
+from decimal import Decimal
+
+from ipalib import frontend, parameters, output, config, schema
+from ipalib.text import _
+
+
+class user_add(frontend.Command):
+    """
+    Add a user.
+    """
+
+    takes_args = (
+        parameters.Str('uid',
+            cli_name='login',
+            label=_('User login'),
+            normalizer=lambda value: value.lower(),
+            default_from=lambda givenname, sn: givenname[0] + sn,
+        ),
+    )
+
+    takes_options = (
+        parameters.Str('givenname', cli_name='first'),
+        parameters.Str('sn', cli_name='last'),
+        parameters.Int('uidnumber?', minvalue=1),
+        parameters.Decimal('quota?', minvalue=Decimal('0.5')),
+        parameters.StrEnum('shell?', values=(u'/bin/sh', u'/bin/bash')),
+        parameters.Str('mail*', flags=['no_search'], exclude='webui'),
+        parameters.Flag('random', default=True),
+    )
+
+    has_output = output.standard_entry
+
+
+class user_show(user_add):
+    def output_for_cli(self, textui, result, *args, **options):
+        pass
+
+
+def test_serialize_command():
+    cmd = user_add()
+    cmd.env = config.Env(context='cli')
+    cmd.finalize()
+
+    data = json.loads(json.dumps(schema.serialize_command(cmd)))
+    assert data['client_code'] is False
+    assert data['args'] == [
+        ['Str', 'uid', dict(cli_name='login', label='User login',
+                            doc='User login', required=False)],
+    ]
+    assert [o[:2] for o in data['output']] == [
+        ['Output', 'summary'], ['Entry', 'result'], ['PrimaryKey', 'value']]
+
+    klass = schema.build_command(data)
+    assert issubclass(klass, schema.SchemaCommand)
+    built = klass()
+    built.env = config.Env(context='cli')
+    built.finalize()
+    assert built.name == 'user_add'
+    assert list(built.args) == ['uid']
+    assert list(built.options) == list(cmd.options)
+    assert list(built.output) == list(cmd.output)
+    assert list(built.output_params) == list(cmd.output_params)
+    for param in cmd.options():
+        other = built.options[param.name]
+        assert type(other) is type(param)
+        for key in ('cli_name', 'required', 'multivalue', 'default',
+                    'flags', 'exclude'):
+            assert getattr(other, key) == getattr(param, key)
+    assert built.options.uidnumber.minvalue == 1
+    assert built.options.quota.minvalue == Decimal('0.5')
+    assert built.options.shell.values == (u'/bin/sh', u'/bin/bash')
+
+    # the default of uid is computed by the server
+    assert built.get_default(givenname=u'John', sn=u'Doe') == dict(
+        random=True)
+    built.validate(givenname=u'John', sn=u'Doe', random=True)
+
+
+def test_client_code():
+    cmd = user_show()
+    cmd.env = config.Env(context='cli')
+    cmd.finalize()
+    assert schema.needs_client_code(cmd)
+    assert schema.serialize_command(cmd)['client_code'] is True
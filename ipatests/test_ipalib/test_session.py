@@ -0,0 +1,181 @@
+# Copyright (C) 2015  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the `ipalib.session` and `ipalib.krb_utils` modules.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from ipalib import errors, krb_utils
+from ipalib.session import (
+    SessionStore, LocalSessionStore, StoreSessionManager)
+
+
+def make_ccache_data(creds):
+    client = (1, 'EXAMPLE.COM', ('admin',))
+    header = struct.pack('>HHHHII', krb_utils.KRB5_FCC_FVNO_4, 12,
+                         1, 8, 0, 0)
+    header += struct.pack('>II', 1, 1)
+    header += struct.pack('>I', 11) + 'EXAMPLE.COM'
+    header += struct.pack('>I', 5) + 'admin'
+    return header + ''.join(krb_utils.krb5_pack_ccache_cred(
+        (client, server, (18, 'k' * 32), (1, 2, 3, 4), 0, 0x40e10000,
+         (), ticket, '', ((1, 'authdata'),)))
+        for server, ticket in creds)
+
+
+def test_ccache_data():
+    tgt = (2, 'EXAMPLE.COM', ('krbtgt', 'EXAMPLE.COM'))
+    http = (3, 'EXAMPLE.COM', ('HTTP', 'ipa.example.com'))
+    data = make_ccache_data([(tgt, 'tgt'), (http, 'http')])
+
+    header, principal, creds = krb_utils.krb5_parse_ccache_data(data)
+    assert principal == (1, 'EXAMPLE.COM', ('admin',))
+    assert [cred[1] for cred, raw in creds] == [tgt, http]
+    assert creds[1][0][2:] == ((18, 'k' * 32), (1, 2, 3, 4), 0, 0x40e10000,
+                               (), 'http', '', ((1, 'authdata'),))
+    assert header + ''.join(raw for cred, raw in creds) == data
+
+    try:
+        krb_utils.krb5_parse_ccache_data(data[:-1])
+    except ValueError:
+        pass
+    else:
+        assert False, 'truncated ccache data was parsed'
+
+
+def test_principal_name():
+    principal = (1, 'EXAMPLE.COM', ('ldap', 'ipa/1@example.com'))
+    name = krb_utils.krb5_format_principal(principal)
+    assert name == 'ldap/ipa\\/1\\@example.com@EXAMPLE.COM'
+    assert krb_utils.krb5_split_principal_name(name) == principal[1:]
+    assert (krb_utils.krb5_split_principal_name('admin') ==
+            ('', ('admin',)))
+
+
+class FakeSessionStore(SessionStore):
+    def __init__(self):
+        self.sets = 0
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, expiration=0):
+        self.sets += 1
+
+
+def test_store_session_data():
+    store = FakeSessionStore()
+    mgr = StoreSessionManager(store)
+
+    session_data = mgr.new_session_data(mgr.new_session_id())
+    session_data['ccache_data'] = 'ccache'
+    mgr.set_session_expiration_time(session_data, duration=20 * 60)
+    mgr.store_session_data(session_data)
+    assert store.sets == 1
+
+    # nothing changed, the expiration moved forward by less than the slack
+    mgr.set_session_expiration_time(session_data, duration=20 * 60)
+    mgr.store_session_data(session_data)
+    assert store.sets == 1
+
+    session_data['ccache_data'] = 'updated ccache'
+    mgr.store_session_data(session_data)
+    assert store.sets == 2
+
+    session_data['session_expiration_timestamp'] = time.time() + 40 * 60
+    mgr.store_session_data(session_data)
+    assert store.sets == 3
+
+    assert mgr.get_store_statistics() == dict(stored=3, skipped=1)
+
+
+class test_LocalSessionStore(object):
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sessions')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store(self):
+        store = LocalSessionStore(self.path, slots=16, slot_size=1024)
+        assert store.get('key') is None
+        store.set('key', dict(session_id='key'), time.time() + 60)
+        assert store.get('key') == dict(session_id='key')
+        store.set('key', dict(session_id='new'))
+        assert store.get('key') == dict(session_id='new')
+
+        # the store is shared by all store objects using the file
+        other = LocalSessionStore(self.path, slots=16, slot_size=1024)
+        assert other.get('key') == dict(session_id='new')
+        other.delete('key')
+        assert store.get('key') is None
+
+        # values too large for a slot are refused, the stored one is kept
+        store.set('key', dict(session_id='kept'))
+        try:
+            store.set('key', 'x' * 1024)
+        except errors.ExecutionError:
+            pass
+        else:
+            assert False, 'value too large for a slot was stored'
+        assert store.get('key') == dict(session_id='kept')
+
+    def test_expiration(self):
+        store = LocalSessionStore(self.path, slots=8, slot_size=256)
+        store.set('expired', 1, time.time() - 1)
+        assert store.get('expired') is None
+
+        # every key maps to all eight slots, the slot of the expired
+        # value is reused
+        for i in xrange(8):
+            store.set('key%d' % i, i, time.time() + 60 + i)
+        assert [store.get('key%d' % i) for i in xrange(8)] == range(8)
+        assert store.get_statistics() == dict(slots=8, used=8)
+
+        # live values are not evicted
+        try:
+            store.set('key8', 8, time.time() + 60)
+        except errors.ExecutionError:
+            pass
+        else:
+            assert False, 'live value was evicted'
+        assert [store.get('key%d' % i) for i in xrange(8)] == range(8)
+        assert store.get('key8') is None
+
+    def test_geometry(self):
+        store = LocalSessionStore(self.path, slots=8, slot_size=256)
+        store.set('key', 1)
+        old_size = os.path.getsize(self.path)
+
+        # a file with a different geometry is replaced, not truncated under
+        # the processes which map it
+        other = LocalSessionStore(self.path, slots=16, slot_size=512)
+        assert other.get('key') is None
+        assert os.fstat(store.fd).st_size == old_size
+        assert store.get('key') == 1
+        other.set('key', 2)
+        assert store.get('key') == 1
+
+        # new stores use the new file
+        assert LocalSessionStore(self.path, slots=16,
+                                 slot_size=512).get('key') == 2
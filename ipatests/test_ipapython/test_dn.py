@@ -1,6 +1,8 @@
 #!/usr/bin/python2
 
 import unittest
+
+import ipapython.dn
 from ipapython.dn import *
 
 def expected_class(klass, component):
@@ -1260,5 +1262,46 @@ class TestInternationalization(unittest.TestCase):
         self.assertEqual(str(dn1), 'cn='+self.arabic_hello_utf8)
 
 
+class TestCaching(unittest.TestCase):
+    def setUp(self):
+        self.base_dn = DN(('cn', 'users'), ('cn', 'accounts'),
+                          ('dc', 'example'), ('dc', 'com'))
+        self.member_dns = [DN(('uid', 'user%d' % i), self.base_dn)
+                           for i in range(100)]
+
+    def test_sharing(self):
+        dn1 = self.member_dns[0]
+        dn2 = DN(dn1)
+        self.assertIs(dn2.rdns, dn1.rdns)
+        self.assertEqual(hash(dn2), hash(dn1))
+
+        dn3 = DN(str(dn1))
+        self.assertIs(DN(str(dn1)).rdns, dn3.rdns)
+        self.assertEqual(dn3, dn1)
+        self.assertEqual(hash(dn3), hash(dn1))
+
+        self.assertEqual(dn1[1:], self.base_dn)
+        self.assertEqual(hash(dn1[1:]), hash(self.base_dn))
+
+    def test_reuse(self):
+        # Parsed RDN's and comparison keys are reused instead of being
+        # computed again, as it is done for every member value of large
+        # groups.
+        value = 'uid=reuse,cn=users,cn=accounts,dc=example,dc=com'
+        dn1 = DN(value)
+        self.assertIs(ipapython.dn._str2dn_cache[value], dn1.rdns)
+        self.assertIs(DN(value).rdns, dn1.rdns)
+
+        self.assertIsNone(dn1._key)
+        hash(dn1)
+        key = dn1._key
+        self.assertIsNotNone(key)
+        self.assertIs(DN(dn1)._key, key)
+        self.assertEqual(dn1[1:]._key, key[1:])
+
+        self.assertTrue(dn1.endswith(self.base_dn))
+        self.assertIs(dn1._key, key)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+# Copyright (C) 2015  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import unittest
+
+from ipapython import dogtag
+
+
+class FakeMessage(object):
+    dict = {}
+
+
+class FakeResponse(object):
+    def __init__(self, will_close=False):
+        self.status = 200
+        self.reason = 'OK'
+        self.msg = FakeMessage()
+        self.will_close = will_close
+
+    def read(self):
+        return '<xml/>'
+
+
+class FakeConnection(object):
+    def __init__(self, alive=True, will_close=False):
+        self.alive = alive
+        self.will_close = will_close
+        self.requests = 0
+        self.closed = False
+
+    def request(self, method, uri, body=None, headers=None):
+        if not self.alive:
+            raise socket.error('connection reset by peer')
+        self.requests += 1
+
+    def getresponse(self):
+        return FakeResponse(self.will_close)
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(object):
+    def __init__(self, *conns):
+        self.idle = list(conns)
+
+    def get(self, key):
+        if self.idle:
+            return self.idle.pop()
+        return None
+
+    def put(self, key, conn):
+        self.idle.append(conn)
+
+    def flush(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+
+
+class FakeNSSLib(object):
+    def __init__(self):
+        self.current_dbdir = None
+        self.initialized = []
+
+    def is_initialized(self, dbdir):
+        return self.current_dbdir == dbdir
+
+    def init_database(self, dbdir):
+        self.initialized.append(dbdir)
+        self.current_dbdir = dbdir
+
+
+class TestHTTPLibRequest(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+
+    def factory(self, host, port):
+        conn = FakeConnection()
+        self.created.append(conn)
+        return conn
+
+    def request(self, pool):
+        return dogtag._httplib_request(
+            'https', 'ca.example.com', 443, '/ca/agent/ca/displayBySerial',
+            self.factory, 'serialNumber=1', connection_pool=pool)
+
+    def test_keep_alive(self):
+        pool = FakePool()
+        for i in xrange(3):
+            self.assertEqual(self.request(pool)[0], 200)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(self.created[0].requests, 3)
+        self.assertEqual(pool.idle, self.created)
+
+    def test_retry_stale(self):
+        stale = FakeConnection(alive=False)
+        pool = FakePool(stale)
+        self.assertEqual(self.request(pool)[0], 200)
+        self.assertTrue(stale.closed)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(pool.idle, self.created)
+
+    def test_server_close(self):
+        pool = FakePool()
+        self.factory = lambda host, port: FakeConnection(will_close=True)
+        self.request(pool)
+        self.assertEqual(pool.idle, [])
+
+    def test_no_pool(self):
+        self.request(None)
+        self.assertTrue(self.created[0].closed)
+
+
+class TestInitNSS(unittest.TestCase):
+    def setUp(self):
+        self.nsslib = dogtag.nsslib
+        dogtag.nsslib = FakeNSSLib()
+
+    def tearDown(self):
+        dogtag.nsslib = self.nsslib
+
+    def test_init_once(self):
+        dogtag.init_nss('/etc/httpd/alias')
+        conn = FakeConnection()
+        pool = FakePool(conn)
+        for i in xrange(3):
+            dogtag.init_nss('/etc/httpd/alias', pool)
+        self.assertEqual(dogtag.nsslib.initialized, ['/etc/httpd/alias'])
+        self.assertEqual(pool.idle, [conn])
+        self.assertFalse(conn.closed)
+
+    def test_other_database(self):
+        dogtag.init_nss('/etc/httpd/alias')
+        conn = FakeConnection()
+        pool = FakePool(conn)
+        dogtag.init_nss('/root/.ipa/alias', pool)
+        self.assertEqual(dogtag.nsslib.initialized,
+                         ['/etc/httpd/alias', '/root/.ipa/alias'])
+        # the pooled connections were opened with the previous database
+        self.assertEqual(pool.idle, [])
+        self.assertTrue(conn.closed)
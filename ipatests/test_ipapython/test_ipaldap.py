@@ -0,0 +1,195 @@
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import shutil
+import tempfile
+import unittest
+
+import ldap
+
+from ipapython.dn import DN
+from ipapython.ipaldap import (
+    LDAPClient, LDAPConnectionPool, SchemaCache, SortRequestControl,
+    VLVRequestControl, VLVResponseControl)
+
+
+class FakeConnection(object):
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.unbound = False
+
+    def whoami_s(self):
+        if not self.alive:
+            raise ldap.SERVER_DOWN({'desc': 'server down'})
+        return 'dn:uid=admin'
+
+    def unbind_s(self):
+        self.unbound = True
+
+
+class TestLDAPConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = LDAPConnectionPool(max_size=2, idle_timeout=60,
+                                       check_interval=-1)
+
+    def test_reuse(self):
+        conn = FakeConnection()
+        self.assertIsNone(self.pool.get('admin'))
+        self.pool.put('admin', conn)
+        self.assertIsNone(self.pool.get('other'))
+        self.assertIs(self.pool.get('admin'), conn)
+        self.assertIsNone(self.pool.get('admin'))
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 3)
+        self.assertEqual(stats['released'], 1)
+        self.assertEqual(stats['idle'], 0)
+
+    def test_max_size(self):
+        conns = [FakeConnection() for i in range(3)]
+        for conn in conns:
+            self.pool.put('admin', conn)
+        self.assertEqual(len(self.pool), 2)
+        self.assertTrue(conns[0].unbound)
+        self.assertIs(self.pool.get('admin'), conns[2])
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = -1
+        conn = FakeConnection()
+        self.pool.put('admin', conn)
+        self.assertIsNone(self.pool.get('admin'))
+        self.assertTrue(conn.unbound)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_failed_check(self):
+        conn = FakeConnection(alive=False)
+        self.pool.put('admin', conn)
+        self.assertIsNone(self.pool.get('admin'))
+        self.assertTrue(conn.unbound)
+        self.assertEqual(self.pool.get_stats()['failed_checks'], 1)
+
+    def test_flush(self):
+        conn = FakeConnection()
+        self.pool.put('admin', conn)
+        self.pool.flush()
+        self.assertTrue(conn.unbound)
+        self.assertIsNone(self.pool.get('admin'))
+
+
+class FakeSchemaConnection(object):
+    def __init__(self, csn):
+        self.csn = csn
+        self.schema_retrievals = 0
+
+    def search_s(self, base, scope, attrlist=None):
+        if 'attributetypes' in attrlist:
+            self.schema_retrievals += 1
+            return [('cn=schema', {
+                'attributeTypes': [
+                    "( 2.5.4.3 NAME ( 'cn' 'commonName' ) "
+                    "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 )",
+                    "( 2.5.4.31 NAME 'member' "
+                    "SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 )",
+                    "( 2.16.840.1.113730.3.1.3 NAME 'employeeNumber' "
+                    "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 SINGLE-VALUE )",
+                ],
+                'objectClasses': [],
+            })]
+        return [('cn=schema', {'modifyTimestamp': ['20140101000000Z'],
+                               'nsSchemaCSN': [self.csn]})]
+
+
+class TestSchemaCache(unittest.TestCase):
+    url = 'ldap://ipa.example.com'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_attribute_table(self, conn):
+        cache = SchemaCache()
+        cache.cache_dir = self.cache_dir
+        return cache.get_attribute_table(self.url, conn)
+
+    def test_attribute_table(self):
+        conn = FakeSchemaConnection('1')
+        table = self.get_attribute_table(conn)
+        self.assertEqual(table['commonname'], table['2.5.4.3'])
+        self.assertEqual(table['member'][1],
+                         '1.3.6.1.4.1.1466.115.121.1.12')
+        self.assertFalse(table['member'][2])
+        self.assertTrue(table['employeenumber'][2])
+        self.assertEqual(conn.schema_retrievals, 1)
+
+    def test_disk_cache(self):
+        conn = FakeSchemaConnection('1')
+        table = self.get_attribute_table(conn)
+
+        # new process, same schema: the table is loaded from disk
+        self.assertEqual(self.get_attribute_table(conn), table)
+        self.assertEqual(conn.schema_retrievals, 1)
+
+        # schema changed: the table is retrieved again
+        conn.csn = '2'
+        self.assertEqual(self.get_attribute_table(conn), table)
+        self.assertEqual(conn.schema_retrievals, 2)
+
+    def test_loaded_schema(self):
+        conn = FakeSchemaConnection('1')
+        schema_entry = conn.search_s('cn=schema', ldap.SCOPE_BASE,
+                                     ['attributetypes', 'objectclasses'])
+        client = LDAPClient('ldap://ipa.example.com',
+                            force_schema_updates=False)
+        client._has_schema = True
+        client._schema = ldap.schema.SubSchema(schema_entry[0][1])
+
+        # a schema already loaded is used without the schema cache
+        def get_attribute_table():
+            raise AssertionError('schema cache used')
+        client._get_attribute_table = get_attribute_table
+
+        self.assertIs(client.get_attribute_type('member'), DN)
+        self.assertIs(client.get_attribute_type('commonName'), unicode)
+        self.assertTrue(client.get_attribute_single_value('employeenumber'))
+        self.assertFalse(client.get_attribute_single_value('cn'))
+        self.assertIsNone(client.get_attribute_single_value('unknown'))
+
+
+class TestPagingControls(unittest.TestCase):
+    def test_sort_request(self):
+        ctrl = SortRequestControl(['uid'])
+        self.assertEqual(ctrl.encodeControlValue(),
+                         '\x30\x07\x30\x05\x04\x03uid')
+        ctrl = SortRequestControl(['-cn'])
+        self.assertEqual(ctrl.encodeControlValue(),
+                         '\x30\x09\x30\x07\x04\x02cn\x81\x01\x01')
+
+    def test_vlv_request(self):
+        ctrl = VLVRequestControl(11, after_count=9)
+        self.assertEqual(ctrl.encodeControlValue(),
+                         '\x30\x0e\x02\x01\x00\x02\x01\x09'
+                         '\xa0\x06\x02\x01\x0b\x02\x01\x00')
+
+    def test_vlv_response(self):
+        ctrl = VLVResponseControl()
+        ctrl.decodeControlValue('\x30\x09\x02\x01\x0b\x02\x01\x64'
+                                '\x0a\x01\x00')
+        self.assertEqual(ctrl.target_position, 11)
+        self.assertEqual(ctrl.content_count, 100)
+        self.assertEqual(ctrl.result, 0)
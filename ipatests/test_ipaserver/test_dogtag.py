@@ -0,0 +1,63 @@
+# Copyright (C) 2015  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the `ipaserver.plugins.dogtag` module.
+"""
+
+from ipalib import errors
+from ipaserver.plugins.dogtag import MasterCache
+
+
+class test_MasterCache(object):
+    def setup(self):
+        self.calls = 0
+
+    def found(self):
+        self.calls += 1
+        return u'ca.example.com'
+
+    def not_found(self):
+        self.calls += 1
+        return None
+
+    def failed(self):
+        self.calls += 1
+        raise errors.NetworkError(uri='ldapi://', error='timed out')
+
+    def test_cached(self):
+        cache = MasterCache(ttl=300)
+        for func in (self.found, self.not_found):
+            key = ('select_any_master', func.__name__)
+            assert cache.lookup(key, func) == func()
+            self.calls = 0
+            cache.lookup(key, func)
+            assert self.calls == 0
+
+    def test_failure_not_cached(self):
+        cache = MasterCache(ttl=300)
+        key = ('host_has_service', 'ca.example.com', 'CA')
+        assert cache.lookup(key, self.failed, False) is False
+        assert cache.lookup(key, self.failed, False) is False
+        assert self.calls == 2
+        assert cache.lookup(key, self.found) == u'ca.example.com'
+
+    def test_disabled(self):
+        cache = MasterCache(ttl=0)
+        key = ('select_any_master', 'CA')
+        cache.lookup(key, self.found)
+        cache.lookup(key, self.found)
+        assert self.calls == 2
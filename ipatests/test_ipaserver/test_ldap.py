@@ -31,10 +31,11 @@ import nose
 from nose.tools import assert_raises  # pylint: disable=E0611
 import nss.nss as nss
 
-from ipaserver.plugins.ldap2 import ldap2
+from ipaserver.plugins.ldap2 import ldap2, IPAConfigCache
 from ipalib.plugins.service import service, service_show
 from ipalib.plugins.host import host
 from ipalib import api, x509, create_api, errors
+from ipalib.request import context
 from ipapython import ipautil
 from ipaplatform.paths import paths
 from ipapython.dn import DN
@@ -148,6 +149,92 @@ class test_ldap(object):
         serial = unicode(x509.get_serial_number(cert, x509.DER))
         assert serial is not None
 
+    def test_iter_entries(self):
+        """
+        Test iterating over paged search results using ldap2
+        """
+        self.conn = ldap2(shared_instance=False, ldap_uri=self.ldapuri)
+        self.conn.connect()
+        base_dn = DN(('cn', 'accounts'), api.env.basedn)
+        entries, truncated = self.conn.find_entries(
+            '(objectclass=*)', [''], base_dn, size_limit=0, time_limit=0)
+        iterated = list(self.conn.iter_entries(
+            '(objectclass=*)', [''], base_dn, size_limit=-1, time_limit=0,
+            paged_search=True))
+        assert sorted(e.dn for e in iterated) == sorted(e.dn for e in entries)
+
+        # stop early, the connection must remain usable
+        for entry in self.conn.iter_entries(
+                '(objectclass=*)', [''], base_dn, size_limit=-1, time_limit=0,
+                paged_search=True):
+            break
+        assert self.conn.get_entry(base_dn, ['']).dn == base_dn
+
+
+    def test_ipa_config_cache(self):
+        """
+        Test caching the IPA configuration entry in ldap2
+        """
+        if not ipautil.file_exists(self.ccache):
+            raise nose.SkipTest('Missing ccache %s' % self.ccache)
+        self.conn = ldap2(shared_instance=False, ldap_uri=self.ldapuri)
+        self.conn.connect(ccache='FILE:%s' % self.ccache)
+        principal = self.conn._bind_principal
+        cache = IPAConfigCache()
+        cache.ttl = 60
+        self.conn._get_config_cache = lambda: cache
+
+        config = self.conn.get_ipa_config()
+        (raw, version, checked) = cache.get(principal)
+        assert version[0] is not None
+        assert 'modifytimestamp' not in config
+        assert config.raw['ipasearchtimelimit'] == raw['ipasearchtimelimit']
+
+        # the next request gets a copy of the cached entry
+        del context.config_entry
+        other = self.conn.get_ipa_config()
+        assert other is not config
+        assert other.raw['ipasearchtimelimit'] == raw['ipasearchtimelimit']
+        assert self.conn.get_ipa_config() is other
+        assert cache.get(principal)[2] == checked
+
+        # an expired entry is revalidated
+        del context.config_entry
+        cache.ttl = 0
+        self.conn.get_ipa_config()
+        assert cache.get(principal)[1] == version
+        assert cache.get(principal)[2] > checked
+
+        # the entry read by another principal is not used
+        cache.ttl = 60
+        del context.config_entry
+        self.conn._bind_principal = u'other@%s' % api.env.realm
+        self.conn.get_ipa_config()
+        assert cache.get(u'other@%s' % api.env.realm)[2] > checked
+        assert cache.get(principal)[0] is raw
+
+    def test_ipa_config_cache_principals(self):
+        """
+        Test the IPA configuration entry is cached per principal
+        """
+        cache = IPAConfigCache()
+        cache.max_size = 2
+        cache.set(u'admin@EXAMPLE.COM', {'ipasearchtimelimit': ['2']}, (1,))
+        assert cache.get(u'user@EXAMPLE.COM') is None
+
+        cache.set(u'user@EXAMPLE.COM', {}, (1,))
+        assert cache.get(u'admin@EXAMPLE.COM')[0] == {
+            'ipasearchtimelimit': ['2']}
+        assert cache.get(u'user@EXAMPLE.COM')[0] == {}
+
+        # the least recently used principal is dropped
+        cache.set(u'host@EXAMPLE.COM', {}, (1,))
+        assert cache.get(u'admin@EXAMPLE.COM') is None
+        assert cache.get(u'user@EXAMPLE.COM') is not None
+
+        cache.clear()
+        assert cache.get(u'user@EXAMPLE.COM') is None
+
 
 class test_LDAPEntry(object):
     """
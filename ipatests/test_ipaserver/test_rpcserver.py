@@ -22,6 +22,9 @@ Test the `ipaserver.rpc` module.
 """
 
 import json
+import zlib
+import gzip
+from cStringIO import StringIO
 
 from ipatests.util import create_test_api, assert_equal, raises, PluginTester
 from ipatests.data import unicode_str
@@ -111,6 +114,50 @@ def test_unauthorized_error():
                          ('X-IPA-Rejection-Reason', 'password-expired')]
 
 
+def test_accepted_encoding():
+    """
+    Test the `ipaserver.rpcserver.accepted_encoding` function.
+    """
+    f = rpcserver.accepted_encoding
+    assert f({}) is None
+    assert f({'HTTP_ACCEPT_ENCODING': 'identity'}) is None
+    assert f({'HTTP_ACCEPT_ENCODING': 'gzip'}) == 'gzip'
+    assert f({'HTTP_ACCEPT_ENCODING': 'deflate, GZIP'}) == 'gzip'
+    assert f({'HTTP_ACCEPT_ENCODING': 'gzip;q=0, deflate'}) == 'deflate'
+    assert f({'HTTP_ACCEPT_ENCODING': 'gzip;q=0.0'}) is None
+
+
+def test_compress_response():
+    """
+    Test the `ipaserver.rpcserver.compress_response` function.
+    """
+    f = rpcserver.compress_response
+    data = json.dumps(dict(result=[unicode_str] * 100))
+
+    compressed = f(data, 'gzip')
+    assert len(compressed) < len(data)
+    assert gzip.GzipFile(fileobj=StringIO(compressed)).read() == data
+
+    compressed = f(data, 'deflate')
+    assert len(compressed) < len(data)
+    assert zlib.decompress(compressed) == data
+
+    raises(ValueError, f, data, 'br')
+
+
+def test_etag_matches():
+    """
+    Test the `ipaserver.rpcserver.etag_matches` function.
+    """
+    f = rpcserver.etag_matches
+    etag = 'W/"abc"'
+    assert f({}, etag) is False
+    assert f({'HTTP_IF_NONE_MATCH': '"xyz"'}, etag) is False
+    assert f({'HTTP_IF_NONE_MATCH': 'W/"abc"'}, etag) is True
+    assert f({'HTTP_IF_NONE_MATCH': '"xyz", "abc"'}, etag) is True
+    assert f({'HTTP_IF_NONE_MATCH': '*'}, etag) is True
+
+
 def test_params_2_args_options():
     """
     Test the `ipaserver.rpcserver.params_2_args_options` function.
@@ -21,13 +21,28 @@
 Test the `ipalib.plugins.baseldap` module.
 """
 
-import ldap
-
 from ipapython.dn import DN
 from ipapython import ipaldap
-from ipalib import errors
+from ipalib import backend, errors, Str
 from ipalib.plugins import baseldap
-from ipatests.util import assert_deepequal
+from ipatests.util import assert_deepequal, create_test_api
+
+
+class FakeLDAPClient(ipaldap.LDAPClient):
+    def __init__(self):
+        super(FakeLDAPClient, self).__init__('ldap://test',
+                                             force_schema_updates=False)
+        self._has_attribute_table = True
+        self._attribute_table = {
+            'binaryattr': (('binaryattr',),
+                           '1.3.6.1.4.1.1466.115.121.1.40', False),
+            'textattr': (('textattr',),
+                         '1.3.6.1.4.1.1466.115.121.1.15', False),
+            'dnattr': (('dnattr',),
+                       '1.3.6.1.4.1.1466.115.121.1.12', False),
+            'cn': (('cn', 'commonname'),
+                   '1.3.6.1.4.1.1466.115.121.1.15', False),
+        }
 
 
 def test_exc_wrapper():
@@ -165,29 +180,6 @@ def test_exc_callback_registration():
 
 
 def test_entry_to_dict():
-    class FakeAttributeType(object):
-        def __init__(self, name, syntax):
-            self.names = (name,)
-            self.syntax = syntax
-
-    class FakeSchema(object):
-        def get_obj(self, type, name):
-            if type != ldap.schema.AttributeType:
-                return
-            if name == 'binaryattr':
-                return FakeAttributeType(name, '1.3.6.1.4.1.1466.115.121.1.40')
-            elif name == 'textattr':
-                return FakeAttributeType(name, '1.3.6.1.4.1.1466.115.121.1.15')
-            elif name == 'dnattr':
-                return FakeAttributeType(name, '1.3.6.1.4.1.1466.115.121.1.12')
-
-    class FakeLDAPClient(ipaldap.LDAPClient):
-        def __init__(self):
-            super(FakeLDAPClient, self).__init__('ldap://test',
-                                                 force_schema_updates=False)
-            self._has_schema = True
-            self._schema = FakeSchema()
-
     conn = FakeLDAPClient()
     rights = {'nothing': 'is'}
 
@@ -207,3 +199,149 @@ def test_entry_to_dict():
     assert_deepequal(
         baseldap.entry_to_dict(entry, all=True, raw=True),
         the_dict)
+
+
+def test_split_member_dn():
+    split = baseldap._split_member_dn
+    assert split('uid=admin,cn=users,cn=accounts,dc=example,dc=com') == (
+        'uid', 'admin', 'cn=users,cn=accounts,dc=example,dc=com')
+    assert split('CN=Admins,CN=Groups,DC=example') == (
+        'cn', 'Admins', 'cn=groups,dc=example')
+    assert split('uid=j\xc3\xbcrgen,cn=users,dc=example') == (
+        'uid', 'j\xc3\xbcrgen', 'cn=users,dc=example')
+
+    # values which must be parsed as DN
+    assert split('cn=a\\,b,cn=users,dc=example') is None
+    assert split('cn=a+uid=b,cn=users,dc=example') is None
+    assert split('uid=admin, cn=users,dc=example') is None
+    assert split('uid=admin,cn=users,dc=example ') is None
+    assert split('uid=#0403,cn=users,dc=example') is None
+    assert split('uid=admin,dc=ex\xc3\xa4mple') is None
+
+
+class test_LDAPSearch_paging(object):
+    """
+    Test the offset and limit options of `baseldap.LDAPSearch`.
+    """
+    names = [u'b', u'A', u'c-1', u'C', u'a10', u'a9', u'a_1']
+    # the server sorts the primary keys with their case ignore ordering
+    server_order = sorted(names, key=lambda name: name.lower())
+
+    def setup(self):
+        self.sorted_searches = []
+        self.searches = []
+        self.vlv_error = None
+
+    def make_command(self, vlv_container_dn=None, extra=None):
+        conn = FakeLDAPClient()
+        test = self
+        container_dn = DN(('cn', 'pagetest'))
+
+        def make_entry(name):
+            return conn.make_entry(
+                DN(('cn', name), container_dn, baseldap.api.env.basedn),
+                cn=[name])
+
+        class FakeBackend(object):
+            MATCH_ALL = conn.MATCH_ALL
+            SCOPE_ONELEVEL = conn.SCOPE_ONELEVEL
+            make_filter = conn.make_filter
+            combine_filters = conn.combine_filters
+
+            def find_entries_sorted(self, filter, attrs_list, base_dn, scope,
+                                    sort_key, offset, limit, time_limit):
+                test.sorted_searches.append((filter, sort_key, offset, limit))
+                if test.vlv_error is not None:
+                    raise test.vlv_error
+                page = test.server_order[offset:offset + limit]
+                return ([make_entry(name) for name in page],
+                        len(test.server_order))
+
+            def find_entries(self, filter, attrs_list, base_dn, scope,
+                             time_limit, size_limit):
+                test.searches.append(filter)
+                return ([make_entry(name) for name in test.names], False)
+
+        class FakeObject(object):
+            backend = FakeBackend()
+            parent_object = ''
+            object_class = ['pagetest']
+            default_attributes = ['cn']
+            search_display_attributes = []
+            search_attributes = []
+            search_attributes_config = None
+            primary_key = Str('cn', primary_key=True)
+        FakeObject.container_dn = container_dn
+        FakeObject.vlv_container_dn = vlv_container_dn
+
+        class pagetest_find(baseldap.LDAPSearch):
+            obj = FakeObject()
+
+            def args_options_2_entry(self, *args, **options):
+                return {}
+
+            def post_callback(self, ldap, entries, truncated, *args,
+                              **options):
+                if extra is not None:
+                    entries.append(make_entry(extra))
+                return truncated
+
+        return pagetest_find()
+
+    def find(self, command, *args, **options):
+        result = command.execute(*(args or (None,)), raw=True, pkey_only=True,
+                                 **options)
+        names = [entry['cn'][0].decode('utf-8') for entry in result['result']]
+        assert result['count'] == len(names)
+        return (names, result.get('total'))
+
+    def test_server_paging(self):
+        command = self.make_command(vlv_container_dn=DN(('cn', 'pagetest')))
+        for offset in range(0, len(self.names) + 3, 3):
+            (names, total) = self.find(command, offset=offset, limit=3)
+            assert names == self.server_order[offset:offset + 3]
+            assert total == len(self.names)
+        assert self.sorted_searches == [
+            ('(objectclass=pagetest)', 'cn', 0, 3),
+            ('(objectclass=pagetest)', 'cn', 3, 3),
+            ('(objectclass=pagetest)', 'cn', 6, 3),
+            ('(objectclass=pagetest)', 'cn', 9, 3)]
+        assert self.searches == []
+
+        # the result of a search without limit is not paged on the server
+        assert self.find(command, offset=5) == (self.server_order[5:],
+                                                len(self.names))
+        assert self.find(command) == (self.server_order, None)
+        assert len(self.sorted_searches) == 4
+
+    def test_paging_error(self):
+        """
+        Test that the entries are paged the same way when the server
+        cannot page them
+        """
+        command = self.make_command(vlv_container_dn=DN(('cn', 'pagetest')))
+        self.vlv_error = errors.DatabaseError(desc='virtual list view',
+                                              info='result 76')
+        for offset in range(0, len(self.names) + 3, 3):
+            (names, total) = self.find(command, offset=offset, limit=3)
+            assert names == self.server_order[offset:offset + 3]
+            assert total == len(self.names)
+        assert len(self.sorted_searches) == len(self.searches) == 4
+
+    def test_not_indexed(self):
+        """
+        Test that searches which are not indexed are paged after the post
+        callbacks
+        """
+        command = self.make_command(extra=u'a0')
+        expected = sorted(self.names + [u'a0'], key=lambda name: name.lower())
+        for offset in range(0, len(expected) + 3, 3):
+            (names, total) = self.find(command, offset=offset, limit=3)
+            assert names == expected[offset:offset + 3]
+            assert total == len(expected)
+        assert self.sorted_searches == []
+
+        # nor are the searches with criteria
+        command = self.make_command(vlv_container_dn=DN(('cn', 'pagetest')))
+        self.find(command, u'a', limit=3)
+        assert self.sorted_searches == []
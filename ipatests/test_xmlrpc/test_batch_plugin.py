@@ -112,6 +112,89 @@ class test_batch(Declarative):
             ),
         ),
 
+        dict(
+            desc='Create, show and delete a group in parallel',
+            command=('batch', [
+                dict(method='group_add',
+                    params=([group1], dict(description=u'Test desc 1'))),
+                dict(method='group_show', params=([group1], dict())),
+                dict(method='group_find', params=([group1], dict())),
+                dict(method='group_show', params=([group1], dict())),
+                dict(method='group_del', params=([group1], dict())),
+                dict(method='group_show', params=([group1], dict())),
+            ], dict(parallel=True)),
+            expected=dict(
+                count=6,
+                results=deepequal_list(
+                    dict(
+                        value=group1,
+                        summary=u'Added group "testgroup1"',
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            objectclass=objectclasses.group + [u'posixgroup'],
+                            ipauniqueid=[fuzzy_uuid],
+                            gidnumber=[fuzzy_digits],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        value=group1,
+                        summary=None,
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            gidnumber=[fuzzy_digits],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        count=1,
+                        truncated=False,
+                        summary=u'1 group matched',
+                        result=[dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            gidnumber=[fuzzy_digits],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            )],
+                        error=None),
+                    dict(
+                        value=group1,
+                        summary=None,
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            gidnumber=[fuzzy_digits],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        summary=u'Deleted group "%s"' % group1,
+                        result=dict(failed=[]),
+                        value=[group1],
+                        error=None),
+                    dict(
+                        error=u'%s: group not found' % group1,
+                        error_name=u'NotFound',
+                        error_code=4001,
+                    ),
+                ),
+            ),
+        ),
+
         dict(
             desc='Try to delete nonexistent group twice',
             command=('batch', [
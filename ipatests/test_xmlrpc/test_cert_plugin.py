@@ -23,12 +23,14 @@ Test the `ipalib/plugins/cert.py` module against a RA.
 import sys
 import os
 import shutil
+import threading
 from nose.tools import raises, assert_raises  # pylint: disable=E0611
 
 from xmlrpc_test import XMLRPC_test, assert_attr_equal
 from ipalib import api
 from ipalib import errors
 from ipalib import x509
+from ipalib.plugins.cert import cert_request_bulk
 import tempfile
 from ipapython import ipautil
 import nose
@@ -188,7 +190,37 @@ class test_cert(XMLRPC_test):
         # And it should match the new one
         assert base64.b64encode(res['usercertificate'][0]) == newcert
 
-    def test_0007_cleanup(self):
+    def test_0007_cert_request_bulk(self):
+        """
+        Renew the certificate of a service along with a request for a service
+        that doesn't exist.
+        """
+        global newcert
+
+        missing_princ = u'missing/%s@%s' % (self.host_fqdn, api.env.realm)
+        csr = unicode(self.generateCSR(str(self.subject)))
+        res = api.Command['cert_request_bulk'](
+            [self.service_princ, missing_princ], csr=[csr, csr])
+        assert res['count'] == 1
+        (issued, failed) = res['results']
+        assert issued['error'] is None
+        assert issued['principal'] == self.service_princ
+        assert DN(issued['subject']) == self.subject
+        assert failed['principal'] == missing_princ
+        assert failed['error_name'] == u'NotFound'
+        newcert = issued['certificate']
+
+    def test_0008_service_show(self):
+        """
+        Verify the certificate issued in bulk with service-show.
+        """
+        global newcert
+
+        res = api.Command['service_show'](self.service_princ)['result']
+        assert len(res['usercertificate']) == 1
+        assert base64.b64encode(res['usercertificate'][0]) == newcert
+
+    def test_0009_cleanup(self):
         """
         Clean up cert test data
         """
@@ -451,3 +483,110 @@ class test_cert_find(XMLRPC_test):
         Search using invalid date format
         """
         res = api.Command['cert_find'](issuedon_from=u'xyz')
+
+    def test_0032_search_with_cursor(self):
+        """
+        Search one page at a time
+        """
+        res = api.Command['cert_find'](sizelimit=2)
+        assert res['count'] == 2 and res['truncated']
+        serials = [c['serial_number'] for c in res['result']]
+        assert res['cursor'] > max(serials)
+
+        res = api.Command['cert_find'](sizelimit=2, cursor=res['cursor'])
+        assert res['count'] >= 1
+        assert min(c['serial_number'] for c in res['result']) > max(serials)
+
+    def test_0033_search_pkey_only(self):
+        """
+        Search for serial numbers and status only
+        """
+        res = api.Command['cert_find'](sizelimit=10, pkey_only=True)
+        assert res['count'] >= 1
+        for cert in res['result']:
+            assert 'subject' not in cert
+            assert 'status' in cert
+
+
+class FakeEnv(object):
+    context = 'server'
+    ra_pool_size = 4
+
+
+class FakeAPI(object):
+    env = FakeEnv()
+
+
+class FakeRA(object):
+    def __init__(self, implemented=True):
+        self.implemented = implemented
+        self.initialized = False
+
+    def init_nss(self):
+        if not self.implemented:
+            raise errors.NotImplementedError(name='ra.init_nss')
+        self.initialized = True
+
+
+class FakeLDAP(object):
+    def connect(self, ccache=None):
+        pass
+
+
+class FakeBackend(object):
+    def __init__(self, ra):
+        self.ra = ra
+        self.ldap2 = FakeLDAP()
+
+
+class test_cert_request_bulk_workers(object):
+    """
+    Test issuing the certificates of cert_request_bulk from worker threads.
+    """
+    def setup(self):
+        self.ccache = os.environ.get('KRB5CCNAME')
+        os.environ['KRB5CCNAME'] = 'FILE:/tmp/krb5cc_test'
+        self.lock = threading.Lock()
+        self.issued = []
+        self.parallel = threading.Event()
+
+    def teardown(self):
+        if self.ccache is None:
+            del os.environ['KRB5CCNAME']
+        else:
+            os.environ['KRB5CCNAME'] = self.ccache
+
+    def issue(self, ra, request, wait):
+        with self.lock:
+            self.issued.append(
+                (request, threading.current_thread(), ra.initialized))
+            if len(set(t for r, t, i in self.issued)) > 1:
+                self.parallel.set()
+        if wait:
+            # keep the first worker busy until another one takes a request
+            self.parallel.wait(5)
+
+    def run(self, ra, wait):
+        cmd = cert_request_bulk()
+        cmd.set_api(FakeAPI())
+        cmd.Backend = FakeBackend(ra)
+        cmd._issue_certificates(
+            range(8), lambda request: self.issue(ra, request, wait))
+
+    def test_parallel(self):
+        ra = FakeRA()
+        self.run(ra, True)
+        assert sorted(r for r, t, i in self.issued) == range(8)
+        threads = set(t for r, t, i in self.issued)
+        assert len(threads) > 1
+        assert threading.current_thread() not in threads
+        # NSS was initialized before any worker connected to the CA
+        assert all(i for r, t, i in self.issued)
+
+    def test_serial(self):
+        # without a way to initialize NSS up front the requests are issued
+        # one by one
+        self.run(FakeRA(implemented=False), False)
+        assert [r for r, t, i in self.issued] == range(8)
+        assert (set(t for r, t, i in self.issued) ==
+                set([threading.current_thread()]))
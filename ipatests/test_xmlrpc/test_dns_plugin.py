@@ -22,6 +22,7 @@ Test the `ipalib/plugins/dns.py` module.
 
 import nose
 from ipalib import api, errors
+from ipalib.plugins.dns import DNSZoneTree, DNSZoneTreeCache
 from ipalib.util import normalize_zone
 from ipapython.dnsutil import DNSName
 from ipapython.dn import DN
@@ -5887,3 +5888,101 @@ class test_dns_soa(Declarative):
                        zone6_unresolvable_ns_dnsname,),
         ),
     ]
+
+
+class test_DNSZoneTree(object):
+    """
+    Test the longest match lookups of zones and delegations.
+    """
+    def setup(self):
+        self.example = DNSName(u'example.com.')
+        self.sub = DNSName(u'sub.example.com.')
+        # zones created by IPA < 4.0 are stored without the trailing dot
+        self.old = DNSName(u'old.example.com')
+        self.inactive = DNSName(u'inactive.example.com.')
+        self.reverse = DNSName(u'1.168.192.in-addr.arpa.')
+
+        self.tree = DNSZoneTree()
+        self.tree.add_zone(self.example, True)
+        self.tree.add_zone(self.sub, True)
+        self.tree.add_zone(self.old, True)
+        self.tree.add_zone(self.inactive, False)
+        self.tree.add_zone(self.reverse, False)
+
+        self.tree.add_delegation(self.example, DNSName(u'child'))
+        self.tree.add_delegation(
+            self.example, DNSName(u'deep.child.example.com.'))
+        self.tree.add_delegation(self.sub, DNSName(u'other'))
+        self.tree.add_delegation(self.example, _dns_zone_record)
+
+    def find_zone(self, name, **kw):
+        return self.tree.find_zone(DNSName(name), **kw)
+
+    def find_delegation(self, zone, name):
+        return self.tree.find_delegation(zone, DNSName(name))
+
+    def test_find_zone(self):
+        assert self.find_zone(u'example.com.') is self.example
+        assert self.find_zone(u'www.example.com.') is self.example
+        assert self.find_zone(u'www.sub.example.com.') is self.sub
+        assert self.find_zone(u'www.old.example.com.') is self.old
+        assert self.find_zone(u'example.org.') is None
+        assert self.find_zone(u'com.') is None
+
+    def test_find_zone_relative_name(self):
+        assert self.find_zone(u'WWW.Sub.Example.COM') is self.sub
+
+    def test_find_zone_inactive(self):
+        assert (self.find_zone(u'www.inactive.example.com.') is
+                self.example)
+        assert (self.find_zone(u'www.inactive.example.com.',
+                               active_only=False) is self.inactive)
+        assert self.find_zone(u'5.1.168.192.in-addr.arpa.') is None
+        assert (self.find_zone(u'5.1.168.192.in-addr.arpa.',
+                               active_only=False) is self.reverse)
+
+    def test_find_delegation(self):
+        example = DNSName(u'example.com')
+        assert (self.find_delegation(example, u'child.example.com.') ==
+                DNSName(u'child'))
+        assert (self.find_delegation(example, u'ns.child.example.com.') ==
+                DNSName(u'child'))
+        assert (self.find_delegation(example,
+                                     u'ns.deep.child.example.com.') ==
+                DNSName(u'deep.child'))
+        assert (self.find_delegation(self.sub, u'ns.other.sub.example.com.')
+                == DNSName(u'other'))
+
+    def test_find_delegation_none(self):
+        # NS records in zone apex are not delegations
+        assert self.find_delegation(self.example, u'example.com.') is None
+        assert self.find_delegation(self.example, u'www.example.com.') is None
+        # delegations of other zones do not match
+        assert (self.find_delegation(self.example,
+                                     u'ns.other.sub.example.com.') is None)
+        assert (self.find_delegation(self.sub, u'ns.child.example.com.')
+                is None)
+
+
+class test_DNSZoneTreeCache(object):
+    def test_versions(self):
+        cache = DNSZoneTreeCache()
+        tree = DNSZoneTree()
+        version = frozenset([(DN(('idnsname', 'example.com.')), '1')])
+        assert cache.get(version) is None
+
+        cache.set(version, tree, ('admin@EXAMPLE.COM', '10'))
+        assert cache.lookup(('admin@EXAMPLE.COM', '10')) is tree
+        # something was written or another principal asks, the version
+        # must be checked again
+        assert cache.lookup(('admin@EXAMPLE.COM', '11')) is None
+        assert cache.lookup(('user@EXAMPLE.COM', '10')) is None
+        assert cache.lookup(None) is None
+
+        assert cache.get(frozenset()) is None
+        assert cache.get(version, ('user@EXAMPLE.COM', '11')) is tree
+        assert cache.lookup(('user@EXAMPLE.COM', '11')) is tree
+        assert cache.lookup(('admin@EXAMPLE.COM', '10')) is None
+
+        cache.clear()
+        assert cache.get(version) is None
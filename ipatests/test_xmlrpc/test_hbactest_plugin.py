@@ -26,6 +26,8 @@ from ipalib import api
 from ipalib import errors
 from types import NoneType
 from nose.tools import raises
+import pyhbac
+from ipalib.plugins.hbactest import HBACRuleSet, convert_to_ipa_rule
 
 # Test strategy:
 # 1. Create few allow rules: with user categories, with explicit users, with user groups, with groups, with services
@@ -198,6 +200,42 @@ class test_hbactest(XMLRPC_test):
             nodetail=True
         )
 
+    def test_f_hbactest_batch(self):
+        """
+        Test 'ipa hbactest-batch' with a cross product and a single request
+        """
+        ret = api.Command['hbactest_batch'](
+            user=[self.test_user],
+            targethost=[self.test_host, self.test_sourcehost],
+            service=[self.test_service],
+            request=[u'%s:%s:%s' % (self.test_user, self.test_host,
+                                    self.test_service)],
+            rules=self.rule_names,
+        )
+        assert ret['count'] == 3
+        (single, host, sourcehost) = ret['results']
+        assert single['value'] == True
+        assert sorted(single['matched']) == sorted(self.rule_names)
+        assert host['targethost'] == self.test_host
+        assert host['value'] == True
+        assert sourcehost['targethost'] == self.test_sourcehost
+        assert sourcehost['value'] == False
+        assert sourcehost['matched'] == []
+
+    def test_f_hbactest_batch_enabled(self):
+        """
+        Test 'ipa hbactest-batch' with all enabled IPA rules
+        """
+        ret = api.Command['hbactest_batch'](
+            request=[u'%s:%s:%s' % (self.test_user, self.test_host,
+                                    self.test_service)],
+        )
+        matched = ret['results'][0]['matched']
+        for i in [0,2]:
+            assert self.rule_names[i] in matched
+        for i in [1,3]:
+            assert self.rule_names[i] not in matched
+
     def test_g_hbactest_clear_testing_data(self):
         """
         Clear data for HBAC test plugin testing.
@@ -215,3 +253,119 @@ class test_hbactest(XMLRPC_test):
         api.Command['hostgroup_del'](self.test_sourcehostgroup)
         api.Command['hbacsvc_del'](self.test_service)
 
+
+
+class test_HBACRuleSet(object):
+    """
+    Test that `HBACRuleSet.match` agrees with pyhbac.
+    """
+    rules = [
+        dict(cn=[u'allow_all'], ipaenabledflag=[True],
+             usercategory=[u'all'], hostcategory=[u'all'],
+             servicecategory=[u'all']),
+        dict(cn=[u'disabled_all'], ipaenabledflag=[False],
+             usercategory=[u'all'], hostcategory=[u'all'],
+             servicecategory=[u'all']),
+        dict(cn=[u'mixed_case'], ipaenabledflag=[True],
+             memberuser_user=[u'Alice'], memberuser_group=[u'Admins'],
+             memberhost_host=[u'Web1.Example.COM'],
+             memberhost_hostgroup=[u'WebServers'],
+             memberservice_hbacsvc=[u'SSHD']),
+        dict(cn=[u'disabled_db'], ipaenabledflag=[False],
+             usercategory=[u'all'], memberhost_host=[u'db.example.com'],
+             memberservice_hbacsvcgroup=[u'Sudo']),
+        dict(cn=[u'non_ascii'], ipaenabledflag=[True],
+             memberuser_group=[u'Stra\xdfe'], hostcategory=[u'all'],
+             servicecategory=[u'all']),
+        dict(cn=[u'malformed'], ipaenabledflag=[True],
+             memberuser_user=['\xff\xfe'], hostcategory=[u'all'],
+             servicecategory=[u'all']),
+        dict(cn=[u'empty'], ipaenabledflag=[True],
+             hostcategory=[u'all'], servicecategory=[u'all']),
+    ]
+
+    users = [
+        (u'alice', []),
+        (u'bob', [u'ADMINS']),
+        (u'carol', [u'STRASSE', u'stra\xdfe']),
+        (u'\xc9mile', []),
+        (None, []),
+    ]
+    targethosts = [
+        (u'web1.example.com', []),
+        (u'web2.example.com', [u'webservers']),
+        (u'DB.example.com', []),
+        (None, []),
+    ]
+    services = [
+        (u'sshd', [u'sudo']),
+        (u'login', []),
+        (None, []),
+    ]
+
+    def evaluate(self, ipa_rules, user, targethost, service):
+        request = pyhbac.HbacRequest()
+        for (element, (name, groups)) in (('user', user),
+                                          ('targethost', targethost),
+                                          ('service', service)):
+            if name is not None:
+                getattr(request, element).name = name
+                getattr(request, element).groups = groups
+        matched = []
+        failed = []
+        for (i, ipa_rule) in enumerate(ipa_rules):
+            try:
+                if request.evaluate([ipa_rule]) == pyhbac.HBAC_EVAL_ALLOW:
+                    matched.append(i)
+            except pyhbac.HbacError:
+                failed.append(i)
+        return (matched, failed)
+
+    def check(self, positions, ipa_rules):
+        ruleset = HBACRuleSet(self.rules)
+        for user in self.users:
+            for targethost in self.targethosts:
+                for service in self.services:
+                    expected = self.evaluate(ipa_rules, user, targethost,
+                                             service)
+                    result = ruleset.match(positions, user, targethost,
+                                           service)
+                    assert result == expected, (user, targethost, service)
+
+    def test_enabled(self):
+        """
+        Test the enabled rules, disabled rules never match
+        """
+        ruleset = HBACRuleSet(self.rules)
+        assert ruleset.select() == [0, 2, 4, 5, 6]
+        self.check(ruleset.select(),
+                   [convert_to_ipa_rule(rule) for rule in self.rules])
+
+    def test_all(self):
+        """
+        Test the enabled and disabled rules, enabled for the test
+        """
+        ruleset = HBACRuleSet(self.rules)
+        positions = ruleset.select(enabled=True, disabled=True)
+        assert positions == range(len(self.rules))
+        self.check(positions, ruleset.ipa_rules)
+
+    def test_match(self):
+        """
+        Test the rules matched by mixed case and non-ASCII requests
+        """
+        ruleset = HBACRuleSet(self.rules)
+        positions = ruleset.select()
+        assert ruleset.match(positions, (u'ALICE', []),
+                             (u'web1.example.com', []),
+                             (u'sshd', [])) == ([0, 2], [5])
+        assert ruleset.match(positions, (u'bob', [u'admins']),
+                             (u'web9.example.com', [u'WEBSERVERS']),
+                             (u'sshd', [])) == ([0, 2], [5])
+        assert ruleset.match(positions, (None, []), (None, []),
+                             (None, [])) == ([0], [])
+        (matched, failed) = ruleset.match(positions,
+                                          (u'carol', [u'stra\xdfe']),
+                                          (None, []), (None, []))
+        assert 4 in matched
+        assert failed == [5]
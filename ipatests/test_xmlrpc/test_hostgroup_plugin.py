@@ -39,6 +39,8 @@ fqdn1 = u'testhost1.%s' % api.env.domain
 host_dn1 = DN(('fqdn',fqdn1),('cn','computers'),('cn','accounts'),
               api.env.basedn)
 
+fqdn_notfound = u'notfound.%s' % api.env.domain
+
 invalidhostgroup1 = u'@invalid'
 
 
@@ -167,6 +169,34 @@ class test_hostgroup(Declarative):
         ),
 
 
+        dict(
+            desc=u'Try to add hosts %r and %r to %r' % (
+                fqdn1, fqdn_notfound, hostgroup1),
+            command=(
+                'hostgroup_add_member', [hostgroup1],
+                dict(host=[fqdn1, fqdn_notfound])
+            ),
+            expected=dict(
+                completed=0,
+                failed=dict(
+                    member=dict(
+                        host=[
+                            (fqdn1, u'This entry is already a member'),
+                            (fqdn_notfound, u'no such entry'),
+                        ],
+                        hostgroup=tuple(),
+                    ),
+                ),
+                result={
+                    'dn': dn1,
+                    'cn': [hostgroup1],
+                    'description': [u'Test hostgroup 1'],
+                    'member_host': [fqdn1],
+                },
+            ),
+        ),
+
+
         dict(
             desc='Retrieve %r' % hostgroup1,
             command=('hostgroup_show', [hostgroup1], {}),
@@ -257,6 +287,31 @@ class test_hostgroup(Declarative):
         ),
 
 
+        dict(
+            desc='Try to remove host %r from %r again' % (fqdn1, hostgroup1),
+            command=('hostgroup_remove_member', [hostgroup1],
+                dict(host=[fqdn1, fqdn1])
+            ),
+            expected=dict(
+                failed=dict(
+                    member=dict(
+                        host=[
+                            (fqdn1, u'This entry is not a member'),
+                            (fqdn1, u'This entry is not a member'),
+                        ],
+                        hostgroup=tuple(),
+                    ),
+                ),
+                completed=0,
+                result={
+                    'dn': dn1,
+                    'cn': [hostgroup1],
+                    'description': [u'Updated hostgroup 1'],
+                },
+            ),
+        ),
+
+
         dict(
             desc='Delete %r' % hostgroup1,
             command=('hostgroup_del', [hostgroup1], {}),
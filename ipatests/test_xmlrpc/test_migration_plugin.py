@@ -0,0 +1,161 @@
+# Copyright (C) 2015  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the `ipalib.plugins.migration` module.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from ipalib.plugins import migration
+from ipapython.dn import DN
+
+
+class test_MigrationCheckpoint(object):
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'checkpoint')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume(self):
+        checkpoint = migration.MigrationCheckpoint(self.path)
+        checkpoint.load()
+        assert checkpoint.get('user') == frozenset()
+        checkpoint.add('user', u'alice')
+        checkpoint.add('user', u'j\xfcrgen')
+        checkpoint.add('group', u'admins')
+        checkpoint.close()
+
+        # the previous run died while writing a line
+        with open(self.path, 'a') as f:
+            f.write('user\tbo')
+
+        checkpoint = migration.MigrationCheckpoint(self.path)
+        checkpoint.load()
+        assert checkpoint.get('user') == set([u'alice', u'j\xfcrgen'])
+        assert checkpoint.get('group') == set([u'admins'])
+        checkpoint.add('user', u'bob')
+        checkpoint.close()
+
+        checkpoint = migration.MigrationCheckpoint(self.path)
+        checkpoint.load()
+        assert checkpoint.get('user') == set([u'alice', u'j\xfcrgen', u'bob'])
+
+        # a complete migration removes the file
+        checkpoint.remove()
+        assert not os.path.exists(self.path)
+        checkpoint.remove()
+
+    def test_for_source(self):
+        base_dn = DN(('dc', 'example'), ('dc', 'com'))
+        searches = [
+            ('user', DN(('ou', 'people'), base_dn),
+             u'(&(|(objectclass=person))(uid=*))'),
+            ('group', DN(('ou', 'groups'), base_dn),
+             u'(&(|(objectclass=groupOfNames))(cn=*))'),
+        ]
+
+        def path(ldapuri, searches):
+            return migration.MigrationCheckpoint.for_source(
+                ldapuri, base_dn, searches).path
+
+        assert (path(u'ldap://ds.example.com', searches) ==
+                path(u'LDAP://DS.example.com', list(reversed(searches))))
+        assert (path(u'ldap://ds.example.com', searches) !=
+                path(u'ldap://ds2.example.com', searches))
+
+        # other containers or filters are another migration
+        other = [searches[0],
+                 ('group', DN(('ou', 'teams'), base_dn), searches[1][2])]
+        assert (path(u'ldap://ds.example.com', searches) !=
+                path(u'ldap://ds.example.com', other))
+        other = [searches[0],
+                 ('group', searches[1][1],
+                  u'(&(|(objectclass=posixGroup))(cn=*))')]
+        assert (path(u'ldap://ds.example.com', searches) !=
+                path(u'ldap://ds.example.com', other))
+
+
+class test_migrate_ds_pipeline(object):
+    def setup(self):
+        self.cmd = migration.migrate_ds()
+        self.cmd.queue_size_per_worker = 1
+        self.lock = threading.Lock()
+        self.processed = []
+        self.connected = []
+        self.read = [0]
+
+    def items(self, count):
+        for i in xrange(count):
+            self.read[0] += 1
+            yield (i, str(i))
+
+    def process(self, i, value):
+        assert value == str(i)
+        with self.lock:
+            self.processed.append(i)
+
+    def connect(self):
+        with self.lock:
+            self.connected.append(threading.current_thread())
+
+    def test_serial(self):
+        self.cmd._run_pipeline(self.items(10), self.process, 1, self.connect)
+        assert self.processed == range(10)
+        assert self.connected == []
+
+    def test_parallel(self):
+        self.cmd._run_pipeline(self.items(100), self.process, 4, self.connect)
+        assert sorted(self.processed) == range(100)
+        assert len(set(self.connected)) == 4
+
+    def test_failure(self):
+        def process(i, value):
+            if i == 5:
+                raise ValueError(i)
+            self.process(i, value)
+
+        try:
+            self.cmd._run_pipeline(self.items(10000), process, 4,
+                                   self.connect)
+        except ValueError, e:
+            assert e.args == (5,)
+        else:
+            assert False, 'failure in a worker was not raised'
+
+        # the reader stopped early and the queue was drained, so the
+        # pipeline did not block
+        assert 5 not in self.processed
+        assert self.read[0] < 10000
+
+    def test_connect_failure(self):
+        def connect():
+            raise RuntimeError('cannot connect')
+
+        try:
+            self.cmd._run_pipeline(self.items(10000), self.process, 2,
+                                   connect)
+        except RuntimeError, e:
+            assert e.args == ('cannot connect',)
+        else:
+            assert False, 'connection failure was not raised'
+        assert self.processed == []
+        assert self.read[0] < 10000
@@ -539,6 +539,59 @@ class test_nesting(Declarative):
         ),
 
 
+        dict(
+            desc='Search for groups %r - %r' % (group1, group4),
+            command=('group_find', [u'testgroup'], {}),
+            expected=dict(
+                count=4,
+                truncated=False,
+                summary=u'4 groups matched',
+                result=[
+                    dict(
+                        cn=[group1],
+                        description=[u'Test desc 1'],
+                        gidnumber= [fuzzy_digits],
+                        memberindirect_group = [group4],
+                        member_group = [group2, group3],
+                        memberindirect_user = [user1, user2, user3, user4],
+                        dn=DN(('cn','testgroup1'),('cn','groups'),
+                              ('cn','accounts'),api.env.basedn),
+                    ),
+                    dict(
+                        cn=[group2],
+                        description=[u'Test desc 2'],
+                        gidnumber= [fuzzy_digits],
+                        memberof_group = [group1],
+                        member_user = [user1, user2],
+                        dn=DN(('cn','testgroup2'),('cn','groups'),
+                              ('cn','accounts'),api.env.basedn),
+                    ),
+                    dict(
+                        cn=[group3],
+                        description=[u'Test desc 3'],
+                        gidnumber= [fuzzy_digits],
+                        memberof_group = [group1],
+                        member_user = [user3],
+                        member_group = [group4],
+                        memberindirect_user = [user1, user4],
+                        dn=DN(('cn','testgroup3'),('cn','groups'),
+                              ('cn','accounts'),api.env.basedn),
+                    ),
+                    dict(
+                        cn=[group4],
+                        description=[u'Test desc 4'],
+                        gidnumber= [fuzzy_digits],
+                        memberof_group = [group3],
+                        member_user = [user1, user4],
+                        memberofindirect_group = [group1],
+                        dn=DN(('cn','testgroup4'),('cn','groups'),
+                              ('cn','accounts'),api.env.basedn),
+                    ),
+                ],
+            ),
+        ),
+
+
         # Now do something similar with hosts and hostgroups
         dict(
             desc='Create host %r' % fqdn1,
@@ -28,7 +28,7 @@ import nose
 
 from ipalib import api, errors
 from ipatests.test_xmlrpc import objectclasses
-from xmlrpc_test import Declarative
+from xmlrpc_test import Declarative, paged_find_test
 from ipapython.dn import DN
 import inspect
 
@@ -2867,6 +2867,11 @@ class test_permission_legacy(Declarative):
                 result=check_legacy_results,
             ),
         ),
+
+        # the legacy permissions are added by a post callback, the result
+        # must be paged after it
+        paged_find_test('permission_find', [],
+                        {'ipapermlocation': api.env.basedn}, limit=3),
     ]
 
 
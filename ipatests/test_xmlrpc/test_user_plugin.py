@@ -32,7 +32,7 @@ from ipatests.test_xmlrpc import objectclasses
 from ipatests.util import assert_equal, assert_not_equal, raises
 from xmlrpc_test import (XMLRPC_test, Declarative, fuzzy_digits, fuzzy_uuid,
                          fuzzy_password, fuzzy_string, fuzzy_dergeneralizedtime,
-                         add_sid, add_oc)
+                         add_sid, add_oc, paged_find_test)
 from ipapython.dn import DN
 
 user1 = u'tuser1'
@@ -1602,6 +1602,35 @@ class test_user(Declarative):
     ]
 
 
+paged_users = [u'tpage-b', u'tpage10', u'tpage9', u'tpage_a', u'tpage-a2']
+
+
+def paged_user_added(e, result):
+    return e is None and result['value'] in paged_users
+
+
+class test_user_paging(Declarative):
+
+    cleanup_commands = [
+        ('user_del', paged_users, {'continue': True}),
+    ]
+
+    tests = [
+        dict(
+            desc='Create "%s"' % uid,
+            command=('user_add', [uid], dict(givenname=u'Test', sn=u'Page')),
+            expected=paged_user_added,
+        )
+        for uid in paged_users
+    ] + [
+        # all the users, sorted and paged by the server
+        paged_find_test('user_find'),
+        paged_find_test('user_find', limit=3),
+        # the users with criteria, sorted and paged after the search
+        paged_find_test('user_find', [u'tpage']),
+    ]
+
+
 class test_denied_bind_with_expired_principal(XMLRPC_test):
 
     password = u'random'
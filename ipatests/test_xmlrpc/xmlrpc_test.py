@@ -367,3 +367,31 @@ def raises_exact(expected_exception):
         assert expected_exception.strerror == got_exception.strerror
     else:
         raise AssertionError('did not raise!')
+
+
+def paged_find_test(command, args=(), options=None, limit=2):
+    """Return a Declarative test of the offset and limit options of a search
+
+    The test reads the result of the search page by page and checks that the
+    pages add up to the result of the search without offset and limit,
+    sorted the same way.
+    """
+    options = dict(options or {}, pkey_only=True)
+
+    def test_pages(declarative):
+        cmd = api.Command[command]
+        pkey = cmd.obj.primary_key.name
+        result = cmd(*args, **options)
+        assert not result['truncated']
+        assert 'total' not in result
+        expected = [entry[pkey][0] for entry in result['result']]
+        assert expected, '%s found nothing' % command
+
+        got = []
+        for offset in range(0, len(expected) + limit, limit):
+            result = cmd(*args, offset=offset, limit=limit, **options)
+            assert result['total'] == len(expected), result
+            assert result['count'] == len(result['result']) <= limit, result
+            got.extend(entry[pkey][0] for entry in result['result'])
+        assert got == expected, (got, expected)
+    return test_pages